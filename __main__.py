@@ -1,5 +1,13 @@
-from app.mainapp import NovelTTSApp
+import os
+import sys
+from app.metrics import PROFILE_ENV, profile_to
 
 if __name__ == "__main__":
-    app = NovelTTSApp()
-    app.run()
\ No newline at end of file
+    # NOVEL_TTS_PROFILE=novel-tts.prof python . ...
+    with profile_to(os.environ.get(PROFILE_ENV)):
+        if len(sys.argv) > 1:
+            from app.cli import main
+            sys.exit(main())
+        from app.mainapp import NovelTTSApp
+        app = NovelTTSApp()
+        app.run()
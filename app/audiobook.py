@@ -0,0 +1,315 @@
+"""
+Join chapter MP3 files into one audiobook without decoding, frame by frame.
+
+The chapter index is written as ID3v2.4 CHAP/CTOC frames at the start of the audiobook,
+and as a CUE sheet beside it. The chapter LRC files are merged into one, shifted by the
+duration of the chapters before. Files are read and written in small buffers, memory does
+not grow with the length of the book.
+"""
+import re
+from dataclasses import dataclass
+from os import PathLike, remove, replace
+from os.path import exists
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator
+from app.chapter_store import ChapterStore
+from app.mp3 import parse_frame_header, skip_id3v2
+from app.tts_cache import unique_tmp_path
+from app.tts_engine import chapter_file_stem
+
+READ_BUFFER_BYTES = 64 * 1024
+WRITE_BUFFER_BYTES = 1024 * 1024
+# entry count of a CTOC frame is one byte
+CTOC_MAX_ENTRIES = 255
+# VBR header frames of encoders, wrong for the joined file
+VBR_HEADER_TAGS = (b"Xing", b"Info", b"VBRI")
+LRC_LINE_RE = re.compile(r"^\[(\d+):(\d{2})(?:\.(\d{1,3}))?\](.*)$")
+
+
+@dataclass
+class BookChapter:
+    title: str
+    mp3_path: Path
+    lrc_path: Path | None = None
+
+
+@dataclass
+class ChapterMark:
+    title: str
+    start_ms: int
+    end_ms: int
+
+
+def find_book_chapters(chapters: ChapterStore, output_dir: PathLike | str) -> tuple[list[BookChapter], int]:
+    """
+    Returns the converted chapters in the output directory, and the number of chapters not converted.
+    """
+    found: list[BookChapter] = []
+    missing = 0
+    for index in range(len(chapters)):
+        title = chapters.title(index)
+        stem = chapter_file_stem(index, title)
+        mp3_path = Path(output_dir) / f"{stem}.mp3"
+        if exists(mp3_path):
+            found.append(BookChapter(title, mp3_path, Path(output_dir) / f"{stem}.lrc"))
+        else:
+            missing += 1
+    return found, missing
+
+
+def read_id3v2_size(file: BinaryIO) -> int:
+    """
+    Size of the ID3v2 tag at the current position of the file, the position is not changed.
+    """
+    pos = file.tell()
+    head = file.read(10)
+    file.seek(pos)
+    return skip_id3v2(head)
+
+
+def is_vbr_header_frame(frame: bytes) -> bool:
+    return any(frame.find(tag, 4, 64) >= 0 for tag in VBR_HEADER_TAGS)
+
+
+def iter_frame_runs(file: BinaryIO) -> Iterator[tuple[bytes, int, int]]:
+    """
+    Iterate over runs of consecutive MPEG audio layer III frames of a file, reading it in small buffers.
+    Garbage between frames and a VBR header frame at the start are skipped.
+
+    Yields:
+        tuple[bytes, int, int]: (data of whole frames, samples, sample rate)
+    """
+    file.seek(read_id3v2_size(file), 1)
+    buffer = bytearray()
+    first = True
+    while True:
+        block = file.read(READ_BUFFER_BYTES)
+        if len(block) <= 0:
+            return
+        buffer.extend(block)
+        pos = 0
+        run_start = 0
+        run_samples = 0
+        run_rate = 0
+        while pos + 4 <= len(buffer):
+            header = parse_frame_header(buffer, pos)
+            if header != None:
+                length, samples, sample_rate = header
+                if pos + length > len(buffer):
+                    break
+                if first:
+                    first = False
+                    if is_vbr_header_frame(buffer[pos:pos + length]):
+                        pos += length
+                        run_start = pos
+                        continue
+                if sample_rate == run_rate or run_samples == 0:
+                    pos += length
+                    run_samples += samples
+                    run_rate = sample_rate
+                    continue
+            if run_samples > 0:
+                yield bytes(buffer[run_start:pos]), run_samples, run_rate
+                run_samples = 0
+            if header == None:
+                pos += 1
+            run_start = pos
+        if run_samples > 0:
+            yield bytes(buffer[run_start:pos]), run_samples, run_rate
+        del buffer[:pos]
+
+
+def scan_mp3_samples(mp3_path: PathLike | str) -> tuple[int, int]:
+    """
+    Returns (samples, sample rate) of a MP3 file.
+    """
+    total = 0
+    rate = 0
+    with open(mp3_path, "rb") as file:
+        for _, samples, sample_rate in iter_frame_runs(file):
+            if rate != 0 and sample_rate != rate:
+                raise ValueError(f"sample rate changes in the MP3 file: {mp3_path}")
+            total += samples
+            rate = sample_rate
+    return total, rate
+
+
+# ======== ID3 ========
+
+def syncsafe(value: int) -> bytes:
+    return bytes(((value >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+
+
+def id3_frame(frame_id: bytes, data: bytes) -> bytes:
+    return frame_id + syncsafe(len(data)) + b"\x00\x00" + data
+
+
+def id3_text_frame(frame_id: bytes, text: str) -> bytes:
+    # 3: UTF-8
+    return id3_frame(frame_id, b"\x03" + text.encode("utf-8"))
+
+
+def make_chapter_tag(title: str, marks: list[ChapterMark]) -> bytes:
+    """
+    ID3v2.4 tag with the book title and CHAP frames, indexed by CTOC frames.
+    More than 255 chapters are grouped into child tables of contents.
+    """
+    frames = [id3_text_frame(b"TIT2", title)]
+    chapter_ids = [f"chp{index}".encode("ascii") for index in range(len(marks))]
+    for chapter_id, mark in zip(chapter_ids, marks):
+        frames.append(id3_frame(b"CHAP", (
+            chapter_id + b"\x00"
+            + mark.start_ms.to_bytes(4, "big") + mark.end_ms.to_bytes(4, "big")
+            + b"\xff\xff\xff\xff\xff\xff\xff\xff"
+            + id3_text_frame(b"TIT2", mark.title)
+        )))
+
+    def ctoc(element_id: bytes, top_level: bool, children: list[bytes], subframes: bytes = b"") -> bytes:
+        flags = (0x02 if top_level else 0) | 0x01
+        return id3_frame(b"CTOC", (
+            element_id + b"\x00" + bytes([flags, len(children)])
+            + b"".join(child + b"\x00" for child in children) + subframes
+        ))
+
+    if len(chapter_ids) <= CTOC_MAX_ENTRIES:
+        frames.append(ctoc(b"toc", True, chapter_ids, id3_text_frame(b"TIT2", title)))
+    else:
+        groups = [
+            chapter_ids[pos:pos + CTOC_MAX_ENTRIES]
+            for pos in range(0, len(chapter_ids), CTOC_MAX_ENTRIES)
+        ]
+        group_ids = [f"toc{index}".encode("ascii") for index in range(len(groups))]
+        frames.append(ctoc(b"toc", True, group_ids, id3_text_frame(b"TIT2", title)))
+        for group_id, group in zip(group_ids, groups):
+            frames.append(ctoc(group_id, False, group))
+    body = b"".join(frames)
+    return b"ID3\x04\x00\x00" + syncsafe(len(body)) + body
+
+
+# ======== sidecars ========
+
+def cue_timestamp(time_ms: int) -> str:
+    # frames of 1/75 second
+    frames = time_ms * 75 // 1000
+    return f"{frames // (75 * 60):02d}:{frames // 75 % 60:02d}:{frames % 75:02d}"
+
+
+def make_cue_sheet(title: str, mp3_name: str, marks: list[ChapterMark]) -> str:
+    def quote(text: str) -> str:
+        return text.replace('"', "'")
+
+    lines = [f'TITLE "{quote(title)}"', f'FILE "{quote(mp3_name)}" MP3']
+    for index, mark in enumerate(marks):
+        lines.append(f"  TRACK {index + 1:02d} AUDIO")
+        lines.append(f'    TITLE "{quote(mark.title)}"')
+        lines.append(f"    INDEX 01 {cue_timestamp(mark.start_ms)}")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def lrc_timestamp(time_ms: int) -> str:
+    """
+    LRC timestamp with minutes over 99, books are longer than chapters.
+    """
+    return f"{time_ms // 60000:02d}:{time_ms // 1000 % 60:02d}.{time_ms // 10 % 100:02d}"
+
+
+def write_shifted_lrc(src: Path, dst, offset_ms: int):
+    """
+    Copy the lines of a LRC file, shifting the timestamps by offset_ms.
+    """
+    with open(src, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            mt = LRC_LINE_RE.match(line)
+            if mt == None:
+                if line.strip() != "":
+                    dst.write(line + "\r\n")
+                continue
+            minute, sec, fraction, text = mt.groups()
+            ms = int((fraction or "0").ljust(3, "0"))
+            time_ms = (int(minute) * 60 + int(sec)) * 1000 + ms + offset_ms
+            dst.write(f"[{lrc_timestamp(time_ms)}]{text}\r\n")
+
+
+# ======== assemble ========
+
+def assemble_audiobook(
+    chapters: list[BookChapter],
+    mp3_path: PathLike | str,
+    title: str = "",
+    lrc_path: PathLike | str | None = None,
+    cue_path: PathLike | str | None = None,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> list[ChapterMark]:
+    """
+    Join the chapters into one MP3 file with a chapter index, without re-encoding.
+
+    The chapter durations are counted from the frame headers first, so the ID3 chapter index
+    can be written before the audio. Outputs are written to temporary files and renamed when finished.
+
+    Args:
+        chapters (list[BookChapter]): Chapters in order, the MP3 files must have the same format.
+        mp3_path (PathLike | str): Output audiobook.
+        title (str): Book title.
+        lrc_path (PathLike | str | None): Output merged LRC, from the LRC files of the chapters.
+        cue_path (PathLike | str | None): Output CUE sheet.
+        on_progress (Callable[[int, int], None]): Called with (finished, total) chapters.
+
+    Returns:
+        list[ChapterMark]: Start and end of each chapter.
+    """
+    marks: list[ChapterMark] = []
+    total_samples = 0
+    book_rate = 0
+    for chapter in chapters:
+        samples, sample_rate = scan_mp3_samples(chapter.mp3_path)
+        if samples <= 0:
+            start_ms = total_samples * 1000 // book_rate if book_rate > 0 else 0
+            marks.append(ChapterMark(chapter.title, start_ms, start_ms))
+            continue
+        if book_rate != 0 and sample_rate != book_rate:
+            raise ValueError(f"MP3 format of chapter is different: {chapter.mp3_path}")
+        book_rate = sample_rate
+        start_ms = total_samples * 1000 // book_rate
+        total_samples += samples
+        marks.append(ChapterMark(chapter.title, start_ms, total_samples * 1000 // book_rate))
+
+    tmp_paths = []
+    try:
+        mp3_tmp_path = unique_tmp_path(mp3_path, "part")
+        tmp_paths.append(mp3_tmp_path)
+        lrc_file = None
+        if lrc_path != None:
+            lrc_tmp_path = unique_tmp_path(lrc_path, "part")
+            tmp_paths.append(lrc_tmp_path)
+            lrc_file = open(lrc_tmp_path, "wt", encoding="utf-8", newline="", buffering=WRITE_BUFFER_BYTES)
+        try:
+            with open(mp3_tmp_path, "wb", buffering=WRITE_BUFFER_BYTES) as out:
+                out.write(make_chapter_tag(title, marks))
+                for index, (chapter, mark) in enumerate(zip(chapters, marks)):
+                    with open(chapter.mp3_path, "rb") as file:
+                        for data, _, _ in iter_frame_runs(file):
+                            out.write(data)
+                    if lrc_file != None and chapter.lrc_path != None and exists(chapter.lrc_path):
+                        write_shifted_lrc(chapter.lrc_path, lrc_file, mark.start_ms)
+                    if on_progress != None:
+                        on_progress(index + 1, len(chapters))
+        finally:
+            if lrc_file != None:
+                lrc_file.close()
+        if cue_path != None:
+            cue_tmp_path = unique_tmp_path(cue_path, "part")
+            tmp_paths.append(cue_tmp_path)
+            with open(cue_tmp_path, "wt", encoding="utf-8", newline="") as f:
+                f.write(make_cue_sheet(title, Path(mp3_path).name, marks))
+    except BaseException:
+        for path in tmp_paths:
+            if exists(path):
+                remove(path)
+        raise
+    replace(mp3_tmp_path, mp3_path)
+    if lrc_path != None:
+        replace(lrc_tmp_path, lrc_path)
+    if cue_path != None:
+        replace(cue_tmp_path, cue_path)
+    return marks
@@ -0,0 +1,244 @@
+import codecs
+import mmap
+from os import PathLike
+from re import compile as re_compile
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+DEFAULT_CUT_CHAPTER_RE = (
+    r"^" +
+    r"(?:第\s{0,4})" +
+    r"([\d零一二三四五六七八九十百千万壹贰叁肆伍陆柒捌玖拾佰仟万ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩⅪⅫIVXLCDM]+?)" +
+    r"(?:" +
+    r"(?:\s{0,4}[集章篇节回段]\s{1,4}([^\s]{1,32}))" +
+    r"|" +
+    r"(?:[\s\.,、，]{1,4}([^\s]{1,32}))" +
+    r")" +
+    r"$"
+)
+ENCODINGS = ["utf-8", "gb18030", "gbk", "big5"]
+ENCODING_SAMPLE_BYTES = 256 * 1024
+PREVIEW_SAMPLE_BYTES = 1024 * 1024
+SCAN_BLOCK_BYTES = 4 * 1024 * 1024
+# 字数不够的不单独成章
+MIN_CHAPTER_CHARS = 100
+
+
+class ChapterSpan(NamedTuple):
+    title: str
+    # byte range in the source file
+    start: int
+    end: int
+
+
+def detect_encoding(
+    file: PathLike | str,
+    sample_bytes: int = ENCODING_SAMPLE_BYTES,
+    skip: Iterable[str] = (),
+) -> str | None:
+    """
+    Detect the text encoding from the first sample_bytes of the file.
+
+    Args:
+        skip (Iterable[str]): Encodings known not to decode the whole file.
+
+    Returns:
+        str | None: The first encoding in `ENCODINGS` that decodes the sample, None if nothing works.
+    """
+    skip = set(skip)
+    with open(file, "rb") as f:
+        sample = f.read(sample_bytes)
+        is_whole_file = len(f.read(1)) <= 0
+    if sample.startswith(codecs.BOM_UTF8) and "utf-8-sig" not in skip:
+        return "utf-8-sig"
+    for encoding in ENCODINGS:
+        if encoding in skip:
+            continue
+        decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+        try:
+            # the sample may end in the middle of a character
+            decoder.decode(sample, final=is_whole_file)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def iter_blocks(file: PathLike | str, encoding: str) -> Iterator[tuple[int, int, list[bytes], list[str]]]:
+    """
+    Scan the file through mmap, block by block, each block ends after a line break.
+
+    Yields:
+        tuple[int, int, list[bytes], list[str]]: (block start, block end, raw lines, decoded lines without line break)
+
+    Raises:
+        UnicodeError: If a block does not decode, characters are never replaced.
+    """
+    with open(file, "rb") as f:
+        if len(f.read(1)) <= 0:
+            # mmap does not support empty file
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            pos = 0
+            while pos < end:
+                block_end = min(pos + SCAN_BLOCK_BYTES, end)
+                if block_end < end:
+                    nl = mm.rfind(b"\n", pos, block_end)
+                    block_end = nl + 1 if nl >= 0 else mm.find(b"\n", block_end, end) + 1 or end
+                block = mm[pos:block_end]
+                # b"\n" is never a part of a multibyte character in the supported encodings,
+                # so the decoded lines and the raw lines are one to one.
+                raw_lines = block.split(b"\n")
+                try:
+                    text = block.decode(encoding)
+                except UnicodeDecodeError as e:
+                    raise UnicodeError(f"第{pos + e.start}字节无法以{encoding}解码") from e
+                text_lines = text.replace("\r\n", "\n").split("\n")
+                if block.endswith(b"\n"):
+                    # nothing after the last line break
+                    raw_lines.pop()
+                    text_lines.pop()
+                yield pos, block_end, raw_lines, text_lines
+                pos = block_end
+
+
+def iter_chapter_spans(
+    regexp: str,
+    file: PathLike | str,
+    encoding: str | None = None,
+    on_progress: Callable[[int], bool | None] | None = None,
+) -> Iterator[ChapterSpan]:
+    """
+    Split the file into chapters lazily, a line matching regexp begins a new chapter.
+    Memory usage does not grow with the file size.
+
+    Args:
+        regexp (str): Regular expression of the title line.
+        file (PathLike | str): Text file.
+        encoding (str | None): Text encoding, detected from the file if None.
+        on_progress (Callable[[int], bool | None]): Called with the scanned bytes after each block,
+            scanning stops if it returns True.
+
+    Raises:
+        re.error: If regexp is invalid.
+        UnicodeError: If encoding can not be detected, or a block does not decode.
+    """
+    reg = re_compile(regexp)
+    if encoding == None:
+        encoding = detect_encoding(file)
+        if encoding == None:
+            raise UnicodeError("无法识别文本编码")
+    title = None
+    chapter_start = 0
+    chapter_chars = 0
+    end = 0
+    for pos, end, raw_lines, text_lines in iter_blocks(file, encoding):
+        if title == None:
+            title = text_lines[0].strip()
+        last_index = 0
+        for index, line in enumerate(text_lines):
+            if chapter_chars >= MIN_CHAPTER_CHARS and reg.match(line) != None:
+                # 该行是标题
+                pos += sum(map(len, raw_lines[last_index:index])) + (index - last_index)
+                last_index = index
+                yield ChapterSpan(title, chapter_start, pos)
+                title = line.strip()
+                chapter_start = pos
+                chapter_chars = 0
+            chapter_chars += len(line)
+        if on_progress != None and on_progress(end):
+            return
+    # 最后一章
+    if title != None:
+        yield ChapterSpan(title, chapter_start, end)
+
+
+def split_chapter_spans(
+    regexp: str,
+    file: PathLike | str,
+    on_progress: Callable[[int, int], bool | None] | None = None,
+) -> tuple[str, list[ChapterSpan]]:
+    """
+    Detect the encoding and split the file into chapters. The encoding is detected from a sample,
+    if a later block does not decode, the scan starts again with the next encoding decoding the sample.
+
+    Args:
+        regexp (str): Regular expression of the title line.
+        file (PathLike | str): Text file.
+        on_progress (Callable[[int, int], bool | None]): Called with the scanned bytes and the chapters found
+            after each block, scanning stops if it returns True.
+
+    Returns:
+        tuple[str, list[ChapterSpan]]: (encoding, chapter spans)
+
+    Raises:
+        re.error: If regexp is invalid.
+        UnicodeError: If no encoding decodes the whole file.
+    """
+    tried: list[str] = []
+    error = None
+    while True:
+        encoding = detect_encoding(file, skip=tried)
+        if encoding == None:
+            raise UnicodeError(f"无法识别文本编码: {error}" if error != None else "无法识别文本编码")
+        spans: list[ChapterSpan] = []
+        progress = (lambda scanned: on_progress(scanned, len(spans))) if on_progress != None else None
+        try:
+            for span in iter_chapter_spans(regexp, file, encoding, progress):
+                spans.append(span)
+            return encoding, spans
+        except UnicodeError as e:
+            error = e
+            tried.append(encoding)
+
+
+def count_title_matches(
+    regexp: str,
+    file: PathLike | str,
+    encoding: str,
+    sample_bytes: int = PREVIEW_SAMPLE_BYTES,
+) -> tuple[int, int, int]:
+    """
+    Count the lines matching regexp in the first sample_bytes of the file, to preview a split rule.
+
+    Returns:
+        tuple[int, int, int]: (matched lines, sampled bytes, file size)
+
+    Raises:
+        re.error: If regexp is invalid.
+    """
+    reg = re_compile(regexp)
+    with open(file, "rb") as f:
+        sample = f.read(sample_bytes)
+        size = f.seek(0, 2)
+    if len(sample) < size:
+        # drop the last incomplete line
+        sample = sample[:sample.rfind(b"\n") + 1]
+    lines = sample.decode(encoding, errors="replace").splitlines()
+    return sum(1 for line in lines if reg.match(line) != None), len(sample), size
+
+
+def read_span_text(file: PathLike | str, encoding: str, start: int, end: int) -> str:
+    """
+    Read text in the byte range of the file, without the line break at the end.
+
+    Raises:
+        UnicodeError: If the text does not decode, the file may have changed after the split.
+    """
+    with open(file, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = data.decode(encoding)
+    if text.endswith("\r\n"):
+        return text[:-2]
+    if text.endswith("\n"):
+        return text[:-1]
+    return text
+
+
+def split_chapters_by_regexp(regexp: str, file: PathLike | str) -> list[tuple[str, str]]:
+    try:
+        encoding, spans = split_chapter_spans(regexp, file)
+    except UnicodeError:
+        return []
+    return [(span.title, read_span_text(file, encoding, span.start, span.end)) for span in spans]
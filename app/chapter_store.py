@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+from os import PathLike
+from typing import Iterable, Iterator
+from app.chapter_splitter import ChapterSpan, read_span_text
+
+
+@dataclass
+class Chapter:
+    title: str
+    # byte range in the source file
+    start: int = 0
+    end: int = 0
+    # edited text, overrides the byte range
+    text: str | None = None
+
+
+class ChapterStore:
+    """
+    ChapterStore keeps the chapters as byte ranges of the source file, and the edited chapters as text.
+    The text of a chapter is read from the file on demand.
+    """
+
+    def __init__(self, file: PathLike | str | None = None, encoding: str = "utf-8", spans: Iterable[ChapterSpan] = ()):
+        """
+        ChapterStore keeps the chapters as byte ranges of the source file, and the edited chapters as text.
+        The text of a chapter is read from the file on demand.
+
+        Args:
+            file (PathLike | str | None): Source text file.
+            encoding (str): Text encoding of the source file.
+            spans (Iterable[ChapterSpan]): Chapters in the source file.
+        """
+        self.file = file
+        self.encoding = encoding
+        self.chapters: list[Chapter] = [Chapter(span.title, span.start, span.end) for span in spans]
+
+    @staticmethod
+    def first_line(text: str) -> str:
+        lines = text.lstrip("\r\n").splitlines()
+        return lines[0].strip() if len(lines) > 0 else ""
+
+    def __len__(self) -> int:
+        return len(self.chapters)
+
+    def __getitem__(self, index: int) -> tuple[str, str]:
+        return self.title(index), self.text(index)
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        for index in range(len(self.chapters)):
+            yield self[index]
+
+    def __byte_length(self, text: str) -> int:
+        encoding = "utf-8" if self.encoding == "utf-8-sig" else self.encoding
+        return len(text.encode(encoding))
+
+    def append(self, span: ChapterSpan):
+        self.chapters.append(Chapter(span.title, span.start, span.end))
+
+    def title(self, index: int) -> str:
+        return self.chapters[index].title
+
+    def set_title(self, index: int, title: str):
+        self.chapters[index].title = title
+
+    def is_edited(self, index: int) -> bool:
+        return self.chapters[index].text != None
+
+    def text(self, index: int) -> str:
+        chapter = self.chapters[index]
+        if chapter.text != None:
+            return chapter.text
+        if self.file == None or chapter.end <= chapter.start:
+            return ""
+        return read_span_text(self.file, self.encoding, chapter.start, chapter.end)
+
+    def set_text(self, index: int, text: str):
+        """
+        Replace the chapter text, the title is updated to the first line.
+        """
+        chapter = self.chapters[index]
+        chapter.text = text
+        chapter.title = ChapterStore.first_line(text)
+
+    def replace_range(self, index: int, start: int, end: int, text: str):
+        """
+        Replace the characters [start, end) of the chapter text, the title is not changed.
+        """
+        chapter = self.chapters[index]
+        if chapter.text == None:
+            chapter.text = self.text(index)
+        chapter.text = chapter.text[:start] + text + chapter.text[end:]
+
+    def merge_up(self, index: int):
+        """
+        Append chapter index to chapter index - 1, and remove it.
+        Adjacent unedited chapters are merged by joining the byte ranges.
+        """
+        if index < 1 or index >= len(self.chapters):
+            raise IndexError("chapter index out of range")
+        prev = self.chapters[index - 1]
+        chapter = self.chapters[index]
+        if prev.text == None and chapter.text == None and prev.end == chapter.start:
+            prev.end = chapter.end
+        else:
+            # the text of a byte range does not have the line break at its end
+            text = self.text(index - 1)
+            prev.text = text + ("" if text.endswith("\n") else "\n") + self.text(index)
+        del self.chapters[index]
+
+    def split(self, index: int, offset: int):
+        """
+        Split chapter index at the character offset of its text, the second part becomes chapter index + 1.
+        Unedited chapters are split by cutting the byte range. The text of the first part is kept whole,
+        a cut right after a line break keeps the line break at its end.
+        """
+        chapter = self.chapters[index]
+        text = self.text(index)
+        if offset <= 0 or offset >= len(text):
+            raise ValueError("split offset out of range")
+        text_before = text[:offset]
+        text_after = text[offset:]
+        if chapter.text == None and text_before.find("\ufffd") < 0:
+            # replacement character can not be encoded back to the original bytes
+            middle = chapter.start + self.__byte_length(text_before)
+            if self.encoding == "utf-8-sig" and chapter.start == 0:
+                middle += len("\ufeff".encode("utf-8"))
+            second = Chapter(ChapterStore.first_line(text_after), middle, chapter.end)
+            chapter.end = middle
+            chapter.title = ChapterStore.first_line(text_before)
+            if text_before.endswith("\n"):
+                # read_span_text drops the line break at the end of a range
+                chapter.text = text_before
+        else:
+            second = Chapter(ChapterStore.first_line(text_after), text=text_after)
+            chapter.text = text_before
+            chapter.title = ChapterStore.first_line(text_before)
+        self.chapters.insert(index + 1, second)
@@ -0,0 +1,330 @@
+"""
+Headless batch conversion.
+
+    python . batch ./content --output ./output --voice zh-CN-YunxiNeural --rate=-20% --jobs 4 --tts-concurrency 8
+
+Or a job in a shared directory, converted by workers on several hosts:
+
+    python . queue ./content/novel.txt /mnt/nfs/novel-job --voice zh-CN-YunxiNeural
+    python . worker /mnt/nfs/novel-job --tts-concurrency 4
+
+Join the converted chapters of a novel into one audiobook with a chapter index:
+
+    python . assemble ./output/novel
+
+Novels are split in a process pool, and all chapters go into one shared synthesis queue.
+The split and the finished chapters are saved in the project database of each novel,
+so running it again restores the split and skips the finished chapters.
+A JSON summary is printed to stdout, progress is printed to stderr.
+"""
+import asyncio
+import json
+import re
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from pathlib import Path
+from time import monotonic, perf_counter
+from app.audiobook import assemble_audiobook, find_book_chapters
+from app.chapter_splitter import DEFAULT_CUT_CHAPTER_RE, ChapterSpan, split_chapter_spans
+from app.chapter_store import ChapterStore
+from app.job_queue import (
+    DEFAULT_LEASE_TIMEOUT, DEFAULT_HEARTBEAT, DEFAULT_POLL, JOB_FILE,
+    JobQueue, create_job, run_worker,
+)
+from app.metrics import PipelineMetrics
+from app.project_db import PROJECT_DB_NAME, ProjectDB, file_sha256
+from app.text_normalizer import get_normalizer
+from app.tts_backend import PooledTTSBackend
+from app.tts_cache import DEFAULT_CACHE_DIR, SynthesisCache
+from app.tts_engine import (
+    TTSEngine, ConvertOptions, ChapterProgress, check_voice,
+    DEFAULT_VOICE, DEFAULT_RATE, DEFAULT_CONCURRENCY,
+    STATE_DONE, STATE_FAILED,
+)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+
+def split_novel(path: str, regexp: str) -> tuple[str, str, list[ChapterSpan], str, float]:
+    """
+    Runs in a worker process, returns (path, encoding, chapter spans, sha256 of the file, seconds to split).
+    """
+    start = perf_counter()
+    encoding, spans = split_chapter_spans(regexp, path)
+    return path, encoding, spans, file_sha256(path), perf_counter() - start
+
+
+def build_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog="novel-tts", description="中文TXT小说TTS转音频工具")
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser("batch", help="转换目录下所有txt小说, 不启动界面")
+    batch.add_argument("input_dir", type=Path, help="小说目录, 包括子目录")
+    batch.add_argument("--output", type=Path, default=Path("./output"), help="输出目录")
+    batch.add_argument("--rule", default=DEFAULT_CUT_CHAPTER_RE, help="分割章节的正则表达式")
+    batch.add_argument("--voice", default=DEFAULT_VOICE)
+    batch.add_argument("--rate", default=DEFAULT_RATE, help="语速, 负数写作 --rate=-20%%")
+    batch.add_argument("--subtitles", nargs="+", choices=("srt", "vtt"), default=[], help="同时输出的字幕格式")
+    batch.add_argument("--normalize", action="store_true", help="合成前精简文本, 已转换的章节会重新转换")
+    batch.add_argument("--strip-pattern", action="append", default=[], help="不合成包含此正则表达式的行, 如网站水印, 可重复")
+    batch.add_argument("--jobs", type=int, default=cpu_count() or 1, help="分割章节的进程数")
+    batch.add_argument("--tts-concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时转换的章节数")
+    batch.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="合成缓存目录, 为空则不使用缓存")
+    batch.add_argument("--metrics-log", default=None, help="把每个请求和章节的耗时追加到此JSON-lines文件")
+    queue = commands.add_parser("queue", help="分割小说, 在共享目录中创建转换任务")
+    queue.add_argument("input_file", type=Path, help="txt小说")
+    queue.add_argument("job_dir", type=Path, help="任务目录, 各worker共享")
+    queue.add_argument("--rule", default=DEFAULT_CUT_CHAPTER_RE, help="分割章节的正则表达式")
+    queue.add_argument("--voice", default=DEFAULT_VOICE)
+    queue.add_argument("--rate", default=DEFAULT_RATE, help="语速, 负数写作 --rate=-20%%")
+    queue.add_argument("--subtitles", nargs="+", choices=("srt", "vtt"), default=[], help="同时输出的字幕格式")
+    queue.add_argument("--normalize", action="store_true", help="合成前精简文本, 已转换的章节会重新转换")
+    queue.add_argument("--strip-pattern", action="append", default=[], help="不合成包含此正则表达式的行, 如网站水印, 可重复")
+    worker = commands.add_parser("worker", help="从共享目录领取章节并转换, 直到任务完成")
+    worker.add_argument("job_dir", type=Path, help="任务目录")
+    worker.add_argument("--tts-concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时转换的章节数")
+    worker.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="合成缓存目录, 为空则不使用缓存")
+    worker.add_argument("--worker-id", default=None, help="worker名称, 默认为主机名和进程号")
+    worker.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT, help="租约超时秒数")
+    worker.add_argument("--heartbeat", type=float, default=DEFAULT_HEARTBEAT, help="刷新租约的间隔秒数")
+    worker.add_argument("--poll", type=float, default=DEFAULT_POLL, help="等待其他worker时的轮询秒数")
+    worker.add_argument("--tts-url", default=None, help="edge-tts协议的websocket地址, 默认为微软Edge在线TTS")
+    worker.add_argument("--metrics-log", default=None, help="把每个请求和章节的耗时追加到此JSON-lines文件")
+    assemble = commands.add_parser("assemble", help="把小说已转换的章节合并为一个有声书文件")
+    assemble.add_argument("output_dir", type=Path, help="小说的输出目录, 包含project.db")
+    assemble.add_argument("--title", default=None, help="书名, 默认为目录名")
+    return parser
+
+
+async def run_batch(args) -> dict:
+    novels = sorted(str(path) for path in args.input_dir.rglob("*.txt") if not path.name.startswith("."))
+    options = ConvertOptions(
+        voice=args.voice, rate=args.rate, concurrency=args.tts_concurrency, subtitle_formats=tuple(args.subtitles),
+        normalize=args.normalize, strip_patterns=tuple(args.strip_pattern))
+    cache = SynthesisCache(args.cache_dir) if args.cache_dir != "" else None
+
+    def print_progress(chapter: ChapterProgress):
+        if chapter.state in (STATE_DONE, STATE_FAILED):
+            error = f" {chapter.error}" if chapter.error != "" else ""
+            print(f"[{chapter.state}] {chapter.output_dir.name}/{chapter.title}{error}", file=sys.stderr)
+
+    backend = PooledTTSBackend(pool_size=options.concurrency * options.chunk_concurrency)
+    metrics = PipelineMetrics(args.metrics_log)
+    engine = TTSEngine(args.output, options, print_progress, cache, backend, metrics=metrics)
+    summary: dict[str, dict] = {
+        path: {"file": path, "output_dir": None, "encoding": None, "chapters": 0, "restored": False, "error": None}
+        for path in novels
+    }
+    books: dict[str, list[ChapterProgress]] = {path: [] for path in novels}
+    projects: dict[str, ProjectDB] = {}
+    loop = asyncio.get_running_loop()
+
+    def output_dir_of(path: str) -> Path:
+        return args.output / Path(path).relative_to(args.input_dir).with_suffix("")
+
+    async def submit_novel(path: str, store: ChapterStore):
+        output_dir = output_dir_of(path)
+        summary[path].update(output_dir=str(output_dir), encoding=store.encoding, chapters=len(store))
+        for index, (title, text) in enumerate(store):
+            chapter = ChapterProgress(index, title, output_dir=output_dir, project=projects[path])
+            books[path].append(chapter)
+            await engine.submit(chapter, text)
+
+    engine.start()
+    try:
+        restored: dict[str, ChapterStore] = {}
+        for path in novels:
+            project = projects[path] = ProjectDB.for_output_dir(output_dir_of(path))
+            source = project.source()
+            store = project.load_chapters(path) if source != None and source.rule == args.rule else None
+            if store != None:
+                summary[path]["restored"] = True
+                restored[path] = store
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+
+            async def split(path: str) -> tuple[str, tuple | None, Exception | None]:
+                try:
+                    return path, await loop.run_in_executor(pool, split_novel, path, args.rule), None
+                except Exception as e:
+                    return path, None, e
+
+            # split in the background while the restored novels are queued
+            splits = [asyncio.create_task(split(path)) for path in novels if path not in restored]
+            for path, store in restored.items():
+                await submit_novel(path, store)
+            for next_novel in asyncio.as_completed(splits):
+                path, result, error = await next_novel
+                if error != None:
+                    summary[path]["error"] = str(error)
+                    continue
+                _, encoding, spans, sha256, seconds = result
+                metrics.on_split(path, seconds, len(spans))
+                store = ChapterStore(path, encoding, spans)
+                projects[path].save_source(path, encoding, args.rule, sha256)
+                projects[path].save_chapters(store)
+                await submit_novel(path, store)
+        await engine.join()
+    finally:
+        await engine.stop()
+        await backend.close()
+        metrics.close()
+        for project in projects.values():
+            project.close()
+    for path, chapters in books.items():
+        summary[path]["done"] = sum(1 for ch in chapters if ch.state == STATE_DONE)
+        summary[path]["skipped"] = sum(1 for ch in chapters if ch.skipped)
+        summary[path]["failed"] = [
+            {"index": ch.index, "title": ch.title, "error": ch.error}
+            for ch in chapters if ch.state == STATE_FAILED
+        ]
+    return {"novels": list(summary.values()), "metrics": metrics.summary()}
+
+
+def check_convert_args(args) -> bool:
+    """
+    Check the options of batch and queue before any novel is split, prints the error.
+    """
+    try:
+        re.compile(args.rule)
+    except re.error as e:
+        print(f"--rule 正则表达式错误: {e}", file=sys.stderr)
+        return False
+    try:
+        get_normalizer(tuple(args.strip_pattern))
+    except re.error as e:
+        print(f"--strip-pattern 正则表达式错误: {e}", file=sys.stderr)
+        return False
+    try:
+        check_voice(args.voice, args.rate)
+    except ValueError as e:
+        print(f"--voice 或 --rate 错误: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+def main_batch(args) -> int:
+    if not args.input_dir.is_dir():
+        print(f"目录不存在: {args.input_dir}", file=sys.stderr)
+        return EXIT_USAGE
+    if not check_convert_args(args):
+        return EXIT_USAGE
+    start = monotonic()
+    result = asyncio.run(run_batch(args))
+    novels = result["novels"]
+    result["chapters"] = sum(novel["chapters"] for novel in novels)
+    result["done"] = sum(novel["done"] for novel in novels)
+    result["skipped"] = sum(novel["skipped"] for novel in novels)
+    result["failed"] = sum(len(novel["failed"]) for novel in novels)
+    result["split_failed"] = sum(1 for novel in novels if novel["error"] != None)
+    result["elapsed_s"] = round(monotonic() - start, 3)
+    print(json.dumps(result, ensure_ascii=False))
+    if result["failed"] > 0 or result["split_failed"] > 0:
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def main_queue(args) -> int:
+    if not args.input_file.is_file():
+        print(f"文件不存在: {args.input_file}", file=sys.stderr)
+        return EXIT_USAGE
+    if not check_convert_args(args):
+        return EXIT_USAGE
+    try:
+        _, encoding, spans, _, _ = split_novel(str(args.input_file), args.rule)
+        options = ConvertOptions(
+            voice=args.voice, rate=args.rate, subtitle_formats=tuple(args.subtitles),
+            normalize=args.normalize, strip_patterns=tuple(args.strip_pattern))
+        count = create_job(args.job_dir, ChapterStore(args.input_file, encoding, spans), options)
+    except (OSError, UnicodeError) as e:
+        print(e, file=sys.stderr)
+        return EXIT_FAILED
+    print(json.dumps({"job_dir": str(args.job_dir), "encoding": encoding, "chapters": count}, ensure_ascii=False))
+    return EXIT_OK
+
+
+async def run_worker_command(args) -> dict:
+    queue = JobQueue(args.job_dir, args.worker_id, args.lease_timeout)
+    cache = SynthesisCache(args.cache_dir) if args.cache_dir != "" else None
+    backend = PooledTTSBackend(args.tts_url, pool_size=args.tts_concurrency * queue.options.chunk_concurrency)
+
+    metrics = PipelineMetrics(args.metrics_log)
+
+    def print_finish(task):
+        print(f"[done] {task.title}", file=sys.stderr)
+
+    try:
+        stats = await run_worker(
+            queue, backend, args.tts_concurrency, cache, args.heartbeat, args.poll, print_finish, metrics)
+    finally:
+        await backend.close()
+        metrics.close()
+    return {"worker": queue.worker_id, **stats, "metrics": metrics.summary()}
+
+
+def main_worker(args) -> int:
+    if not (args.job_dir / JOB_FILE).is_file():
+        print(f"任务不存在: {args.job_dir}", file=sys.stderr)
+        return EXIT_USAGE
+    start = monotonic()
+    result = asyncio.run(run_worker_command(args))
+    result["elapsed_s"] = round(monotonic() - start, 3)
+    print(json.dumps(result, ensure_ascii=False))
+    return EXIT_FAILED if result["failed"] > 0 else EXIT_OK
+
+
+def main_assemble(args) -> int:
+    if not (args.output_dir / PROJECT_DB_NAME).is_file():
+        print(f"项目不存在: {args.output_dir}", file=sys.stderr)
+        return EXIT_USAGE
+    project = ProjectDB(args.output_dir / PROJECT_DB_NAME)
+    try:
+        source = project.source()
+        store = project.load_chapters(source.path) if source != None else None
+    finally:
+        project.close()
+    if store == None:
+        print("源文件已改变, 请重新分割章节", file=sys.stderr)
+        return EXIT_FAILED
+    chapters, missing = find_book_chapters(store, args.output_dir)
+    if len(chapters) <= 0:
+        print("没有已转换的章节", file=sys.stderr)
+        return EXIT_FAILED
+    title = args.title if args.title != None else args.output_dir.name
+
+    def print_progress(finished: int, total: int):
+        if finished % 100 == 0 or finished == total:
+            print(f"[{finished}/{total}]", file=sys.stderr)
+
+    marks = assemble_audiobook(
+        chapters,
+        args.output_dir / f"{title}.mp3",
+        title,
+        args.output_dir / f"{title}.lrc",
+        args.output_dir / f"{title}.cue",
+        print_progress,
+    )
+    print(json.dumps({
+        "mp3": str(args.output_dir / f"{title}.mp3"),
+        "chapters": len(marks),
+        "missing": missing,
+        "duration_ms": marks[-1].end_ms,
+    }, ensure_ascii=False))
+    return EXIT_OK
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        return main_batch(args)
+    if args.command == "queue":
+        return main_queue(args)
+    if args.command == "worker":
+        return main_worker(args)
+    if args.command == "assemble":
+        return main_assemble(args)
+    parser.print_help()
+    return EXIT_USAGE
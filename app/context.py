@@ -1,14 +1,44 @@
 from dataclasses import dataclass, field
+from os.path import exists
 from textual.message import Message
+from app.chapter_store import ChapterStore
+from app.project_db import PROJECT_DB_NAME, ProjectDB
 
 # typing
 from pathlib import Path
 
+DEFAULT_OUTPUT_DIR = "./output"
+
 
 @dataclass
 class ContextData:
     selected_txt_path: Path | None = None
-    chapters: list[tuple[str, str]] = field(default_factory=lambda: [])
+    chapters: ChapterStore = field(default_factory=ChapterStore)
+    # project database of the selected novel, created when it is split
+    project: ProjectDB | None = None
+
+    def get_output_dir(self) -> Path:
+        if self.selected_txt_path == None:
+            return Path(DEFAULT_OUTPUT_DIR)
+        return Path(DEFAULT_OUTPUT_DIR) / self.selected_txt_path.stem
+
+    def open_project(self, create: bool = False) -> ProjectDB | None:
+        """
+        Open the project database of the selected novel, returns None if it does not exist and not create.
+        """
+        if self.project != None and self.project.path == self.get_output_dir() / PROJECT_DB_NAME:
+            return self.project
+        # the previous one may still be used by a running conversion, it is closed when released
+        if self.project != None:
+            self.project.close_when_released()
+        self.project = None
+        if create or exists(self.get_output_dir() / PROJECT_DB_NAME):
+            self.project = ProjectDB.for_output_dir(self.get_output_dir())
+        return self.project
+
+    def save_chapters(self):
+        if self.project != None:
+            self.project.save_chapters(self.chapters)
 
 
 class MainAppEvent:
@@ -13,8 +13,10 @@ zh-CN-shaanxi-XiaoniNeural         Female    Dialect                Bright
 """
 
 # ======== main ========
-import edge_tts as tts
-from app.lrc_maker import LRCMaker
+import json
+from app.metrics import PipelineMetrics
+from app.tts_backend import PooledTTSBackend
+from app.tts_engine import ConvertOptions, synthesize_chapter
 
 VOICE = "zh-CN-YunxiNeural"
 INPUT_TEXT_FILE = "p1.txt"
@@ -25,22 +27,22 @@ async def main():
     with open(INPUT_TEXT_FILE, "rt", encoding="utf-8") as f:
         txt = f.read().strip()
 
-    communicate = tts.Communicate(txt, VOICE, rate="-20%")
-    # lrc_maker = LRCMaker(reference_text=txt, stop_ms=100, cjk_chars_limit=10)
-    lrc_maker = LRCMaker(reference_text=txt, stop_ms=100, cjk_chars_limit=-1)
-
-    with open(OUTPUT_FILE, "wb") as file:
-        async for chunk in communicate.stream():
-            if chunk["type"] == "audio":
-                file.write(chunk["data"])
-            elif chunk["type"] == "WordBoundary":
-                lrc_maker.feed_edge_tts_chunk(chunk)
-                print(f"{lrc_maker.get_progress() * 100 :.2f}%")
-    
-    with open(LRC_FILE, "wt", encoding="utf-8") as f:
-        f.write(lrc_maker.get_lrc())
-
-    print(lrc_maker.get_lrc())
+    # options = ConvertOptions(voice=VOICE, rate="-20%", stop_ms=100, cjk_chars_limit=10)
+    options = ConvertOptions(voice=VOICE, rate="-20%", stop_ms=100, cjk_chars_limit=-1)
+
+    def print_progress(progress: float):
+        print(f"{progress * 100 :.2f}%")
+
+    backend = PooledTTSBackend()
+    metrics = PipelineMetrics()
+    try:
+        await synthesize_chapter(txt, OUTPUT_FILE, LRC_FILE, options, print_progress, backend=backend, metrics=metrics)
+    finally:
+        await backend.close()
+    print(json.dumps(metrics.summary(), ensure_ascii=False))
+
+    with open(LRC_FILE, "rt", encoding="utf-8") as f:
+        print(f.read())
 
 if __name__ == "__main__":
     import asyncio
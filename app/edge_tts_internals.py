@@ -0,0 +1,32 @@
+"""
+Internals of edge-tts used by the websocket backends, to speak its protocol on our own connections.
+They are not public API of edge-tts and change between versions, all imports of them are here
+and checked against the version they are written for, the one pinned in requirements.txt.
+"""
+import edge_tts
+
+EDGE_TTS_VERSION = "7.3.1"
+
+try:
+    from edge_tts.communicate import (
+        connect_id, date_to_string, get_headers_and_data, mkssml,
+        remove_incompatible_characters, ssml_headers_plus_data,
+    )
+    from edge_tts.constants import SEC_MS_GEC_VERSION, WSS_HEADERS, WSS_URL
+    from edge_tts.data_classes import TTSConfig
+    from edge_tts.drm import DRM
+    IMPORT_ERROR: ImportError | None = None
+except ImportError as e:
+    IMPORT_ERROR = e
+
+
+def check_edge_tts_version():
+    """
+    Raises:
+        RuntimeError: If the installed edge-tts is not the version the internals are written for.
+    """
+    if edge_tts.__version__ != EDGE_TTS_VERSION or IMPORT_ERROR != None:
+        raise RuntimeError(
+            f"edge-tts {EDGE_TTS_VERSION} is required by the websocket backends, "
+            f"{edge_tts.__version__} is installed: {IMPORT_ERROR or 'internals may differ'}"
+        )
@@ -0,0 +1,362 @@
+"""
+Chapter queue in a shared directory, for several worker processes on one or more hosts (NFS).
+
+    <job_dir>/job.json          options and chapters
+    <job_dir>/source.txt        copy of the novel
+    <job_dir>/leases/<id>       claimed by a worker, refreshed by heartbeat
+    <job_dir>/done/<id>         finished, with the result
+    <job_dir>/failed/<id>       gave up after max attempts
+    <job_dir>/errors/<id>.*     one file per failed attempt
+    <job_dir>/workers/<worker>  touched to read the file server clock
+    <job_dir>/output/           MP3 and LRC files
+
+Markers are created by hard linking a private temporary file, which fails if the target exists,
+also on NFS. A lease not refreshed for `lease_timeout` is stale, and is taken over by renaming it,
+so only one worker can reclaim it. Lease times are compared to the clock of the file server.
+"""
+import asyncio
+import json
+import shutil
+import socket
+from dataclasses import asdict, dataclass
+from os import PathLike, getpid, link, listdir, makedirs, remove, rename, stat, utime
+from os.path import exists
+from pathlib import Path
+from uuid import uuid4
+from app.chapter_splitter import read_span_text
+from app.chapter_store import ChapterStore
+from app.metrics import PipelineMetrics
+from app.tts_backend import TTSBackend
+from app.tts_cache import SynthesisCache
+from app.tts_engine import ConvertOptions, chapter_file_stem, synthesize_chapter
+from app.tts_limiter import AdaptiveLimiter
+
+JOB_FILE = "job.json"
+SOURCE_FILE = "source.txt"
+DEFAULT_LEASE_TIMEOUT = 60.0
+DEFAULT_HEARTBEAT = 10.0
+DEFAULT_POLL = 5.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+@dataclass
+class JobTask:
+    id: str
+    index: int
+    title: str
+    start: int = 0
+    end: int = 0
+    # edited text, overrides the byte range
+    text: str | None = None
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{getpid()}"
+
+
+def create_job(job_dir: PathLike | str, store: ChapterStore, options: ConvertOptions) -> int:
+    """
+    Write a job of all chapters in the store, returns the number of chapters.
+    """
+    job_dir = Path(job_dir)
+    if exists(job_dir / JOB_FILE):
+        raise FileExistsError(f"job already exists: {job_dir}")
+    for name in ("leases", "done", "failed", "errors", "workers", "output"):
+        makedirs(job_dir / name, exist_ok=True)
+    if store.file != None:
+        shutil.copyfile(store.file, job_dir / SOURCE_FILE)
+    tasks = [
+        JobTask(chapter_file_stem(index, chapter.title), index, chapter.title, chapter.start, chapter.end, chapter.text)
+        for index, chapter in enumerate(store.chapters)
+    ]
+    job = {
+        "encoding": store.encoding,
+        "options": {
+            "voice": options.voice,
+            "rate": options.rate,
+            "pitch": options.pitch,
+            "stop_ms": options.stop_ms,
+            "cjk_chars_limit": options.cjk_chars_limit,
+            "chunk_chars": options.chunk_chars,
+            "subtitle_formats": list(options.subtitle_formats),
+            "normalize": options.normalize,
+            "strip_patterns": list(options.strip_patterns),
+        },
+        "tasks": [asdict(task) for task in tasks],
+    }
+    tmp_path = job_dir / f"{JOB_FILE}.{uuid4().hex}.tmp"
+    with open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False)
+    rename(tmp_path, job_dir / JOB_FILE)
+    return len(tasks)
+
+
+class JobQueue:
+    """
+    JobQueue claims, refreshes and finishes the chapters of a job for one worker.
+    """
+
+    def __init__(
+        self,
+        job_dir: PathLike | str,
+        worker_id: str | None = None,
+        lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        """
+        JobQueue claims, refreshes and finishes the chapters of a job for one worker.
+
+        Args:
+            job_dir (PathLike | str): Shared job directory.
+            worker_id (str | None): Unique name of the worker, host and pid if None.
+            lease_timeout (float): Seconds without heartbeat before a lease is stale.
+            max_attempts (int): Failed attempts of a chapter before giving up.
+        """
+        self.job_dir = Path(job_dir)
+        self.worker_id = worker_id if worker_id != None else default_worker_id()
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        with open(self.job_dir / JOB_FILE, "rt", encoding="utf-8") as f:
+            job = json.load(f)
+        self.encoding: str = job["encoding"]
+        self.options = ConvertOptions(**job["options"])
+        self.options.subtitle_formats = tuple(self.options.subtitle_formats)
+        self.options.strip_patterns = tuple(self.options.strip_patterns)
+        self.tasks = [JobTask(**task) for task in job["tasks"]]
+        self.output_dir = self.job_dir / "output"
+        # lease file content, to tell our lease from a reclaimed one
+        self.__token = f"{self.worker_id} {uuid4().hex}"
+
+    # ======== markers ========
+
+    def __path(self, kind: str, task_id: str) -> Path:
+        return self.job_dir / kind / task_id
+
+    def __create_exclusive(self, path: Path, content: str) -> bool:
+        """
+        Create the file with the content, returns False if it exists.
+        """
+        tmp_path = path.parent / f".{path.name}.{uuid4().hex}.tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(content)
+        try:
+            link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            # the reply of a successful link can be lost on NFS, the link count tells
+            return stat(tmp_path).st_nlink == 2
+        finally:
+            remove(tmp_path)
+
+    def __read(self, path: Path) -> str | None:
+        try:
+            with open(path, "rt", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def server_now(self) -> float:
+        """
+        Current time of the file server, by touching the file of this worker.
+        """
+        path = self.__path("workers", self.worker_id)
+        with open(path, "at", encoding="utf-8"):
+            pass
+        utime(path)
+        return stat(path).st_mtime
+
+    def task_text(self, task: JobTask) -> str:
+        if task.text != None:
+            return task.text
+        if task.end <= task.start:
+            return ""
+        return read_span_text(self.job_dir / SOURCE_FILE, self.encoding, task.start, task.end)
+
+    # ======== leases ========
+
+    def try_claim(self, task: JobTask) -> bool:
+        if exists(self.__path("done", task.id)) or exists(self.__path("failed", task.id)):
+            return False
+        if not self.__create_exclusive(self.__path("leases", task.id), self.__token):
+            return False
+        if exists(self.__path("done", task.id)):
+            # finished and released after the check above
+            self.release(task)
+            return False
+        return True
+
+    def owns(self, task: JobTask) -> bool:
+        return self.__read(self.__path("leases", task.id)) == self.__token
+
+    def heartbeat(self, task: JobTask) -> bool:
+        """
+        Refresh the lease, returns False if it is lost.
+        """
+        if not self.owns(task):
+            return False
+        try:
+            utime(self.__path("leases", task.id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, task: JobTask):
+        if self.owns(task):
+            try:
+                remove(self.__path("leases", task.id))
+            except FileNotFoundError:
+                pass
+
+    def reclaim_stale(self, task: JobTask, now: float) -> bool:
+        """
+        Remove the lease if it is not refreshed in time, returns True if removed.
+        """
+        path = self.__path("leases", task.id)
+        try:
+            if now - stat(path).st_mtime < self.lease_timeout:
+                return False
+            # rename is atomic, only one worker gets the stale lease
+            stale_path = path.parent / f".{task.id}.{uuid4().hex}.stale"
+            rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+        if now - stat(stale_path).st_mtime < self.lease_timeout:
+            # released and claimed again after the check above, the fresh lease goes back to its owner
+            try:
+                link(stale_path, path)
+            except FileExistsError:
+                pass
+            remove(stale_path)
+            return False
+        remove(stale_path)
+        return True
+
+    def claim_next(self) -> JobTask | None:
+        """
+        Claim a chapter which is not finished or leased, reclaiming stale leases.
+        Returns None if nothing can be claimed now.
+        """
+        finished = set(listdir(self.job_dir / "done")) | set(listdir(self.job_dir / "failed"))
+        leased = set(listdir(self.job_dir / "leases"))
+        now = None
+        for task in self.tasks:
+            if task.id in finished:
+                continue
+            if task.id in leased:
+                now = now if now != None else self.server_now()
+                if not self.reclaim_stale(task, now):
+                    continue
+            if self.try_claim(task):
+                return task
+        return None
+
+    def remaining(self) -> int:
+        """
+        Number of chapters not finished or failed.
+        """
+        finished = set(listdir(self.job_dir / "done")) | set(listdir(self.job_dir / "failed"))
+        return sum(1 for task in self.tasks if task.id not in finished)
+
+    # ======== results ========
+
+    def complete(self, task: JobTask, result: dict) -> bool:
+        """
+        Mark the chapter done if the lease is still ours, returns False if it is lost.
+        """
+        if not self.owns(task):
+            return False
+        created = self.__create_exclusive(
+            self.__path("done", task.id),
+            json.dumps({"worker": self.worker_id, **result}, ensure_ascii=False),
+        )
+        self.release(task)
+        return created
+
+    def fail(self, task: JobTask, error: str) -> bool:
+        """
+        Record a failed attempt and release the chapter, give up after max attempts.
+        Returns True if the chapter is given up, False if it will be tried again.
+        """
+        self.__create_exclusive(self.__path("errors", f"{task.id}.{uuid4().hex}"), f"{self.worker_id}: {error}")
+        attempts = sum(1 for name in listdir(self.job_dir / "errors") if name.startswith(f"{task.id}."))
+        given_up = False
+        if attempts >= self.max_attempts:
+            given_up = self.__create_exclusive(self.__path("failed", task.id), error)
+        self.release(task)
+        return given_up
+
+
+async def run_worker(
+    queue: JobQueue,
+    backend: TTSBackend,
+    concurrency: int = 1,
+    cache: SynthesisCache | None = None,
+    heartbeat: float = DEFAULT_HEARTBEAT,
+    poll: float = DEFAULT_POLL,
+    on_finish=None,
+    metrics: PipelineMetrics | None = None,
+) -> dict[str, int]:
+    """
+    Convert chapters of the job until every chapter is finished or failed.
+    A chapter is dropped if its lease is lost, so its output is written by one worker only.
+    Returns the numbers of chapters done, given up and lost by this worker,
+    and the failed attempts which are left for a retry.
+    """
+    options = queue.options
+    limiter = AdaptiveLimiter(initial=concurrency, max_limit=max(1, concurrency * options.chunk_concurrency))
+    stats = {"done": 0, "failed": 0, "lost": 0, "retried": 0}
+    makedirs(queue.output_dir, exist_ok=True)
+
+    async def convert(task: JobTask):
+        convert_task = asyncio.create_task(synthesize_chapter(
+            queue.task_text(task),
+            queue.output_dir / f"{task.id}.mp3",
+            queue.output_dir / f"{task.id}.lrc",
+            options,
+            cache=cache,
+            backend=backend,
+            limiter=limiter,
+            metrics=metrics,
+        ))
+        while True:
+            done, _ = await asyncio.wait([convert_task], timeout=heartbeat)
+            if len(done) > 0:
+                break
+            if not queue.heartbeat(task):
+                convert_task.cancel()
+                await asyncio.gather(convert_task, return_exceptions=True)
+                stats["lost"] += 1
+                return
+        try:
+            duration_ms = convert_task.result()
+        except Exception as e:
+            if queue.fail(task, str(e)):
+                stats["failed"] += 1
+            else:
+                stats["retried"] += 1
+            return
+        if queue.complete(task, {"duration_ms": duration_ms}):
+            stats["done"] += 1
+            if on_finish != None:
+                on_finish(task)
+        else:
+            stats["lost"] += 1
+
+    async def worker():
+        while True:
+            task = queue.claim_next()
+            if task == None:
+                if queue.remaining() <= 0:
+                    return
+                await asyncio.sleep(poll)
+                continue
+            try:
+                await convert(task)
+            except BaseException:
+                queue.release(task)
+                raise
+
+    await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    return stats
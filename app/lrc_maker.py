@@ -1,6 +1,12 @@
+from array import array
 from dataclasses import dataclass
+from io import StringIO
+from typing import Iterable, Iterator, TextIO
 # import type
 from edge_tts.typing import TTSChunk
+from app.text_normalizer import NormalizedText
+
+SUBTITLE_FORMATS = ("lrc", "srt", "vtt")
 
 @dataclass
 class LRCLine:
@@ -8,12 +14,124 @@ class LRCLine:
     duration_ms: int
     text: str
 
+class LineTimings:
+    """
+    Compact store of subtitle lines, the times are kept in two int arrays and the texts in a list.
+    """
+    __slots__ = ("offsets", "durations", "texts")
+
+    def __init__(self):
+        self.offsets = array("q")
+        self.durations = array("q")
+        self.texts: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def append(self, offset_ms: int, duration_ms: int, text: str):
+        self.offsets.append(offset_ms)
+        self.durations.append(duration_ms)
+        self.texts.append(text)
+
+    def line(self, index: int) -> LRCLine:
+        return LRCLine(self.offsets[index], self.durations[index], self.texts[index])
+
+    def __iter__(self) -> Iterator[LRCLine]:
+        for offset, duration, text in zip(self.offsets, self.durations, self.texts):
+            yield LRCLine(offset, duration, text)
+
+def ms_to_lrc_timestamp(time_ms: int) -> str:
+    ms = (time_ms // 10) % 100
+    sec = (time_ms // 1000) % 60
+    minute = (time_ms // (1000 * 60)) % 100
+    return f"{minute:>02d}:{sec:>02d}.{ms:>02d}"
+
+def ms_to_srt_timestamp(time_ms: int, ms_sep: str = ",") -> str:
+    hour = time_ms // (1000 * 60 * 60)
+    minute = (time_ms // (1000 * 60)) % 60
+    sec = (time_ms // 1000) % 60
+    return f"{hour:>02d}:{minute:>02d}:{sec:>02d}{ms_sep}{time_ms % 1000:>03d}"
+
+def clean_line_text(text: str) -> str:
+    return text.strip().replace("\r", "").replace("\n", "")
+
+class SubtitleWriter:
+    """
+    SubtitleWriter writes closed lines to a file in LRC, SRT or WebVTT format,
+    and flushes after each line, so the lines written survive a crash.
+    """
+
+    def __init__(self, file: TextIO, subtitle_format: str = "lrc"):
+        """
+        SubtitleWriter writes closed lines to a file in LRC, SRT or WebVTT format.
+
+        Args:
+            file (TextIO): Opened text file.
+            subtitle_format (str): One of "lrc", "srt", "vtt".
+        """
+        if subtitle_format not in SUBTITLE_FORMATS:
+            raise ValueError(f"Unknown subtitle format: {subtitle_format}")
+        self.file = file
+        self.format = subtitle_format
+        self.count = 0
+        if subtitle_format == "vtt":
+            file.write("WEBVTT\r\n\r\n")
+
+    def write_line(self, line: LRCLine, tail: str = ""):
+        """
+        Write one line, tail is appended to its text.
+        """
+        content = clean_line_text(line.text) + tail
+        if self.format != "lrc" and content == "":
+            # SRT and WebVTT have no empty cues, the numbers of the cues written stay consecutive
+            return
+        self.count += 1
+        if self.format == "lrc":
+            # no line break after the last line
+            head = "\r\n" if self.count > 1 else ""
+            self.file.write(f"{head}[{ms_to_lrc_timestamp(line.offset_ms)}]{content}")
+        else:
+            end_ms = line.offset_ms + line.duration_ms
+            if self.format == "srt":
+                timestamps = f"{ms_to_srt_timestamp(line.offset_ms)} --> {ms_to_srt_timestamp(end_ms)}"
+                self.file.write(f"{self.count}\r\n{timestamps}\r\n{content}\r\n\r\n")
+            else:
+                timestamps = f"{ms_to_srt_timestamp(line.offset_ms, '.')} --> {ms_to_srt_timestamp(end_ms, '.')}"
+                self.file.write(f"{timestamps}\r\n{content}\r\n\r\n")
+        self.file.flush()
+
+    def write_tail(self, tail: str):
+        """
+        Write the text after the last line when there is no line, only LRC keeps it.
+        """
+        if self.format == "lrc":
+            self.file.write(tail)
+            self.file.flush()
+
+
+def render_subtitles(timings: LineTimings, subtitle_format: str = "lrc", tail: str = "") -> str:
+    """
+    Render the lines in LRC, SRT or WebVTT format, tail is appended to the last line.
+    """
+    buffer = StringIO()
+    writer = SubtitleWriter(buffer, subtitle_format)
+    for index in range(len(timings) - 1):
+        writer.write_line(timings.line(index))
+    if len(timings) > 0:
+        writer.write_line(timings.line(len(timings) - 1), tail)
+    else:
+        writer.write_tail(tail)
+    return buffer.getvalue()
+
 class LRCMaker:
     """
     LRCMaker is used to generate subtitles from WordBoundary messages.
     """
 
-    def __init__(self, reference_text = "", stop_ms = -1, cjk_chars_limit = -1):
+    def __init__(
+        self, reference_text = "", stop_ms = -1, cjk_chars_limit = -1,
+        writers: Iterable[SubtitleWriter] = (), normalized: NormalizedText | None = None,
+    ):
         """
         LRCMaker is used to generate subtitles from WordBoundary messages.
 
@@ -21,112 +139,189 @@ class LRCMaker:
             reference_text (str): Control how to break line, and provide a better result.
             stop_ms (int): Time in ms unit. Control how to break line.
             cjk_chars_limit (int): max cjk characters a line, English count as 0.5/char. Control how to break line.
+            writers (Iterable[SubtitleWriter]): Lines are written to them as soon as they are closed, call `finish` at the end.
+            normalized (NormalizedText | None): The synthesized text, if it is the normalized reference text.
+                Words are searched in it and the lines are cut from the reference text with its position map.
         """
-        self.lines: list[LRCLine] = []
+        self.timings = LineTimings()
         self.ref = reference_text
+        # words are searched in this text, `ref_pos` is a position of it
+        self.search = normalized.text if normalized != None else reference_text
+        self.__normalized = normalized
         self.ref_pos = 0
         self.stop_ms = stop_ms
         self.ch_lmt = cjk_chars_limit
-    
-    def __update_ref_pos(self, text: str, word_pos = -1):
-        if self.ref != "":
-            if word_pos < 0:
-                word_pos = self.ref.find(text, self.ref_pos)
+        self.writers = list(writers)
+        self.finished = False
+        # text pieces and width of the last line, joined into the text of the line when it is closed
+        self.__last_parts: list[str] = []
+        self.__last_width = 0.0
+
+    @staticmethod
+    def __text_width(text: str) -> float:
+        return sum( (0.5 if ord(ch) < 0xFF else 1) for ch in text )
+
+    def __append_last_line(self, text: str):
+        self.__last_parts.append(text)
+        if self.ch_lmt > 0:
+            self.__last_width += LRCMaker.__text_width(text)
+
+    def __close_last_line(self):
+        if len(self.timings) > 0 and len(self.__last_parts) > 0:
+            self.timings.texts[-1] = "".join(self.__last_parts)
+
+    def __new_line(self, offset: int, duration: int, text: str):
+        self.__close_last_line()
+        if len(self.timings) > 0:
+            # the last line never changes after a new line starts
+            last_line = self.timings.line(len(self.timings) - 1)
+            for writer in self.writers:
+                writer.write_line(last_line)
+        self.timings.append(offset, duration, "")
+        self.__last_parts = []
+        self.__last_width = 0.0
+        self.__append_last_line(text)
+
+    def __ref_slice(self, start: int, end: int) -> str:
+        """
+        The reference text between two positions of the searched text.
+        """
+        if self.__normalized == None:
+            return self.ref[start:end]
+        return self.ref[self.__normalized.to_original(start):self.__normalized.to_original(end)]
+
+    def __joined_slice(self, start: int, end: int) -> str:
+        """
+        The reference text between two positions of the searched text, without the lines removed by normalization.
+        """
+        text = self.__ref_slice(start, end)
+        if self.__normalized == None:
+            return text
+        pos_first_break = text.find("\n")
+        if pos_first_break < 0:
+            return text
+        return text[:pos_first_break] + text[text.rfind("\n"):]
+
+    def __word_text(self, text: str, word_pos: int) -> str:
+        """
+        The word as written in the reference text, it may differ from the synthesized one after normalization.
+        """
+        if self.__normalized == None or word_pos < 0:
+            return text
+        return self.__ref_slice(word_pos, word_pos + len(text))
+
+    def __update_ref_pos(self, text: str, word_pos: int):
+        if self.search != "":
             self.ref_pos = word_pos + len(text)
         else:
             self.ref_pos = self.ref_pos + len(text)
-    
-    @staticmethod
-    def __ms_to_lrc_timestamp(time_ms: int) -> str:
-        ms = (time_ms // 10) % 100
-        sec = (time_ms // 1000) % 60
-        minute = (time_ms // (1000 * 60)) % 100
-        return f"{minute:>02d}:{sec:>02d}.{ms:>02d}"
-    
-    @staticmethod
-    def __generate_line_of_lrc(line: LRCLine) -> str:
-        content = line.text.strip().replace("\r", "").replace("\n", "")
-        timestamp = LRCMaker.__ms_to_lrc_timestamp(line.offset_ms)
-        return f"[{timestamp}]{content}"
 
     def feed_edge_tts_chunk(self, chunk: TTSChunk):
+        """
+        Align one WordBoundary message with the reference text in a single pass.
+        The reference text is searched once per word, from the cursor `ref_pos`,
+        and the width of the last line is counted as it grows.
+        """
         if chunk["type"] != "WordBoundary":
             raise ValueError("Invalid message type, expected 'WordBoundary'")
         offset = chunk["offset"] // 10000
         duration = chunk["duration"] // 10000
         text = chunk["text"]
+        ref_pos = self.ref_pos
+        # search word pos
+        word_pos = self.search.find(text, ref_pos) if self.search != "" else -1
         # add first line
-        if len(self.lines) <= 0:
-            self.lines.append(LRCLine(offset, duration, text))
-            self.__update_ref_pos(text)
+        if len(self.timings) <= 0:
+            self.__new_line(offset, duration, self.__word_text(text, word_pos))
+            self.__update_ref_pos(text, word_pos)
             return
-        last_line = self.lines[len(self.lines) - 1]
+        last_offset_ms = self.timings.offsets[-1]
+        last_offset = offset - (last_offset_ms + self.timings.durations[-1])
         # calculate info
         flag_need_break = False
         # split line by none word signs
-        if self.ref != "":
-            # search word pos
-            word_pos = self.ref.find(text, self.ref_pos)
-            if word_pos - self.ref_pos > 0:
-                text_between = self.ref[self.ref_pos : word_pos]
-                flag_need_break = True
-                # check text, ignore space
-                if text_between.strip(" ") == "":
-                    flag_need_break = False
-                # also check stop time, should more than stop_ms
-                if self.stop_ms > 0:
-                    last_offset = offset - (last_line.offset_ms + last_line.duration_ms)
-                    if last_offset < self.stop_ms:
-                        flag_need_break = False
+        if self.search != "" and word_pos - ref_pos > 0:
+            # check text, ignore space
+            flag_need_break = self.__ref_slice(ref_pos, word_pos).strip(" ") != ""
+            # also check stop time, should more than stop_ms
+            if self.stop_ms > 0 and last_offset < self.stop_ms:
+                flag_need_break = False
         # split line by stop time
-        if self.stop_ms > 0:
-            last_offset = offset - (last_line.offset_ms + last_line.duration_ms)
-            if last_offset >= self.stop_ms:
-                flag_need_break = True
+        if self.stop_ms > 0 and last_offset >= self.stop_ms:
+            flag_need_break = True
         # split line by cjk characters limit
         if self.ch_lmt > 0:
-            last_count = sum( (0.5 if ord(ch) < 0xFF else 1) for ch in last_line.text )
-            current_count = sum( (0.5 if ord(ch) < 0xFF else 1) for ch in text )
-            if self.ch_lmt < last_count + current_count:
+            if self.ch_lmt < self.__last_width + LRCMaker.__text_width(text):
                 flag_need_break = True
         # split new line
         if flag_need_break:
-            new_line = LRCLine(offset, duration, text)
+            new_line_head = ""
             # optism for reference text
-            if self.ref != "":
-                word_pos = self.ref.find(text, self.ref_pos)
-                words_between = self.ref[self.ref_pos : word_pos]
-                if words_between.find("\n") >= 0:
+            if self.search != "":
+                words_between = self.__ref_slice(ref_pos, word_pos)
+                pos_last_line = words_between.find("\n")
+                if pos_last_line >= 0:
                     # deal with new paragraph
-                    pos_last_line = words_between.find("\n")
-                    last_line.text = last_line.text + words_between[:pos_last_line]
-                    pos_next_line = words_between.rfind("\n")
-                    new_line.text = words_between[pos_next_line + 1:] + new_line.text
+                    self.__append_last_line(words_between[:pos_last_line])
+                    new_line_head = words_between[words_between.rfind("\n") + 1:]
                 else:
-                    last_line.text = last_line.text + words_between
-            self.lines.append(new_line)
+                    self.__append_last_line(words_between)
+            self.__new_line(offset, duration, new_line_head + self.__word_text(text, word_pos))
             self.__update_ref_pos(text, word_pos)
             return
         # append to current line
-        last_line.duration_ms = (offset + duration) - last_line.offset_ms
-        if self.ref != "":
-            word_pos = self.ref.find(text, self.ref_pos)
-            last_line.text = last_line.text + self.ref[self.ref_pos : word_pos + len(text)]
-            self.__update_ref_pos(text, word_pos)
+        self.timings.durations[-1] = (offset + duration) - last_offset_ms
+        if self.search != "":
+            self.__append_last_line(self.__joined_slice(ref_pos, word_pos + len(text)))
         else:
             # if english, add space.
             if all( (ord(ch) < 0xFF) for ch in text ):
-                last_line.text = last_line.text + " "
-            last_line.text = last_line.text + text
-            self.__update_ref_pos(text)
+                self.__append_last_line(" ")
+            self.__append_last_line(text)
+        self.__update_ref_pos(text, word_pos)
 
     def get_progress(self) -> float:
-        return (self.ref_pos / len(self.ref)) if (len(self.ref) > 0) else 0.0
+        return (self.ref_pos / len(self.search)) if (len(self.search) > 0) else 0.0
+
+    def get_tail(self) -> str:
+        """
+        The reference text after the last word, such as the last symbol.
+        """
+        if self.ref_pos < len(self.search) - 1:
+            tail = self.__ref_slice(self.ref_pos, len(self.search))
+            if self.__normalized != None:
+                # the lines after are not synthesized
+                tail = tail.split("\n", 1)[0]
+            return tail.strip()
+        return ""
+
+    def finish(self):
+        """
+        Close the last line and write it to the writers.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.__close_last_line()
+        tail = self.get_tail()
+        for writer in self.writers:
+            if len(self.timings) > 0:
+                writer.write_line(self.timings.line(len(self.timings) - 1), tail)
+            else:
+                writer.write_tail(tail)
+
+    def get_subtitles(self, subtitle_format: str = "lrc") -> str:
+        """
+        Render all lines in LRC, SRT or WebVTT format, from the same alignment.
+        """
+        self.__close_last_line()
+        return render_subtitles(self.timings, subtitle_format, self.get_tail())
 
     def get_lrc(self) -> str:
-        lrc_text = "\r\n".join( LRCMaker.__generate_line_of_lrc(line) for line in self.lines)
-        if self.ref_pos < len(self.ref) - 1:
-            # last symbol
-            last = self.ref[self.ref_pos:].strip()
-            lrc_text = lrc_text + last
-        return lrc_text
+        return self.get_subtitles("lrc")
+
+    def get_srt(self) -> str:
+        return self.get_subtitles("srt")
+
+    def get_vtt(self) -> str:
+        return self.get_subtitles("vtt")
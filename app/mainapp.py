@@ -1,16 +1,20 @@
-from textual import on
+from importlib import import_module
+from textual import on, work
 from textual.app import App, ComposeResult
 from textual.containers import Vertical, HorizontalGroup
 from textual.widgets import Footer, Header, Label, TabbedContent, TabPane
 from app.context import ContextData, MainAppEvent
-from app.tabs.open_novel_tab import FilteredDirectoryTree, OpenNovelTab
-from app.tabs.cut_chapters_tab import CutChaptersTab
-from app.tabs.tts_convert import TTSConvertTab
+from app.tabs.open_novel_tab import OpenNovelTab
 
 
 TAB_OPEN_NOVEL = "打开小说"
 TAB_CUT_CHAPTERS = "分割章节"
 TAB_TTS_CONVERT = "TTS转换"
+# tab pane id: (module, widget class), imported and mounted when the tab is first shown
+LAZY_TABS = {
+    "t_cut_chapter": ("app.tabs.cut_chapters_tab", "CutChaptersTab"),
+    "t_tts_convert": ("app.tabs.tts_convert", "TTSConvertTab"),
+}
 
 
 class NovelTTSApp(App):
@@ -32,14 +36,15 @@ class NovelTTSApp(App):
             with TabbedContent(TAB_OPEN_NOVEL, TAB_CUT_CHAPTERS, TAB_TTS_CONVERT):
                 with TabPane(TAB_OPEN_NOVEL, id="t_open_novel"):
                     yield OpenNovelTab(self.ctx)
-                with TabPane(TAB_CUT_CHAPTERS, id="t_cut_chapter"):
-                    yield CutChaptersTab(self.ctx)
-                with TabPane(TAB_TTS_CONVERT, id="t_tts_convert"):
-                    yield TTSConvertTab(self.ctx)
+                yield TabPane(TAB_CUT_CHAPTERS, id="t_cut_chapter")
+                yield TabPane(TAB_TTS_CONVERT, id="t_tts_convert")
             with HorizontalGroup(id="c_status_bar"):
                 yield Label(f"未打开小说")
         yield Footer()
 
+    def on_mount(self):
+        self.call_after_refresh(self.preload_tabs)
+
     # ======== utils ========
 
     async def set_status_bar_text(self, text: str):
@@ -51,6 +56,25 @@ class NovelTTSApp(App):
         tabed_content: TabbedContent = self.query("TabbedContent").first()
         tabed_content.active = tab_id
 
+    async def mount_tab(self, tab_id: str):
+        """
+        Mount the widget of a lazy tab, if not mounted yet.
+        """
+        pane: TabPane = self.query_exactly_one(f"#{tab_id}")
+        if tab_id not in LAZY_TABS or len(pane.children) > 0:
+            return
+        module_name, class_name = LAZY_TABS[tab_id]
+        tab_class = getattr(import_module(module_name), class_name)
+        await pane.mount(tab_class(self.ctx))
+
+    @work(thread=True, exclusive=True, group="preload")
+    def preload_tabs(self):
+        """
+        Import the modules of the lazy tabs after the first frame, so the first switch does not wait for them.
+        """
+        for module_name, _ in LAZY_TABS.values():
+            import_module(module_name)
+
     # ======== main component event ========
 
     def action_toggle_dark(self) -> None:
@@ -63,6 +87,10 @@ class NovelTTSApp(App):
         """Exit app."""
         self.exit(0)
 
+    @on(TabbedContent.TabActivated)
+    async def on_tab_activated(self, event: TabbedContent.TabActivated):
+        await self.mount_tab(event.pane.id)
+
     # ======== sub component event ========
 
     @on(MainAppEvent.SetStatusText)
@@ -0,0 +1,212 @@
+"""
+Timings and counters of the conversion pipeline.
+
+Backends and the engine fill a RequestTiming for each synthesis request and a ChapterTiming
+for each chapter, PipelineMetrics sums them up for the status bar and the summary,
+and appends every record to a JSON-lines log if one is given.
+
+Set the environment variable NOVEL_TTS_PROFILE to a file name to profile the whole run
+with cProfile, read the result with `python -m pstats <file>`.
+"""
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from os import PathLike
+from time import monotonic, time
+from typing import Iterator
+
+PROFILE_ENV = "NOVEL_TTS_PROFILE"
+# log of the interface, in the output directory beside the project database
+METRICS_LOG_NAME = "metrics.jsonl"
+# recent requests kept for the percentiles
+RECENT_REQUESTS = 1024
+
+
+def percentile(values: list[float], p: float) -> float:
+    if len(values) <= 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+@dataclass
+class RequestTiming:
+    chars: int = 0
+    # seconds, connect is 0 on a reused connection
+    connect: float = 0.0
+    first_byte: float = 0.0
+    total: float = 0.0
+    audio_bytes: int = 0
+    reused: bool = False
+    error: str = ""
+
+
+@dataclass
+class ChapterTiming:
+    name: str = ""
+    chars: int = 0
+    chunks: int = 0
+    # characters sent to synthesis after normalization
+    speak_chars: int = 0
+    cached_chunks: int = 0
+    # seconds
+    total: float = 0.0
+    align: float = 0.0
+    audio_bytes: int = 0
+    audio_ms: float = 0.0
+
+    @property
+    def chars_per_sec(self) -> float:
+        return self.chars / self.total if self.total > 0 else 0.0
+
+    @property
+    def rtf(self) -> float:
+        """
+        Real-time factor, seconds spent per second of audio.
+        """
+        return self.total / (self.audio_ms / 1000) if self.audio_ms > 0 else 0.0
+
+
+class PipelineMetrics:
+    """
+    PipelineMetrics sums up the timings of the requests, chapters and splits of a run.
+    The records may come from the event loop and from worker threads.
+    """
+
+    def __init__(self, log_path: PathLike | str | None = None):
+        """
+        PipelineMetrics sums up the timings of the requests, chapters and splits of a run.
+
+        Args:
+            log_path (PathLike | str | None): Append every record to this JSON-lines file.
+        """
+        self.start = monotonic()
+        self.requests = 0
+        self.request_errors = 0
+        # characters of the successful requests, goes up before the chapter is finished
+        self.request_chars = 0
+        self.connects = 0
+        self.connect_total = 0.0
+        self.chapters = 0
+        self.chars = 0
+        self.speak_chars = 0
+        self.audio_bytes = 0
+        self.audio_ms = 0.0
+        self.align_total = 0.0
+        self.splits = 0
+        self.split_total = 0.0
+        self.queue_depth = 0
+        self.__first_bytes: deque[float] = deque(maxlen=RECENT_REQUESTS)
+        self.__totals: deque[float] = deque(maxlen=RECENT_REQUESTS)
+        self.__lock = threading.Lock()
+        self.__log = open(log_path, "at", encoding="utf-8") if log_path != None else None
+
+    def log(self, event: str, record: dict):
+        if self.__log == None:
+            return
+        line = json.dumps({"ts": round(time(), 3), "event": event, **record}, ensure_ascii=False)
+        with self.__lock:
+            if self.__log == None:
+                return
+            self.__log.write(line + "\n")
+            self.__log.flush()
+
+    def on_request(self, timing: RequestTiming):
+        with self.__lock:
+            self.requests += 1
+            if timing.error != "":
+                self.request_errors += 1
+            else:
+                self.request_chars += timing.chars
+                self.__first_bytes.append(timing.first_byte)
+                self.__totals.append(timing.total)
+            if not timing.reused and timing.connect > 0:
+                self.connects += 1
+                self.connect_total += timing.connect
+        self.log("request", asdict(timing))
+
+    def on_chapter(self, timing: ChapterTiming):
+        with self.__lock:
+            self.chapters += 1
+            self.chars += timing.chars
+            self.speak_chars += timing.speak_chars
+            self.audio_bytes += timing.audio_bytes
+            self.audio_ms += timing.audio_ms
+            self.align_total += timing.align
+        self.log("chapter", {
+            **asdict(timing),
+            "chars_per_sec": round(timing.chars_per_sec, 1),
+            "rtf": round(timing.rtf, 4),
+        })
+
+    def on_split(self, name: str, seconds: float, chapters: int):
+        with self.__lock:
+            self.splits += 1
+            self.split_total += seconds
+        self.log("split", {"name": name, "seconds": seconds, "chapters": chapters})
+
+    def set_queue_depth(self, depth: int):
+        self.queue_depth = depth
+
+    def summary(self) -> dict:
+        elapsed = monotonic() - self.start
+        with self.__lock:
+            first_bytes = list(self.__first_bytes)
+            totals = list(self.__totals)
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "requests": self.requests,
+            "request_errors": self.request_errors,
+            "connects": self.connects,
+            "connect_avg_ms": round(self.connect_total / self.connects * 1000, 1) if self.connects > 0 else 0.0,
+            "first_byte_p50_ms": round(percentile(first_bytes, 0.50) * 1000, 1),
+            "first_byte_p95_ms": round(percentile(first_bytes, 0.95) * 1000, 1),
+            "request_p50_ms": round(percentile(totals, 0.50) * 1000, 1),
+            "request_p95_ms": round(percentile(totals, 0.95) * 1000, 1),
+            "chapters": self.chapters,
+            "chars": self.chars,
+            "speak_chars": self.speak_chars,
+            "audio_bytes": self.audio_bytes,
+            "audio_s": round(self.audio_ms / 1000, 3),
+            "chars_per_sec": round(self.chars / elapsed, 1) if elapsed > 0 else 0.0,
+            "request_chars_per_sec": round(self.request_chars / elapsed, 1) if elapsed > 0 else 0.0,
+            "rtf": round(elapsed / (self.audio_ms / 1000), 4) if self.audio_ms > 0 else 0.0,
+            "align_s": round(self.align_total, 3),
+            "split_s": round(self.split_total, 3),
+            "queue_depth": self.queue_depth,
+        }
+
+    def status_text(self) -> str:
+        summary = self.summary()
+        return (
+            f"{summary['chapters']} 章  合成 {summary['request_chars_per_sec']:.0f} 字/秒  RTF {summary['rtf']:.3f}"
+            f"  首字节 p50 {summary['first_byte_p50_ms']:.0f}ms p95 {summary['first_byte_p95_ms']:.0f}ms"
+            f"  请求 {summary['requests']} (失败 {summary['request_errors']})  队列 {summary['queue_depth']}"
+        )
+
+    def close(self):
+        if self.__log != None:
+            with self.__lock:
+                self.__log.close()
+                self.__log = None
+
+
+@contextmanager
+def profile_to(path: PathLike | str | None) -> Iterator[None]:
+    """
+    Profile the block with cProfile and dump the stats to path, does nothing if path is None or empty.
+    Only the calling thread is profiled, worker threads are not.
+    """
+    if path == None or path == "":
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,86 @@
+from typing import Iterator
+
+# bitrate in kbps, index by [mpeg1 or not][bitrate index], layer III only
+BITRATES_KBPS = (
+    (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0),
+    (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0),
+)
+# sample rate in Hz, index by [version bits][sample rate index]
+SAMPLE_RATES = {
+    0b00: (11025, 12000, 8000),  # MPEG 2.5
+    0b10: (22050, 24000, 16000),  # MPEG 2
+    0b11: (44100, 48000, 32000),  # MPEG 1
+}
+
+
+def skip_id3v2(data: bytes | memoryview) -> int:
+    """
+    Returns the position of the first byte after the ID3v2 tag, 0 if no tag.
+    """
+    if len(data) >= 10 and bytes(data[:3]) == b"ID3":
+        size = 0
+        for b in data[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def parse_frame_header(data: bytes | memoryview, pos: int) -> tuple[int, int, int] | None:
+    """
+    Parse the MPEG audio layer III frame header at pos.
+
+    Returns:
+        tuple[int, int, int] | None: (frame length in bytes, samples per frame, sample rate), None if not a valid header.
+    """
+    if pos + 4 > len(data):
+        return None
+    b0, b1, b2 = data[pos], data[pos + 1], data[pos + 2]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0b11
+    layer = (b1 >> 1) & 0b11
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0b11
+    padding = (b2 >> 1) & 0b1
+    if version == 0b01 or layer != 0b01 or sample_rate_index == 0b11:
+        return None
+    mpeg1 = version == 0b11
+    bitrate = BITRATES_KBPS[1 if mpeg1 else 0][bitrate_index] * 1000
+    if bitrate == 0:
+        return None
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    samples = 1152 if mpeg1 else 576
+    length = (samples // 8) * bitrate // sample_rate + padding
+    return length, samples, sample_rate
+
+
+def iter_mp3_frames(data: bytes | memoryview) -> Iterator[tuple[int, int, int, int]]:
+    """
+    Iterate over MPEG audio layer III frames, skip ID3v2 tag and garbage between frames.
+
+    Yields:
+        tuple[int, int, int, int]: (frame position, frame length, samples per frame, sample rate)
+    """
+    pos = skip_id3v2(data)
+    end = len(data)
+    while pos + 4 <= end:
+        header = parse_frame_header(data, pos)
+        if header == None:
+            pos += 1
+            continue
+        length, samples, sample_rate = header
+        if pos + length > end:
+            return
+        yield pos, length, samples, sample_rate
+        pos += length
+
+
+def mp3_duration_ms(data: bytes | memoryview) -> float:
+    """
+    Exact playing time of MP3 data by counting frames, no decoding needed.
+    """
+    duration = 0.0
+    for _, _, samples, sample_rate in iter_mp3_frames(data):
+        duration += samples * 1000 / sample_rate
+    return duration
@@ -0,0 +1,230 @@
+import hashlib
+import sqlite3
+from dataclasses import dataclass
+from os import PathLike, makedirs, stat
+from os.path import exists, getsize
+from pathlib import Path
+from time import time
+from app.chapter_store import Chapter, ChapterStore
+
+PROJECT_DB_NAME = "project.db"
+HASH_BLOCK_BYTES = 1024 * 1024
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS source (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    encoding TEXT NOT NULL,
+    rule TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    idx INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    -- edited text, overrides the byte range
+    text TEXT
+);
+CREATE TABLE IF NOT EXISTS synthesis (
+    stem TEXT PRIMARY KEY,
+    -- hash of the text and the options, see TTSEngine
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    mp3_bytes INTEGER NOT NULL DEFAULT 0,
+    lrc_bytes INTEGER NOT NULL DEFAULT 0,
+    duration_ms REAL NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT '',
+    updated REAL NOT NULL
+);
+"""
+
+
+def file_sha256(file: PathLike | str) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while block := f.read(HASH_BLOCK_BYTES):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class SourceInfo:
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    encoding: str
+    rule: str
+
+
+@dataclass
+class SynthesisRecord:
+    stem: str
+    key: str
+    state: str
+    mp3_bytes: int = 0
+    lrc_bytes: int = 0
+    duration_ms: float = 0.0
+    error: str = ""
+
+
+class ProjectDB:
+    """
+    ProjectDB keeps the state of one novel in a SQLite file: the source file and its encoding,
+    the chapter boundaries, and the synthesis result of each chapter.
+    """
+
+    def __init__(self, path: PathLike | str):
+        """
+        ProjectDB keeps the state of one novel in a SQLite file: the source file and its encoding,
+        the chapter boundaries, and the synthesis result of each chapter.
+
+        Args:
+            path (PathLike | str): Database file, created if not exists.
+        """
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        # users besides the owner, such as a running conversion, see `hold` and `close_when_released`
+        self.holders = 0
+        self.__close_pending = False
+
+    @staticmethod
+    def for_output_dir(output_dir: PathLike | str) -> "ProjectDB":
+        """
+        Open the project database in the output directory of the novel.
+        """
+        makedirs(output_dir, exist_ok=True)
+        return ProjectDB(Path(output_dir) / PROJECT_DB_NAME)
+
+    def close(self):
+        self.db.close()
+
+    def hold(self):
+        """
+        Keep the database open while it is used, until `release`.
+        """
+        self.holders += 1
+
+    def release(self):
+        self.holders -= 1
+        if self.holders <= 0 and self.__close_pending:
+            self.close()
+
+    def close_when_released(self):
+        """
+        Close now if nothing holds the database, or else after the last `release`.
+        """
+        if self.holders <= 0:
+            self.close()
+        else:
+            self.__close_pending = True
+
+    # ======== source ========
+
+    def source(self) -> SourceInfo | None:
+        row = self.db.execute("SELECT path, size, mtime_ns, sha256, encoding, rule FROM source").fetchone()
+        return SourceInfo(*row) if row != None else None
+
+    def source_matches(self, file: PathLike | str) -> bool:
+        """
+        Whether the file is the saved source. Size and mtime are checked first,
+        the file is hashed only if it is touched.
+        """
+        source = self.source()
+        if source == None or not exists(file):
+            return False
+        st = stat(file)
+        if st.st_size != source.size:
+            return False
+        if st.st_mtime_ns == source.mtime_ns:
+            return True
+        if file_sha256(file) != source.sha256:
+            return False
+        with self.db:
+            self.db.execute("UPDATE source SET mtime_ns = ?", (st.st_mtime_ns,))
+        return True
+
+    def save_source(self, file: PathLike | str, encoding: str, rule: str, sha256: str | None = None):
+        """
+        Save the source file, the saved chapters and synthesis results are cleared if it is another file.
+        """
+        st = stat(file)
+        if sha256 == None:
+            sha256 = file_sha256(file)
+        source = self.source()
+        with self.db:
+            if source == None or source.sha256 != sha256 or source.encoding != encoding:
+                self.db.execute("DELETE FROM chapters")
+                self.db.execute("DELETE FROM synthesis")
+            self.db.execute(
+                "INSERT OR REPLACE INTO source (id, path, size, mtime_ns, sha256, encoding, rule)"
+                " VALUES (1, ?, ?, ?, ?, ?, ?)",
+                (str(Path(file).resolve()), st.st_size, st.st_mtime_ns, sha256, encoding, rule),
+            )
+
+    # ======== chapters ========
+
+    def save_chapters(self, store: ChapterStore):
+        with self.db:
+            self.db.execute("DELETE FROM chapters")
+            self.db.executemany(
+                "INSERT INTO chapters (idx, title, start, end, text) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (index, chapter.title, chapter.start, chapter.end, chapter.text)
+                    for index, chapter in enumerate(store.chapters)
+                ),
+            )
+
+    def load_chapters(self, file: PathLike | str) -> ChapterStore | None:
+        """
+        Returns the saved chapters of the file, or None if the file is not the saved source.
+        """
+        if not self.source_matches(file):
+            return None
+        store = ChapterStore(file, self.source().encoding)
+        store.chapters = [
+            Chapter(title, start, end, text)
+            for title, start, end, text in self.db.execute(
+                "SELECT title, start, end, text FROM chapters ORDER BY idx")
+        ]
+        return store
+
+    # ======== synthesis ========
+
+    def synthesis(self, stem: str) -> SynthesisRecord | None:
+        row = self.db.execute(
+            "SELECT stem, key, state, mp3_bytes, lrc_bytes, duration_ms, error FROM synthesis WHERE stem = ?",
+            (stem,),
+        ).fetchone()
+        return SynthesisRecord(*row) if row != None else None
+
+    def is_synthesized(self, output_dir: PathLike | str, stem: str, key: str, done_state: str) -> bool:
+        """
+        Whether the chapter output is finished with the same text and options, and the files are untouched.
+        """
+        record = self.synthesis(stem)
+        if record == None or record.key != key or record.state != done_state:
+            return False
+        mp3_path = Path(output_dir) / f"{stem}.mp3"
+        lrc_path = Path(output_dir) / f"{stem}.lrc"
+        return (
+            exists(mp3_path) and getsize(mp3_path) == record.mp3_bytes
+            and exists(lrc_path) and getsize(lrc_path) == record.lrc_bytes
+        )
+
+    def save_synthesis(self, record: SynthesisRecord):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO synthesis"
+                " (stem, key, state, mp3_bytes, lrc_bytes, duration_ms, error, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.stem, record.key, record.state, record.mp3_bytes,
+                    record.lrc_bytes, record.duration_ms, record.error, time(),
+                ),
+            )
@@ -1,54 +1,37 @@
-from textual import on
+from textual import events, on, work
 from textual.containers import Vertical, Horizontal, HorizontalGroup
-from textual.widgets import ListView, ListItem, Label, TextArea, Input, Button, LoadingIndicator
-from app.context import ContextData
+from textual.timer import Timer
+from textual.widgets import TextArea, Input, Button, Label, LoadingIndicator
+from textual.worker import get_current_worker
+from app.context import ContextData, MainAppEvent
+from app.chapter_splitter import DEFAULT_CUT_CHAPTER_RE, count_title_matches, detect_encoding, split_chapter_spans
+from app.chapter_store import ChapterStore
+from app.metrics import METRICS_LOG_NAME, PipelineMetrics
+from app.project_db import file_sha256
+from app.widgets.chapter_list_view import ChapterListView
+from app.widgets.chapter_text_area import ChapterTextArea
+from os import PathLike
+from os.path import getsize
 from re import compile as re_compile
 from re import error as re_error
-from os import PathLike
+from time import monotonic, perf_counter, sleep
 
-DEFAULT_CUT_CHAPTER_RE = (
-    r"^" +
-    r"(?:第\s{0,4})" +
-    r"([\d零一二三四五六七八九十百千万壹贰叁肆伍陆柒捌玖拾佰仟万ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩⅪⅫIVXLCDM]+?)" +
-    r"(?:" +
-    r"(?:\s{0,4}[集章篇节回段]\s{1,4}([^\s]{1,32}))" +
-    r"|" +
-    r"(?:[\s\.,、，]{1,4}([^\s]{1,32}))" +
-    r")" +
-    r"$"
-)
-
-
-def split_chapters_by_regexp(regexp: str, file: PathLike | str) -> list[tuple[str, str]]:
-    reg = re_compile(regexp)
-    for encoding in ["gb18030", "utf-8", "gbk", "big5"]:
-        try:
-            chapters = []
-            lines = []
-            with open(file, "rt", encoding=encoding, errors="strict") as f:
-                content = f.read()
-                for line in content.splitlines():
-                    mt = reg.match(line)
-                    if mt != None:
-                        # 该行是标题
-                        if (sum(len(l) for l in lines) >= 100):
-                            if len(lines) > 0:
-                                chapters.append((lines[0].strip(), "\r\n".join(lines)))
-                            lines = [line]
-                        else:
-                            # 字数不够100的不单独成章了
-                            lines.append(line)
-                    else:
-                        # 该行不是标题
-                        lines.append(line)
-            # 最后一章
-            if len(lines) > 0:
-                chapters.append((lines[0].strip(), "\r\n".join(lines)))
-            return chapters
-        except UnicodeDecodeError:
-            # 编码错误，重试
-            continue
-    return []
+SPLIT_STATUS_INTERVAL = 0.2
+PREVIEW_DELAY = 0.3
+EDIT_DEBOUNCE = 0.5
+
+
+def location_to_offset(text: str, location: tuple[int, int]) -> int:
+    """
+    Convert (row, column) location of TextArea to character offset of the text.
+    """
+    row, column = location
+    offset = 0
+    for index, line in enumerate(text.splitlines(keepends=True)):
+        if index >= row:
+            break
+        offset += len(line)
+    return offset + column
 
 
 class CutChaptersTab(Vertical):
@@ -56,42 +39,78 @@ class CutChaptersTab(Vertical):
         super().__init__(*children, name=name, id=id, classes=classes, disabled=disabled)
         self.ctx = ctx
         self.is_showing_index = -1
+        # TextArea.load_text also posts TextArea.Changed
+        self.loading_text_count = 0
+        self.is_splitting = False
+        # applies the edits after typing stops
+        self.edit_timer: Timer | None = None
 
     def compose(self):
         with Horizontal():
             with Vertical(id="c_panel_left"):
-                yield ListView(id="c_chapter_list")
+                yield ChapterListView(self.ctx.chapters, id="c_chapter_list")
             with Vertical(id="c_panel_right"):
-                yield TextArea("", id="w_chapter_content")
+                yield ChapterTextArea("", id="w_chapter_content")
                 with HorizontalGroup(id="c_bottom_buttons"):
                     yield Button("向上合并", id="w_merge_up")
                     yield Button("向下分割", id="w_cursor_cut_down")
         with HorizontalGroup(id="c_bottom_panel"):
             yield Input(DEFAULT_CUT_CHAPTER_RE, placeholder="分割规则 正则表达式", id="w_cut_rule_text")
+            yield Label("", id="w_cut_rule_preview")
             yield Button("按规则分割", id="w_rule_cut")
 
+    def load_chapter_text(self, text: str):
+        text_area: ChapterTextArea = self.query_exactly_one("#w_chapter_content")
+        self.loading_text_count += 1
+        text_area.load_text(text)
+
+    def flush_edits(self):
+        """
+        Apply the edits recorded by the text area to the showing chapter.
+        """
+        if self.edit_timer != None:
+            self.edit_timer.stop()
+            self.edit_timer = None
+        text_area: ChapterTextArea = self.query_exactly_one("#w_chapter_content")
+        edits, full_sync = text_area.take_edits()
+        index = self.is_showing_index
+        if index < 0 or index >= len(self.ctx.chapters) or (len(edits) <= 0 and not full_sync):
+            return
+        doc = text_area.document
+        title = self.ctx.chapters.title(index)
+        if full_sync:
+            self.ctx.chapters.set_text(index, doc.text)
+        else:
+            for edit in edits:
+                self.ctx.chapters.replace_range(index, edit.start, edit.end, edit.text)
+            if any(edit.top_row == 0 for edit in edits):
+                first_line = doc.get_line(0).strip()
+                if first_line == "":
+                    first_line = ChapterStore.first_line(doc.text)
+                self.ctx.chapters.set_title(index, first_line)
+        self.ctx.save_chapters()
+        if self.ctx.chapters.title(index) != title:
+            # update list display
+            self.update_chapter_title(index)
+
+    def update_chapter_title(self, index: int):
+        chapter_list: ChapterListView = self.query_exactly_one("#c_chapter_list")
+        chapter_list.refresh_row(index)
+
     @on(Button.Pressed, "#w_merge_up")
     def on_merge_up(self, _: Button.Pressed):
         index = self.is_showing_index
         if index < 0:
             self.notify("请先选择章节")
             return
+        self.flush_edits()
         if index >= 1 and index < len(self.ctx.chapters):
             last_index = index - 1
-            new_chapter_title = self.ctx.chapters[last_index][0]
-            new_chapter_content = self.ctx.chapters[last_index][1]
-            new_chapter_content += self.ctx.chapters[index][1]
-            self.ctx.chapters[last_index] = (
-                new_chapter_title,
-                new_chapter_content,
-            )
-            del self.ctx.chapters[index]
+            self.ctx.chapters.merge_up(index)
+            self.ctx.save_chapters()
             # update list view and text area
-            chapter_list: ListView = self.query_exactly_one("#c_chapter_list")
-            item: ListItem = chapter_list.query("ListItem")[last_index]
-            item.query("Label").remove()
-            item.mount(Label(new_chapter_title))
-            chapter_list.remove_items([index])
+            chapter_list: ChapterListView = self.query_exactly_one("#c_chapter_list")
+            chapter_list.rows_changed(last_index)
             chapter_list.index = last_index
             chapter_list.action_select_cursor()
 
@@ -101,86 +120,192 @@ class CutChaptersTab(Vertical):
         if index < 0:
             self.notify("请先选择章节")
             return
+        self.flush_edits()
         text_area: TextArea = self.query_exactly_one("#w_chapter_content")
-        doc = text_area.document
-        cursor_localtion = text_area.cursor_location
-        text_before = doc.get_text_range((0, 0), cursor_localtion)
-        text_after = doc.get_text_range(cursor_localtion, doc.end)
-        if len(text_after) <= 0 or len(text_before) <= 0:
+        text = self.ctx.chapters.text(index)
+        offset = location_to_offset(text, text_area.cursor_location)
+        if offset <= 0 or offset >= len(text):
             self.notify("无法在光标位置处分割章节")
             return
         # update chapter, list view and text area
         new_index = index + 1
-        chapter_list: ListView = self.query_exactly_one("#c_chapter_list")
-        chapter1 = (text_before.splitlines()[0].strip(), text_before)
-        self.ctx.chapters[index] = chapter1
-        chapter2 = (text_after.splitlines()[0].strip(), text_after)
-        self.ctx.chapters.insert(new_index, chapter2)
-        item: ListItem = chapter_list.query("ListItem")[index]
-        item.query("Label").remove()
-        item.mount(Label(chapter1[0]))
-        chapter_list.insert(new_index, [
-            ListItem(Label(chapter2[0])),
-        ])
+        self.ctx.chapters.split(index, offset)
+        self.ctx.save_chapters()
+        chapter_list: ChapterListView = self.query_exactly_one("#c_chapter_list")
+        chapter_list.rows_changed(index)
         chapter_list.index = new_index
         chapter_list.action_select_cursor()
 
     @on(Button.Pressed, "#w_rule_cut")
     async def on_rule_cut_chapter(self, _: Button.Pressed):
+        if self.is_splitting:
+            self.workers.cancel_group(self, "split")
+            return
         if self.ctx.selected_txt_path == None:
             self.notify("请先打开一本txt小说")
             return
-        # loading
-        await self.query_exactly_one("#c_panel_left").mount(LoadingIndicator())
+        self.flush_edits()
+        # get rule
+        input_field: Input = self.query_exactly_one("#w_cut_rule_text")
+        reg = input_field.value
         try:
-            # get rule
-            input_field: Input = self.query_exactly_one("#w_cut_rule_text")
-            reg = input_field.value
-            # cut
-            chapters = split_chapters_by_regexp(
-                reg, self.ctx.selected_txt_path)
-            self.ctx.chapters = chapters
-            # update display
-            chapter_list: ListView = self.query_exactly_one("#c_chapter_list")
-            await chapter_list.clear()
-            await chapter_list.extend(ListItem(Label(ch[0])) for ch in self.ctx.chapters)
-            chapter_list.refresh()
-            # clear text area
-            text_area: TextArea = self.query_exactly_one("#w_chapter_content")
-            text_area.load_text("")
-            self.is_showing_index = -1
+            re_compile(reg)
         except re_error as e:
             self.notify(f"正则表达式错误: {e}")
             return
+        # loading
+        self.is_splitting = True
+        self.query_exactly_one("#w_rule_cut").label = "取消分割"
+        await self.query_exactly_one("#c_panel_left").mount(LoadingIndicator())
+        self.split_chapters(reg, self.ctx.selected_txt_path)
+
+    @work(thread=True, exclusive=True, group="split")
+    def split_chapters(self, reg: str, path: PathLike):
+        worker = get_current_worker()
+        store = None
+        sha256 = ""
+        error = ""
+        start = perf_counter()
+        seconds = 0.0
+        try:
+            total = max(1, getsize(path))
+            last_report = monotonic()
+
+            def report_progress(scanned: int, chapters: int) -> bool:
+                nonlocal last_report
+                if monotonic() - last_report >= SPLIT_STATUS_INTERVAL:
+                    last_report = monotonic()
+                    self.post_message(MainAppEvent.SetStatusText(
+                        f"分割中: {chapters} 章, {scanned / total * 100 :.1f}%"))
+                return worker.is_cancelled
+
+            # the scan starts again with another encoding if a block does not decode
+            encoding, spans = split_chapter_spans(reg, path, report_progress)
+            store = ChapterStore(path, encoding, spans)
+            seconds = perf_counter() - start
+            if not worker.is_cancelled:
+                sha256 = file_sha256(path)
+        except (OSError, UnicodeError) as e:
+            # the chapters before stay
+            store = None
+            error = str(e)
         finally:
-            # end loading
-            await self.query_exactly_one("#c_panel_left LoadingIndicator").remove()
+            cancelled = worker.is_cancelled
+            self.app.call_from_thread(
+                self.finish_split, None if cancelled else store, reg, sha256, seconds, error)
 
-    @on(ListView.Selected, "#c_chapter_list")
-    def on_select_chapter(self, event: ListView.Selected):
-        index = event.list_view.index
+    async def finish_split(
+        self, store: ChapterStore | None, reg: str = "", sha256: str = "", seconds: float = 0.0, error: str = "",
+    ):
+        """
+        Show the split chapters, store is None if the split is cancelled or failed with error.
+        """
+        self.is_splitting = False
+        self.query_exactly_one("#w_rule_cut").label = "按规则分割"
+        # end loading
+        await self.query_exactly_one("#c_panel_left LoadingIndicator").remove()
+        if error != "":
+            self.notify(f"分割失败: {error}", severity="error")
+            self.post_message(MainAppEvent.SetStatusText(f"分割失败: {error}"))
+            return
+        if store == None:
+            self.post_message(MainAppEvent.SetStatusText("已取消分割"))
+            return
+        self.flush_edits()
+        self.ctx.chapters = store
+        if sha256 != "":
+            project = self.ctx.open_project(create=True)
+            project.save_source(store.file, store.encoding, reg, sha256)
+            project.save_chapters(store)
+            metrics = PipelineMetrics(project.path.with_name(METRICS_LOG_NAME))
+            metrics.on_split(str(store.file), seconds, len(store))
+            metrics.close()
+        self.post_message(MainAppEvent.SetStatusText(f"分割完成: {len(store)} 章, 用时 {seconds:.2f} 秒"))
+        self.show_chapters()
+
+    def show_chapters(self):
+        """
+        Show the chapters of the context, after split or another novel is opened.
+        """
+        chapter_list: ChapterListView = self.query_exactly_one("#c_chapter_list")
+        chapter_list.set_chapters(self.ctx.chapters)
+        # clear text area
+        self.load_chapter_text("")
+        self.is_showing_index = -1
+
+    def on_show(self, _: events.Show):
+        chapter_list: ChapterListView = self.query_exactly_one("#c_chapter_list")
+        if chapter_list.chapters is self.ctx.chapters:
+            return
+        # edits not applied yet belong to the chapters of the previous novel
+        if self.edit_timer != None:
+            self.edit_timer.stop()
+            self.edit_timer = None
+        text_area: ChapterTextArea = self.query_exactly_one("#w_chapter_content")
+        text_area.take_edits()
+        self.show_chapters()
+        self.restore_rule()
+
+    def on_mount(self):
+        # mounted when first shown, the chapters of the context may be restored already
+        self.restore_rule()
+
+    def restore_rule(self):
+        """
+        Show the rule of the restored chapters.
+        """
+        source = self.ctx.project.source() if self.ctx.project != None else None
+        if source != None and len(self.ctx.chapters) > 0:
+            self.query_exactly_one("#w_cut_rule_text").value = source.rule
+
+    @on(Input.Changed, "#w_cut_rule_text")
+    def on_cut_rule_changed(self, event: Input.Changed):
+        if self.ctx.selected_txt_path == None:
+            return
+        self.preview_rule(event.value, self.ctx.selected_txt_path)
+
+    @work(thread=True, exclusive=True, group="preview")
+    def preview_rule(self, reg: str, path: PathLike):
+        worker = get_current_worker()
+        # wait for typing
+        sleep(PREVIEW_DELAY)
+        if worker.is_cancelled:
+            return
+        try:
+            encoding = detect_encoding(path)
+            if encoding == None:
+                text = "无法识别编码"
+            else:
+                matches, sampled, size = count_title_matches(reg, path, encoding)
+                text = f"匹配 {matches} 行" if sampled >= size else f"前 {sampled * 100 // size}% 匹配 {matches} 行"
+        except re_error:
+            text = "正则表达式错误"
+        except (OSError, UnicodeError) as e:
+            # the file may be removed or unreadable while the rule is typed
+            text = f"无法读取: {e}"
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self.show_preview, text)
+
+    def show_preview(self, text: str):
+        label: Label = self.query_exactly_one("#w_cut_rule_preview")
+        label.update(text)
+
+    @on(ChapterListView.Selected, "#c_chapter_list")
+    def on_select_chapter(self, event: ChapterListView.Selected):
+        index = event.index
+        self.flush_edits()
         if index >= 0 and index < len(self.ctx.chapters):
             self.is_showing_index = index
-            text = self.ctx.chapters[index][1]
-            text_area: TextArea = self.query_exactly_one("#w_chapter_content")
-            text_area.load_text(text)
+            self.load_chapter_text(self.ctx.chapters.text(index))
 
     @on(TextArea.Changed, "#w_chapter_content")
-    def on_chapter_content_changed(self, event: TextArea.Changed):
-        if self.ctx.selected_txt_path == None:
-            return
-        index = self.is_showing_index
-        if index < 0 or index >= len(self.ctx.chapters):
+    def on_chapter_content_changed(self, _: TextArea.Changed):
+        if self.loading_text_count > 0:
+            self.loading_text_count -= 1
             return
-        doc = event.text_area.document
-        if len(doc.lines) <= 0:
+        if self.ctx.selected_txt_path == None:
             return
-        first_line = doc.get_line(0).strip()
-        chapter = self.ctx.chapters[index]
-        self.ctx.chapters[index] = (first_line, doc.text)
-        if first_line != chapter[0]:
-            # update list display
-            chapter_list: ListView = self.query_exactly_one("#c_chapter_list")
-            item: ListItem = chapter_list.query("ListItem")[index]
-            item.query("Label").remove()
-            item.mount(Label(first_line))
+        # apply after typing stopped
+        if self.edit_timer != None:
+            self.edit_timer.stop()
+        self.edit_timer = self.set_timer(EDIT_DEBOUNCE, self.flush_edits)
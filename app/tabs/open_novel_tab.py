@@ -1,19 +1,61 @@
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 from textual import on
 from textual.containers import Vertical
 from textual.widgets import DirectoryTree
+from textual.worker import Worker
+from app.chapter_store import ChapterStore
 from app.context import ContextData, MainAppEvent
-from os import makedirs
+from os import makedirs, scandir
 
 
 class FilteredDirectoryTree(DirectoryTree):
+    """
+    Shows the directories and the txt files.
+
+    Directories are listed in the loader thread of DirectoryTree with `os.scandir`, which knows
+    the entry types without a stat call on most file systems. The types are remembered,
+    so adding the nodes in the UI thread does not stat every entry again.
+
+    `_directory_content` and `_safe_is_dir` override private methods of DirectoryTree,
+    checked against the Textual version pinned in requirements.txt by tests/test_open_novel_tab.py.
+    If a later version renames them, the tree falls back to stat calls but still lists the same entries.
+    """
+
+    def __init__(self, path: str | Path, *, name=None, id=None, classes=None, disabled=False):
+        self.__is_dir: dict[Path, bool] = {}
+        super().__init__(path, name=name, id=id, classes=classes, disabled=disabled)
+
+    def _directory_content(self, location: Path, worker: Worker) -> Iterator[Path]:
+        try:
+            with scandir(location) as entries:
+                for entry in entries:
+                    if worker.is_cancelled:
+                        break
+                    path = location / entry.name
+                    try:
+                        self.__is_dir[path] = entry.is_dir()
+                    except OSError:
+                        self.__is_dir[path] = False
+                    yield path
+        except OSError:
+            pass
+
+    def _safe_is_dir(self, path: Path) -> bool:
+        is_dir = self.__is_dir.get(path)
+        if is_dir != None:
+            return is_dir
+        try:
+            return path.is_dir()
+        except OSError:
+            return False
+
     def filter_paths(self, paths: Iterable[Path]) -> Iterable[Path]:
         for path in paths:
             if not path.name.startswith("."):
                 if path.name.endswith(".txt"):
                     yield path
-                elif path.is_dir():
+                elif self._safe_is_dir(path):
                     yield path
 
 
@@ -30,6 +72,10 @@ class OpenNovelTab(Vertical):
     async def on_file_selected(self, event: FilteredDirectoryTree.FileSelected):
         if event.path.suffix == ".txt":
             self.ctx.selected_txt_path = event.path
+            project = self.ctx.open_project()
+            store = project.load_chapters(event.path) if project != None else None
+            self.ctx.chapters = store if store != None else ChapterStore()
+            restored = f", 已恢复 {len(store)} 章" if store != None else ""
             self.post_message(MainAppEvent.SetStatusText(
-                f"已打开: {event.path.name}"))
+                f"已打开: {event.path.name}{restored}"))
             self.post_message(MainAppEvent.SetActiveTab("t_cut_chapter"))
@@ -1,8 +1,195 @@
-from textual.containers import Vertical
-from app.context import ContextData
+from textual import on, work
+from textual.containers import Vertical, HorizontalGroup
+from textual.widgets import Button, Checkbox, Input, Label, ProgressBar, Static
+from textual.worker import get_current_worker
+from app.audiobook import BookChapter, assemble_audiobook, find_book_chapters
+from app.context import ContextData, MainAppEvent
+from app.metrics import METRICS_LOG_NAME, PipelineMetrics
+from app.text_normalizer import get_normalizer
+from app.tts_engine import (
+    TTSEngine, ConvertOptions,
+    DEFAULT_VOICE, DEFAULT_RATE, DEFAULT_CONCURRENCY,
+    STATE_RUNNING, STATE_DONE, STATE_FAILED,
+)
+from app.tts_backend import PooledTTSBackend
+from app.tts_cache import SynthesisCache
+from re import error as re_error
 
 
 class TTSConvertTab(Vertical):
     def __init__(self, ctx: ContextData, *children, name=None, id=None, classes=None, disabled=False):
         super().__init__(*children, name=name, id=id, classes=classes, disabled=disabled)
         self.ctx = ctx
+        self.engine: TTSEngine | None = None
+        self.metrics: PipelineMetrics | None = None
+        self.cache: SynthesisCache | None = None
+        # warm connections are kept between conversions
+        self.backend = PooledTTSBackend()
+
+    def compose(self):
+        with HorizontalGroup(id="c_tts_options"):
+            yield Label("语音")
+            yield Input(DEFAULT_VOICE, placeholder="语音", id="w_tts_voice")
+            yield Label("语速")
+            yield Input(DEFAULT_RATE, placeholder="语速 如-20%", id="w_tts_rate")
+            yield Label("并发数")
+            yield Input(str(DEFAULT_CONCURRENCY), placeholder="并发数", type="integer", id="w_tts_concurrency")
+        with HorizontalGroup(id="c_tts_text_options"):
+            # changes the chapter keys, the converted chapters are converted again
+            yield Checkbox("精简文本", id="w_tts_normalize")
+            yield Input("", placeholder="不合成包含此正则表达式的行 如网站水印", id="w_tts_strip_pattern")
+        with HorizontalGroup(id="c_tts_buttons"):
+            yield Button("开始转换", id="w_tts_start")
+            yield Button("停止", id="w_tts_stop", disabled=True)
+            yield Button("合并为有声书", id="w_tts_assemble")
+        yield ProgressBar(id="w_tts_progress", show_eta=False)
+        yield Static("", id="w_tts_stats")
+        yield Static("", id="w_tts_running")
+
+    # ======== utils ========
+
+    def get_options(self) -> ConvertOptions:
+        """
+        Options from the inputs, the concurrency is at least 1.
+
+        Raises:
+            ValueError: If the concurrency is not an integer.
+        """
+        voice: Input = self.query_exactly_one("#w_tts_voice")
+        rate: Input = self.query_exactly_one("#w_tts_rate")
+        concurrency: Input = self.query_exactly_one("#w_tts_concurrency")
+        normalize: Checkbox = self.query_exactly_one("#w_tts_normalize")
+        # one pattern, alternatives are joined with | by the user
+        strip_pattern: Input = self.query_exactly_one("#w_tts_strip_pattern")
+        try:
+            concurrency_count = int(concurrency.value.strip() or DEFAULT_CONCURRENCY)
+        except ValueError:
+            raise ValueError(f"并发数不是整数: {concurrency.value}")
+        return ConvertOptions(
+            voice=voice.value.strip() or DEFAULT_VOICE,
+            rate=rate.value.strip() or DEFAULT_RATE,
+            concurrency=max(1, concurrency_count),
+            normalize=normalize.value,
+            strip_patterns=(strip_pattern.value,) if strip_pattern.value.strip() != "" else (),
+        )
+
+    def set_running(self, running: bool):
+        self.query_exactly_one("#w_tts_start").disabled = running
+        self.query_exactly_one("#w_tts_stop").disabled = not running
+        self.query_exactly_one("#w_tts_assemble").disabled = running
+
+    def update_progress_display(self):
+        if self.engine == None:
+            return
+        chapters = self.engine.chapters
+        finished = sum(1 for ch in chapters if ch.state in (STATE_DONE, STATE_FAILED))
+        progress_bar: ProgressBar = self.query_exactly_one("#w_tts_progress")
+        progress_bar.update(total=len(self.ctx.chapters), progress=finished)
+        stats = self.engine.limiter.stats()
+        self.query_exactly_one("#w_tts_stats").update(
+            f"请求并发上限 {stats['limit']:.1f}  进行中 {stats['in_flight']}  成功 {stats['successes']}"
+            f"  失败 {stats['errors']}  限流 {stats['throttled']}  重试 {stats['retries']}"
+        )
+        if self.metrics != None:
+            self.post_message(MainAppEvent.SetStatusText(self.metrics.status_text()))
+        running = [ch for ch in chapters if ch.state == STATE_RUNNING]
+        running_text = "\n".join(f"{ch.progress * 100 :>6.2f}% {ch.title}" for ch in running)
+        self.query_exactly_one("#w_tts_running").update(running_text)
+
+    # ======== events ========
+
+    async def on_unmount(self):
+        await self.backend.close()
+
+    @on(Button.Pressed, "#w_tts_start")
+    def on_start(self, _: Button.Pressed):
+        if len(self.ctx.chapters) <= 0:
+            self.notify("请先分割章节")
+            return
+        try:
+            get_normalizer(self.get_options().strip_patterns)
+        except ValueError as e:
+            self.post_message(MainAppEvent.SetStatusText(str(e)))
+            return
+        except re_error as e:
+            self.notify(f"正则表达式错误: {e}")
+            return
+        self.convert_chapters()
+
+    @on(Button.Pressed, "#w_tts_stop")
+    def on_stop(self, _: Button.Pressed):
+        self.workers.cancel_group(self, "tts")
+
+    @on(Button.Pressed, "#w_tts_assemble")
+    def on_assemble(self, _: Button.Pressed):
+        if self.ctx.selected_txt_path == None or len(self.ctx.chapters) <= 0:
+            self.notify("请先分割章节")
+            return
+        chapters, missing = find_book_chapters(self.ctx.chapters, self.ctx.get_output_dir())
+        if len(chapters) <= 0:
+            self.notify("没有已转换的章节")
+            return
+        if missing > 0:
+            self.notify(f"{missing} 章未转换, 将被跳过")
+        self.query_exactly_one("#w_tts_assemble").disabled = True
+        self.query_exactly_one("#w_tts_start").disabled = True
+        self.assemble_book(chapters)
+
+    @work(thread=True, exclusive=True, group="assemble")
+    def assemble_book(self, chapters: list[BookChapter]):
+        worker = get_current_worker()
+        output_dir = self.ctx.get_output_dir()
+        stem = self.ctx.selected_txt_path.stem
+
+        def report_progress(finished: int, total: int):
+            if not worker.is_cancelled:
+                self.post_message(MainAppEvent.SetStatusText(f"合并中: {finished}/{total} 章"))
+
+        try:
+            marks = assemble_audiobook(
+                chapters,
+                output_dir / f"{stem}.mp3",
+                stem,
+                output_dir / f"{stem}.lrc",
+                output_dir / f"{stem}.cue",
+                report_progress,
+            )
+            duration_s = marks[-1].end_ms // 1000 if len(marks) > 0 else 0
+            self.post_message(MainAppEvent.SetStatusText(
+                f"合并完成: {len(marks)} 章, {duration_s // 3600}:{duration_s // 60 % 60:02d}:{duration_s % 60:02d}"))
+        except (OSError, ValueError) as e:
+            self.post_message(MainAppEvent.SetStatusText(f"合并失败: {e}"))
+        finally:
+            self.app.call_from_thread(self.set_running, False)
+
+    @work(exclusive=True, group="tts")
+    async def convert_chapters(self):
+        if self.cache == None:
+            self.cache = SynthesisCache()
+        options = self.get_options()
+        self.backend.pool_size = options.concurrency * options.chunk_concurrency
+        project = self.ctx.open_project(create=True)
+        # another novel may be opened before the conversion finishes
+        project.hold()
+        self.metrics = PipelineMetrics(project.path.with_name(METRICS_LOG_NAME))
+        self.engine = TTSEngine(
+            self.ctx.get_output_dir(), options, cache=self.cache, backend=self.backend,
+            project=project, metrics=self.metrics,
+        )
+        self.set_running(True)
+        timer = self.set_interval(0.5, self.update_progress_display)
+        try:
+            chapters = await self.engine.convert(self.ctx.chapters)
+            failed = [ch for ch in chapters if ch.state == STATE_FAILED]
+            skipped = [ch for ch in chapters if ch.skipped]
+            summary = self.metrics.summary()
+            status = f"转换完成: {len(chapters) - len(failed)} 成功 ({len(skipped)} 已跳过), {len(failed)} 失败"
+        finally:
+            timer.stop()
+            self.update_progress_display()
+            self.metrics.close()
+            self.metrics = None
+            project.release()
+            self.set_running(False)
+        self.post_message(MainAppEvent.SetStatusText(
+            f"{status}, {summary['chars_per_sec']:.0f} 字/秒, RTF {summary['rtf']:.3f}"))
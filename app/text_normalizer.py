@@ -0,0 +1,175 @@
+"""
+Normalize chapter text before synthesis, so the requests carry less text and the audio less noise.
+
+    full-width letters, digits and spaces   -> half-width, one byte instead of three in UTF-8
+    blank lines and paragraph indents       -> one line break
+    runs of spaces                          -> one space
+    separator lines like ------ or ******   -> removed
+    lines matching `strip_patterns`         -> removed, for the watermark and ad lines of a site
+    runs of the same punctuation            -> one, two for … and —, three for . and 。 which make an ellipsis
+
+The normalized text keeps a map from each of its positions to the original text,
+so the subtitles can be cut from the original text the reader sees.
+"""
+import re
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable
+
+# full-width digits and letters, and the ideographic space; full-width punctuation is kept, it reads differently
+FULLWIDTH_TABLE = {
+    **{code: code - 0xFEE0 for code in range(0xFF10, 0xFF1A)},
+    **{code: code - 0xFEE0 for code in range(0xFF21, 0xFF3B)},
+    **{code: code - 0xFEE0 for code in range(0xFF41, 0xFF5B)},
+    0x3000: 0x20,
+}
+FULLWIDTH_CHARS = "０-９Ａ-Ｚａ-ｚ"
+SPACE_CHARS = " \t\u3000"
+# a line of only . or — is a pause or trailing-off speech, it is shortened by the ellipsis and paired rules
+SEPARATOR_CHARS = r"\-=_*~#·"
+PUNCTUATION_CHARS = r"，！？、；：,!?;:～~"
+PAIRED_PUNCTUATION_CHARS = r"…—"
+# ... and 。。。 are ellipses, not one period
+ELLIPSIS_CHARS = r".。"
+
+
+@dataclass
+class NormalizedText:
+    text: str
+    # position in the original text of each character, and the length of the original text at the end
+    positions: array
+
+    def to_original(self, pos: int) -> int:
+        """
+        Position in the original text of a position in the normalized text, negative counts from the end.
+        """
+        if pos < 0:
+            pos += len(self.text)
+        return self.positions[min(max(pos, 0), len(self.text))]
+
+
+class TextNormalizer:
+    """
+    TextNormalizer shortens the text to synthesize with precompiled patterns, a pass over the lines
+    for the strip patterns and a single pass of the other rules, and keeps the position map back to the original.
+    """
+
+    def __init__(self, strip_patterns: Iterable[str] = ()):
+        """
+        TextNormalizer shortens the text to synthesize with precompiled patterns.
+
+        Args:
+            strip_patterns (Iterable[str]): Regular expressions, lines containing a match are removed.
+                Each is compiled alone, so inline flags and back references keep their meaning.
+
+        Raises:
+            re.error: If a strip pattern is invalid.
+        """
+        self.strip_patterns = [re.compile(pattern) for pattern in strip_patterns]
+        alternatives = [
+            rf"(?P<separator>^[{SPACE_CHARS}]*[{SEPARATOR_CHARS}]{{3,}}[{SPACE_CHARS}\r]*(?:\n|$)(?:[{SPACE_CHARS}\r]*\n)*)",
+            # only the line breaks which change, a single \n does not match
+            rf"(?P<newline>[{SPACE_CHARS}]+\r?\n(?:[{SPACE_CHARS}\r]*\n)*|\r\n(?:[{SPACE_CHARS}\r]*\n)*|\n(?:[{SPACE_CHARS}\r]*\n)+)",
+            rf"(?P<indent>^[{SPACE_CHARS}]+)",
+            rf"(?P<space>[{SPACE_CHARS}]{{2,}}|\u3000)",
+            rf"(?P<fullwidth>[{FULLWIDTH_CHARS}]+)",
+            rf"(?P<paired>(?P<paired_char>[{PAIRED_PUNCTUATION_CHARS}])(?P=paired_char){{2,}})",
+            rf"(?P<ellipsis>(?P<ellipsis_char>[{ELLIPSIS_CHARS}])(?P=ellipsis_char){{3,}})",
+            rf"(?P<punctuation>(?P<punctuation_char>[{PUNCTUATION_CHARS}])(?P=punctuation_char)+)",
+        ]
+        # every alternative starts at a line start or with one of these, most positions fail at the lookahead
+        first_chars = (
+            rf"[{SPACE_CHARS}\r\n{FULLWIDTH_CHARS}{PUNCTUATION_CHARS}{PAIRED_PUNCTUATION_CHARS}{ELLIPSIS_CHARS}]"
+        )
+        self.pattern = re.compile(rf"(?=^|{first_chars})(?:{'|'.join(alternatives)})", re.MULTILINE)
+
+    def __replacement(self, mt: re.Match) -> str:
+        kind = mt.lastgroup
+        if kind == "newline":
+            return "\n"
+        if kind == "space":
+            return " "
+        if kind == "fullwidth":
+            return mt[0].translate(FULLWIDTH_TABLE)
+        if kind == "paired":
+            return mt["paired_char"] * 2
+        if kind == "ellipsis":
+            return mt["ellipsis_char"] * 3
+        if kind == "punctuation":
+            return mt["punctuation_char"]
+        # separator, indent
+        return ""
+
+    def __stripped_ranges(self, text: str) -> list[tuple[int, int]]:
+        """
+        Ranges of the lines containing a match of a strip pattern, with their line breaks and the blank lines after them.
+        """
+        ranges: list[tuple[int, int]] = []
+        if len(self.strip_patterns) <= 0:
+            return ranges
+        searches = [pattern.search for pattern in self.strip_patterns]
+        pos = 0
+        for line in text.split("\n"):
+            end = min(pos + len(line) + 1, len(text))
+            if len(ranges) > 0 and ranges[-1][1] == pos and line.strip(SPACE_CHARS + "\r") == "":
+                # a blank line after a removed line
+                ranges[-1] = (ranges[-1][0], end)
+            elif any(search(line) != None for search in searches):
+                ranges.append((pos, end))
+            pos = end
+        return ranges
+
+    def strip_lines(self, text: str) -> NormalizedText | None:
+        """
+        Remove the lines containing a match of a strip pattern, with their line breaks and the blank lines after them.
+
+        Returns:
+            NormalizedText | None: None if no line is removed.
+        """
+        ranges = self.__stripped_ranges(text)
+        if len(ranges) <= 0:
+            return None
+        pieces: list[str] = []
+        positions = array("I")
+        last = 0
+        for start, end in ranges:
+            pieces.append(text[last:start])
+            positions.extend(range(last, start))
+            last = end
+        pieces.append(text[last:])
+        positions.extend(range(last, len(text) + 1))
+        return NormalizedText("".join(pieces), positions)
+
+    def normalize(self, text: str) -> NormalizedText:
+        pieces: list[str] = []
+        positions = array("I")
+        last = 0
+        # the text between the removed lines is normalized part by part, each part starts at a line start
+        for strip_start, strip_end in self.__stripped_ranges(text) + [(len(text), len(text))]:
+            for mt in self.pattern.finditer(text, last, strip_start):
+                start, end = mt.span()
+                replacement = self.__replacement(mt)
+                pieces.append(text[last:start])
+                positions.extend(range(last, start))
+                pieces.append(replacement)
+                if mt.lastgroup == "newline":
+                    # the line break after the trailing spaces
+                    positions.append(text.index("\n", start))
+                else:
+                    # the replacement is a prefix of the match, one character for it or the same length
+                    positions.extend(range(start, start + len(replacement)))
+                last = end
+            pieces.append(text[last:strip_start])
+            positions.extend(range(last, strip_start))
+            last = strip_end
+        positions.append(len(text))
+        return NormalizedText("".join(pieces), positions)
+
+
+@lru_cache(maxsize=8)
+def get_normalizer(strip_patterns: tuple[str, ...] = ()) -> TextNormalizer:
+    """
+    Returns a shared normalizer, patterns are compiled once for each set of strip patterns.
+    """
+    return TextNormalizer(strip_patterns)
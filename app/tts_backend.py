@@ -0,0 +1,308 @@
+"""
+TTS backends yield the same TTSChunk dicts as `edge_tts.Communicate.stream`,
+`{"type": "audio", "data": ...}` and `{"type": "WordBoundary", "offset": ..., "duration": ..., "text": ...}`.
+"""
+import json
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+from typing import AsyncIterator
+from xml.sax.saxutils import escape, unescape
+import aiohttp
+import edge_tts as tts
+from edge_tts.exceptions import NoAudioReceived, UnexpectedResponse, WebSocketError
+from edge_tts.typing import TTSChunk
+# not public API of edge-tts, only used after check_edge_tts_version
+from app import edge_tts_internals as internals
+from app.metrics import RequestTiming
+
+# edge-tts splits longer text into several requests, keep chunks below it
+MAX_REQUEST_BYTES = 4096
+DEFAULT_POOL_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 30.0
+# Sec-MS-GEC token of a connection is valid for 5 minutes
+DEFAULT_MAX_AGE = 240.0
+SPEECH_CONFIG = (
+    "Content-Type:application/json; charset=utf-8\r\n"
+    "Path:speech.config\r\n\r\n"
+    '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+    '"sentenceBoundaryEnabled":"false","wordBoundaryEnabled":"true"'
+    "},"
+    '"outputFormat":"audio-24khz-48kbitrate-mono-mp3"'
+    "}}}}\r\n"
+)
+
+
+class TTSBackend(ABC):
+    """
+    Interface of speech synthesis services.
+    """
+
+    @abstractmethod
+    def stream(
+        self, text: str, voice: str, rate: str, pitch: str, timing: RequestTiming | None = None,
+    ) -> AsyncIterator[TTSChunk]:
+        """
+        Synthesize text, yields audio and WordBoundary chunks.
+        Backends which know the connect time record it in timing.
+
+        Raises:
+            NoAudioReceived: If the text has nothing to speak.
+        """
+
+    async def close(self):
+        pass
+
+
+class EdgeTTSBackend(TTSBackend):
+    """
+    Microsoft Edge online TTS through `edge_tts.Communicate`, one connection per request.
+    """
+
+    async def stream(
+        self, text: str, voice: str, rate: str, pitch: str, timing: RequestTiming | None = None,
+    ) -> AsyncIterator[TTSChunk]:
+        # the connection is made inside Communicate, connect time is not known
+        communicate = tts.Communicate(text, voice, rate=rate, pitch=pitch, boundary="WordBoundary")
+        async for chunk in communicate.stream():
+            yield chunk
+
+
+def parse_metadata(data: bytes) -> list[TTSChunk]:
+    chunks: list[TTSChunk] = []
+    for meta_obj in json.loads(data)["Metadata"]:
+        if meta_obj["Type"] == "WordBoundary":
+            chunks.append({
+                "type": "WordBoundary",
+                "offset": meta_obj["Data"]["Offset"],
+                "duration": meta_obj["Data"]["Duration"],
+                "text": unescape(meta_obj["Data"]["text"]["Text"]),
+            })
+    return chunks
+
+
+async def request_on_websocket(
+    websocket: aiohttp.ClientWebSocketResponse,
+    text: str,
+    voice: str,
+    rate: str,
+    pitch: str,
+) -> AsyncIterator[TTSChunk]:
+    """
+    Run one synthesis turn on an open connection speaking the edge-tts protocol,
+    the connection can be used for the next turn after this finishes.
+    """
+    ssml = internals.mkssml(
+        internals.TTSConfig(voice, rate, "+0%", pitch, "WordBoundary"),
+        escape(internals.remove_incompatible_characters(text)),
+    )
+    if len(ssml.encode("utf-8")) > MAX_REQUEST_BYTES * 2:
+        raise ValueError("text is too long for one request")
+    await websocket.send_str(f"X-Timestamp:{internals.date_to_string()}\r\n{SPEECH_CONFIG}")
+    await websocket.send_str(
+        internals.ssml_headers_plus_data(internals.connect_id(), internals.date_to_string(), ssml))
+    audio_was_received = False
+    async for received in websocket:
+        if received.type == aiohttp.WSMsgType.TEXT:
+            encoded_data: bytes = received.data.encode("utf-8")
+            parameters, data = internals.get_headers_and_data(encoded_data, encoded_data.find(b"\r\n\r\n"))
+            path = parameters.get(b"Path", None)
+            if path == b"audio.metadata":
+                for chunk in parse_metadata(data):
+                    yield chunk
+            elif path == b"turn.end":
+                break
+        elif received.type == aiohttp.WSMsgType.BINARY:
+            if len(received.data) < 2:
+                raise UnexpectedResponse("We received a binary message, but it is missing the header length.")
+            header_length = int.from_bytes(received.data[:2], "big")
+            parameters, data = internals.get_headers_and_data(received.data, header_length)
+            if parameters.get(b"Path") != b"audio":
+                raise UnexpectedResponse("Received binary message, but the path is not audio.")
+            if len(data) > 0:
+                audio_was_received = True
+                yield {"type": "audio", "data": data}
+        elif received.type == aiohttp.WSMsgType.ERROR:
+            raise WebSocketError(str(received.data) if received.data else "Unknown error")
+        else:
+            # closed by the server in the middle of a turn
+            raise WebSocketError(f"Connection closed: {received.type}")
+    else:
+        raise WebSocketError("Connection closed")
+    if not audio_was_received:
+        raise NoAudioReceived("No audio was received.")
+
+
+class WebSocketTTSBackend(TTSBackend):
+    """
+    Speaks the edge-tts websocket protocol to a configurable url, one connection per request.
+    With the default url it is the Microsoft Edge online TTS, otherwise for example a local fake server.
+    """
+
+    def __init__(self, url: str | None = None):
+        """
+        Speaks the edge-tts websocket protocol to a configurable url, one connection per request.
+
+        Args:
+            url (str | None): Websocket url, Microsoft Edge online TTS if None.
+
+        Raises:
+            RuntimeError: If the installed edge-tts is not the version its internals are written for.
+        """
+        internals.check_edge_tts_version()
+        self.url = url
+
+    def connect_args(self) -> tuple[str, dict]:
+        """
+        Returns the url and headers of a new connection.
+        """
+        if self.url != None:
+            return self.url, {}
+        url = (
+            f"{internals.WSS_URL}&ConnectionId={internals.connect_id()}"
+            f"&Sec-MS-GEC={internals.DRM.generate_sec_ms_gec()}"
+            f"&Sec-MS-GEC-Version={internals.SEC_MS_GEC_VERSION}"
+        )
+        return url, internals.DRM.headers_with_muid(internals.WSS_HEADERS)
+
+    async def stream(
+        self, text: str, voice: str, rate: str, pitch: str, timing: RequestTiming | None = None,
+    ) -> AsyncIterator[TTSChunk]:
+        url, headers = self.connect_args()
+        async with aiohttp.ClientSession(trust_env=True) as session:
+            start = monotonic()
+            async with session.ws_connect(url, headers=headers, compress=15) as websocket:
+                if timing != None:
+                    timing.connect = monotonic() - start
+                async for chunk in request_on_websocket(websocket, text, voice, rate, pitch):
+                    yield chunk
+
+
+@dataclass
+class PoolStats:
+    connects: int = 0
+    reuses: int = 0
+    # idle connections found closed by the server, the request is sent again on a new one
+    reconnects: int = 0
+    # expired or broken connections closed by the pool
+    discarded: int = 0
+
+
+@dataclass
+class PooledConnection:
+    websocket: aiohttp.ClientWebSocketResponse
+    created: float
+    last_used: float
+
+
+class PooledTTSBackend(WebSocketTTSBackend):
+    """
+    Keeps warm websocket connections and reuses them for the next requests,
+    instead of a new TLS handshake for every chunk.
+
+    A connection goes back to the pool only after a complete turn. Idle connections
+    are checked before reuse, and a request on an idle connection which turns out to be
+    closed by the server is sent again on a new connection.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        """
+        Keeps warm websocket connections and reuses them for the next requests.
+
+        Args:
+            url (str | None): Websocket url, Microsoft Edge online TTS if None.
+            pool_size (int): Max idle connections kept.
+            idle_timeout (float): Close connections idle for longer, in seconds.
+            max_age (float): Close connections opened for longer, in seconds.
+        """
+        super().__init__(url)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.stats = PoolStats()
+        self.__session: aiohttp.ClientSession | None = None
+        self.__idle: deque[PooledConnection] = deque()
+
+    def __is_healthy(self, connection: PooledConnection) -> bool:
+        now = monotonic()
+        return (
+            not connection.websocket.closed
+            and connection.websocket.exception() == None
+            and now - connection.last_used < self.idle_timeout
+            and now - connection.created < self.max_age
+        )
+
+    async def __discard(self, connection: PooledConnection):
+        self.stats.discarded += 1
+        await connection.websocket.close()
+
+    async def __acquire(self) -> tuple[PooledConnection, bool]:
+        """
+        Returns a connection, and whether it is reused.
+        """
+        while len(self.__idle) > 0:
+            # the most recently used one is the least likely to be closed by the server
+            connection = self.__idle.pop()
+            if self.__is_healthy(connection):
+                self.stats.reuses += 1
+                return connection, True
+            await self.__discard(connection)
+        if self.__session == None or self.__session.closed:
+            self.__session = aiohttp.ClientSession(trust_env=True)
+        url, headers = self.connect_args()
+        websocket = await self.__session.ws_connect(url, headers=headers, compress=15)
+        self.stats.connects += 1
+        now = monotonic()
+        return PooledConnection(websocket, now, now), False
+
+    async def __release(self, connection: PooledConnection, healthy: bool):
+        if healthy and len(self.__idle) < self.pool_size:
+            connection.last_used = monotonic()
+            self.__idle.append(connection)
+        else:
+            await self.__discard(connection)
+
+    async def stream(
+        self, text: str, voice: str, rate: str, pitch: str, timing: RequestTiming | None = None,
+    ) -> AsyncIterator[TTSChunk]:
+        while True:
+            start = monotonic()
+            connection, reused = await self.__acquire()
+            if timing != None:
+                timing.reused = reused
+                timing.connect = 0.0 if reused else monotonic() - start
+            healthy = False
+            received = False
+            try:
+                async for chunk in request_on_websocket(connection.websocket, text, voice, rate, pitch):
+                    received = True
+                    yield chunk
+                healthy = True
+                return
+            except NoAudioReceived:
+                # the turn is finished, the connection is fine
+                healthy = True
+                raise
+            except (aiohttp.ClientError, WebSocketError, ConnectionError):
+                if not reused or received:
+                    raise
+                self.stats.reconnects += 1
+            finally:
+                await self.__release(connection, healthy)
+
+    async def close(self):
+        """
+        Close all connections, the requests still running fail.
+        """
+        while len(self.__idle) > 0:
+            await self.__idle.pop().websocket.close()
+        if self.__session != None:
+            await self.__session.close()
+            self.__session = None
@@ -0,0 +1,140 @@
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from os import PathLike, getpid, makedirs, replace, remove, scandir, utime
+from pathlib import Path
+from time import time
+from uuid import uuid4
+from edge_tts.typing import TTSChunk
+
+DEFAULT_CACHE_DIR = "./cache/tts"
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# temporary files older than this are left by a crashed process, younger ones may be written right now
+STALE_TMP_SECONDS = 3600.0
+
+
+def unique_tmp_path(path: PathLike | str, suffix: str = "tmp") -> str:
+    """
+    Temporary file of path, unique to the process and the call, so processes sharing a directory
+    never write the same temporary file.
+    """
+    return f"{path}.{getpid()}-{uuid4().hex[:8]}.{suffix}"
+
+
+def normalize_chunk_text(text: str) -> str:
+    """
+    Text that synthesizes to the same audio should produce the same cache key.
+    """
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+class SynthesisCache:
+    """
+    On disk cache of synthesized audio and WordBoundary messages,
+    keyed by the hash of (normalized text, voice, rate, pitch).
+    The least recently used entries are removed when the size goes over `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: PathLike | str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        """
+        On disk cache of synthesized audio and WordBoundary messages,
+        keyed by the hash of (normalized text, voice, rate, pitch).
+        The least recently used entries are removed when the size goes over `max_bytes`.
+
+        Args:
+            cache_dir (PathLike | str): Directory of the cache files.
+            max_bytes (int): Max total size of the cache files.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # key -> size, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        makedirs(self.cache_dir, exist_ok=True)
+        self.__load_index()
+
+    def __load_index(self):
+        # other processes sharing the directory may be writing entries now
+        stale_time = time() - STALE_TMP_SECONDS
+        found: dict[str, list] = {}
+        with scandir(self.cache_dir) as it:
+            for entry in it:
+                key, _, suffix = entry.name.partition(".")
+                if suffix.endswith(".tmp"):
+                    try:
+                        if entry.stat().st_mtime < stale_time:
+                            remove(entry.path)
+                    except FileNotFoundError:
+                        # renamed or removed by its writer
+                        pass
+                    continue
+                if suffix not in ("mp3", "json"):
+                    continue
+                stat = entry.stat()
+                info = found.setdefault(key, [0, 0, 0.0])
+                info[0] += 1
+                info[1] += stat.st_size
+                info[2] = max(info[2], stat.st_mtime)
+        for key, (count, size, mtime) in sorted(found.items(), key=lambda item: item[1][2]):
+            if count != 2:
+                # half written entry, left by a crash if stale
+                if mtime < stale_time:
+                    self.__remove_files(key)
+                continue
+            self.entries[key] = size
+            self.total_bytes += size
+        self.__evict()
+
+    def __audio_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp3"
+
+    def __meta_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def __remove_files(self, key: str):
+        for path in (self.__audio_path(key), self.__meta_path(key)):
+            try:
+                remove(path)
+            except FileNotFoundError:
+                # removed by another process sharing the directory
+                pass
+
+    def __evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.__remove_files(key)
+
+    @staticmethod
+    def make_key(text: str, voice: str, rate: str, pitch: str) -> str:
+        data = "\0".join((normalize_chunk_text(text), voice, rate, pitch))
+        return sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tuple[bytes, list[TTSChunk]] | None:
+        if key not in self.entries:
+            return None
+        try:
+            with open(self.__meta_path(key), "rt", encoding="utf-8") as f:
+                boundaries = json.load(f)
+            with open(self.__audio_path(key), "rb") as f:
+                audio = f.read()
+        except (OSError, ValueError):
+            self.total_bytes -= self.entries.pop(key)
+            self.__remove_files(key)
+            return None
+        self.entries.move_to_end(key)
+        utime(self.__meta_path(key))
+        return audio, boundaries
+
+    def put(self, key: str, audio: bytes, boundaries: list[TTSChunk]):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)
+        meta = json.dumps(boundaries, ensure_ascii=False).encode("utf-8")
+        for path, data in ((self.__audio_path(key), audio), (self.__meta_path(key), meta)):
+            tmp_path = unique_tmp_path(path)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            replace(tmp_path, path)
+        self.entries[key] = len(audio) + len(meta)
+        self.total_bytes += len(audio) + len(meta)
+        self.__evict()
@@ -0,0 +1,585 @@
+import asyncio
+import hashlib
+import json
+import re
+import zlib
+from dataclasses import dataclass
+from os import PathLike, makedirs, replace, remove, scandir
+from os.path import exists, getsize
+from pathlib import Path
+from time import monotonic, perf_counter, time
+from typing import Callable, Iterable
+import edge_tts as tts
+from edge_tts.exceptions import NoAudioReceived
+from edge_tts.typing import TTSChunk
+from app.lrc_maker import LRCMaker, SubtitleWriter
+from app.metrics import ChapterTiming, PipelineMetrics, RequestTiming
+from app.mp3 import mp3_duration_ms
+from app.project_db import ProjectDB, SynthesisRecord
+from app.text_normalizer import NormalizedText, get_normalizer
+from app.tts_backend import TTSBackend, EdgeTTSBackend
+from app.tts_cache import STALE_TMP_SECONDS, SynthesisCache, normalize_chunk_text, unique_tmp_path
+from app.tts_limiter import AdaptiveLimiter, backoff_delay
+
+DEFAULT_VOICE = "zh-CN-YunxiNeural"
+DEFAULT_RATE = "+0%"
+DEFAULT_PITCH = "+0Hz"
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_CHARS = 1000
+DEFAULT_CHUNK_CONCURRENCY = 4
+DEFAULT_RETRIES = 3
+# output written before a failure, kept beside the output file
+PARTIAL_SUFFIX = "partial"
+
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+INVALID_FILENAME_CHARS_RE = re.compile(r"[\\/:*?\"<>|\r\n\t]")
+# 句子结尾, 包括后面紧跟的引号括号
+SENTENCE_END_RE = re.compile(r"[。！？!?；;…]+[”’」』）)\"']*")
+
+
+@dataclass
+class ConvertOptions:
+    voice: str = DEFAULT_VOICE
+    rate: str = DEFAULT_RATE
+    pitch: str = DEFAULT_PITCH
+    concurrency: int = DEFAULT_CONCURRENCY
+    stop_ms: int = 100
+    cjk_chars_limit: int = -1
+    chunk_chars: int = DEFAULT_CHUNK_CHARS
+    chunk_concurrency: int = DEFAULT_CHUNK_CONCURRENCY
+    retries: int = DEFAULT_RETRIES
+    # "srt" and "vtt", written beside the LRC file
+    subtitle_formats: tuple[str, ...] = ()
+    # shorten the text to synthesize, the subtitles keep the original text;
+    # off by default, it changes the chapter keys so converted chapters with indents would be converted again
+    normalize: bool = False
+    # regular expressions, lines containing a match are not synthesized, such as site watermarks
+    strip_patterns: tuple[str, ...] = ()
+
+
+@dataclass
+class ChapterProgress:
+    index: int
+    title: str
+    state: str = STATE_PENDING
+    progress: float = 0.0
+    error: str = ""
+    # output directory, TTSEngine.output_dir if None
+    output_dir: Path | None = None
+    # project database, TTSEngine.project if None
+    project: ProjectDB | None = None
+    # finished in a previous run
+    skipped: bool = False
+    duration_ms: float = 0.0
+
+
+def chapter_file_stem(index: int, title: str) -> str:
+    """
+    File name (without suffix) of the chapter output, sortable by chapter index.
+    """
+    safe_title = INVALID_FILENAME_CHARS_RE.sub("_", title).strip(" .")[:64]
+    return f"{index + 1:04d} {safe_title}".rstrip()
+
+
+def remove_partial_files(path: PathLike | str):
+    """
+    Remove the partial output of the failed attempts before, and the temporary files left by crashed processes.
+    Younger temporary files may be written by another process right now.
+    """
+    path = Path(path)
+    stale_time = time() - STALE_TMP_SECONDS
+    with scandir(path.parent) as it:
+        for entry in it:
+            if not entry.name.startswith(f"{path.name}."):
+                continue
+            suffix = entry.name[len(path.name) + 1:]
+            try:
+                if suffix == PARTIAL_SUFFIX or (suffix.endswith(".part") and entry.stat().st_mtime < stale_time):
+                    remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def check_voice(voice: str, rate: str, pitch: str = DEFAULT_PITCH):
+    """
+    Check the voice options in the format of edge-tts, before any chapter is converted.
+
+    Raises:
+        ValueError: If the voice, rate or pitch is not valid, such as rate "10%" without a sign.
+    """
+    tts.Communicate(" ", voice, rate=rate, pitch=pitch)
+
+
+def normalize_chapter_text(text: str, options: ConvertOptions) -> NormalizedText | None:
+    """
+    The text to synthesize and its position map, None if the text is synthesized as it is.
+    Without `options.normalize`, only the lines matching `options.strip_patterns` are removed.
+    """
+    if options.normalize:
+        return get_normalizer(tuple(options.strip_patterns)).normalize(text)
+    if len(options.strip_patterns) > 0:
+        return get_normalizer(tuple(options.strip_patterns)).strip_lines(text)
+    return None
+
+
+def chapter_key(text: str, options: ConvertOptions, normalized: NormalizedText | None = None) -> str:
+    """
+    Hash of the chapter text and the options which change the output.
+    normalized is the result of `normalize_chapter_text` of the stripped text, computed if None.
+    """
+    values = [text, options.voice, options.rate, options.pitch, options.stop_ms, options.cjk_chars_limit]
+    if len(options.subtitle_formats) > 0:
+        # only when set, keys of the projects before stay the same
+        values.append(sorted(options.subtitle_formats))
+    if normalized == None:
+        normalized = normalize_chapter_text(text.strip(), options)
+    if normalized != None and normalized.text != text.strip():
+        # only when it changes the text, keys of the clean chapters stay the same
+        values.append(normalized.text)
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Split text after each sentence end mark, joining the result gives the original text.
+    """
+    sentences = []
+    pos = 0
+    for mt in SENTENCE_END_RE.finditer(text):
+        sentences.append(text[pos:mt.end()])
+        pos = mt.end()
+    if pos < len(text):
+        sentences.append(text[pos:])
+    return sentences
+
+
+def split_text_chunks(text: str, max_chars: int = DEFAULT_CHUNK_CHARS) -> list[str]:
+    """
+    Split text into chunks of at most max_chars characters, at paragraph boundaries if possible,
+    or else at sentence boundaries. A single sentence longer than max_chars is cut hard.
+    Joining the result gives the original text.
+
+    Chunk boundaries depend on the content of the paragraphs near them, not on the position
+    in the text, so an edit only changes the chunks around it and the others hit the cache.
+    """
+    min_chars = max_chars // 4
+    pieces: list[str] = []
+    for paragraph in text.splitlines(keepends=True):
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in split_sentences(paragraph):
+            for pos in range(0, len(sentence), max_chars):
+                pieces.append(sentence[pos:pos + max_chars])
+    chunks: list[str] = []
+    current: list[str] = []
+    current_len = 0
+    for piece in pieces:
+        if current_len + len(piece) > max_chars and current_len > 0:
+            chunks.append("".join(current))
+            current = []
+            current_len = 0
+        current.append(piece)
+        current_len += len(piece)
+        # content defined boundary, about 1 in 4 pieces
+        if current_len >= min_chars and zlib.crc32(piece.encode("utf-8")) % 4 == 0:
+            chunks.append("".join(current))
+            current = []
+            current_len = 0
+    if current_len > 0:
+        chunks.append("".join(current))
+    return chunks
+
+
+async def synthesize_chunk(
+    text: str,
+    options: ConvertOptions = ConvertOptions(),
+    backend: TTSBackend | None = None,
+    timing: RequestTiming | None = None,
+) -> tuple[bytes, list[TTSChunk]]:
+    """
+    Synthesize a short text, returns the audio and the WordBoundary messages.
+    Text without any speakable word gives empty audio.
+    Uses Microsoft Edge online TTS if backend is None.
+    With timing, the times to connect, to the first audio byte and to the end are recorded.
+    """
+    if backend == None:
+        backend = EdgeTTSBackend()
+    audio = bytearray()
+    boundaries: list[TTSChunk] = []
+    start = perf_counter()
+    try:
+        async for chunk in backend.stream(text, options.voice, options.rate, options.pitch, timing):
+            if chunk["type"] == "audio":
+                if timing != None and len(audio) <= 0:
+                    timing.first_byte = perf_counter() - start
+                audio.extend(chunk["data"])
+            elif chunk["type"] == "WordBoundary":
+                boundaries.append(chunk)
+    except NoAudioReceived:
+        return b"", []
+    finally:
+        if timing != None:
+            timing.total = perf_counter() - start
+            timing.audio_bytes = len(audio)
+    return bytes(audio), boundaries
+
+
+async def synthesize_chunk_with_retry(
+    text: str,
+    options: ConvertOptions = ConvertOptions(),
+    backend: TTSBackend | None = None,
+    limiter: AdaptiveLimiter | None = None,
+    metrics: PipelineMetrics | None = None,
+) -> tuple[bytes, list[TTSChunk]]:
+    """
+    Synthesize a short text, retry with jittered backoff on errors.
+    With a limiter, the request waits for a free slot, and reports its latency and errors.
+    With metrics, the timing of every attempt is recorded.
+    """
+    for retry in range(options.retries + 1):
+        if limiter != None:
+            await limiter.acquire()
+        timing = RequestTiming(len(text)) if metrics != None else None
+        start = monotonic()
+        try:
+            result = await synthesize_chunk(text, options, backend, timing)
+            if limiter != None:
+                limiter.on_success(monotonic() - start, len(text))
+            return result
+        except Exception as e:
+            if timing != None:
+                timing.error = f"{type(e).__name__}: {e}"
+            if limiter != None:
+                limiter.on_error(e)
+            if retry >= options.retries:
+                raise
+        finally:
+            if limiter != None:
+                await limiter.release()
+            if timing != None:
+                metrics.on_request(timing)
+        if limiter != None:
+            limiter.retries += 1
+        await asyncio.sleep(backoff_delay(retry))
+
+
+async def synthesize_chapter(
+    text: str,
+    mp3_path: PathLike | str,
+    lrc_path: PathLike | str,
+    options: ConvertOptions = ConvertOptions(),
+    on_progress: Callable[[float], None] | None = None,
+    cache: SynthesisCache | None = None,
+    backend: TTSBackend | None = None,
+    limiter: AdaptiveLimiter | None = None,
+    metrics: PipelineMetrics | None = None,
+    normalized: NormalizedText | None = None,
+) -> float:
+    """
+    Synthesize one chapter into a MP3 file and a LRC file.
+
+    The text is normalized with `options.normalize` and `options.strip_patterns`, and the
+    subtitles are aligned with the original text through the position map.
+    The text is split into chunks at paragraph and sentence boundaries, and the chunks are
+    synthesized in parallel. Each chunk is appended to the audio and aligned as soon as it and the
+    chunks before it are finished, its WordBoundary offsets shifted by the duration of the audio before it.
+    A failed chunk is retried alone.
+
+    The outputs are written to temporary files first, and renamed when finished,
+    so an existing output file is always complete. Audio and subtitle lines are written to the
+    temporary files as soon as they are ready, so a crash keeps them. On failure they are kept
+    as `<output>.partial`, and removed by the next successful attempt.
+
+    Args:
+        text (str): Chapter text.
+        mp3_path (PathLike | str): Output audio file.
+        lrc_path (PathLike | str): Output subtitle file, SRT and WebVTT files of `options.subtitle_formats` are written beside it.
+        options (ConvertOptions): Voice, chunk and line break options.
+        on_progress (Callable[[float], None]): Called with progress in [0, 1] when a chunk is finished.
+        cache (SynthesisCache | None): Reuse the chunks synthesized before.
+        backend (TTSBackend | None): Speech synthesis service, Microsoft Edge online TTS if None.
+        limiter (AdaptiveLimiter | None): Limit of the requests running at once, shared by chapters.
+        metrics (PipelineMetrics | None): Record the timings of the requests and the chapter.
+        normalized (NormalizedText | None): Result of `normalize_chapter_text` of the stripped text
+            if computed before, for example by `chapter_key`.
+
+    Returns:
+        float: Audio duration in ms.
+    """
+    start = perf_counter()
+    text = text.strip()
+    if normalized == None:
+        normalized = normalize_chapter_text(text, options)
+    speak = normalized.text if normalized != None else text
+    chunks = split_text_chunks(speak, options.chunk_chars)
+    semaphore = asyncio.Semaphore(max(1, options.chunk_concurrency))
+    finished_chars = 0
+    timing = ChapterTiming(Path(mp3_path).stem, len(text), len(chunks), speak_chars=len(speak))
+
+    async def run_chunk(chunk: str) -> tuple[bytes, list[TTSChunk]]:
+        nonlocal finished_chars
+        speak_text = normalize_chunk_text(chunk)
+        key = SynthesisCache.make_key(speak_text, options.voice, options.rate, options.pitch)
+        cached = cache.get(key) if cache != None and speak_text != "" else None
+        if speak_text == "":
+            result = (b"", [])
+        elif cached != None and len(cached[0]) > 0:
+            result = cached
+            timing.cached_chunks += 1
+        else:
+            async with semaphore:
+                result = await synthesize_chunk_with_retry(speak_text, options, backend, limiter, metrics)
+            # empty audio may be a transient failure of the service, it is requested again next time
+            if cache != None and len(result[0]) > 0:
+                cache.put(key, *result)
+        finished_chars += len(chunk)
+        if on_progress != None:
+            on_progress(finished_chars / max(1, len(speak)))
+        return result
+
+    # subtitle files by path, the lines are written as soon as they are closed
+    subtitle_paths = {str(lrc_path): "lrc"}
+    for subtitle_format in options.subtitle_formats:
+        subtitle_paths[str(Path(lrc_path).with_suffix(f".{subtitle_format}"))] = subtitle_format
+    # the MP3 file last, it tells the chapter is converted;
+    # a reclaimed chapter may be written by two workers at once, each writes its own temporary files
+    tmp_paths = {unique_tmp_path(path, "part"): path for path in subtitle_paths}
+    mp3_tmp_path = unique_tmp_path(mp3_path, "part")
+    tmp_paths[mp3_tmp_path] = str(mp3_path)
+    subtitle_files = []
+    offset_ticks = 0
+    tasks = [asyncio.ensure_future(run_chunk(chunk)) for chunk in chunks]
+    try:
+        writers = []
+        for tmp_path, path in tmp_paths.items():
+            if tmp_path == mp3_tmp_path:
+                continue
+            subtitle_files.append(open(tmp_path, "wt", encoding="utf-8"))
+            writers.append(SubtitleWriter(subtitle_files[-1], subtitle_paths[path]))
+        lrc_maker = LRCMaker(
+            reference_text=text, stop_ms=options.stop_ms, cjk_chars_limit=options.cjk_chars_limit,
+            writers=writers, normalized=normalized)
+        with open(mp3_tmp_path, "wb") as file:
+            # each chunk is written and aligned as soon as it and the chunks before it are finished
+            for task in tasks:
+                audio, boundaries = await task
+                file.write(audio)
+                file.flush()
+                timing.audio_bytes += len(audio)
+                align_start = perf_counter()
+                for boundary in boundaries:
+                    lrc_maker.feed_edge_tts_chunk({
+                        **boundary,
+                        "offset": boundary["offset"] + offset_ticks,
+                    })
+                timing.align += perf_counter() - align_start
+                offset_ticks += round(mp3_duration_ms(audio) * 10000)
+        lrc_maker.finish()
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for file in subtitle_files:
+            file.close()
+        # the part finished stays for inspection, the chunks in it are in the cache for the next attempt
+        for tmp_path, path in tmp_paths.items():
+            if exists(tmp_path):
+                replace(tmp_path, f"{path}.{PARTIAL_SUFFIX}")
+        raise
+    for file in subtitle_files:
+        file.close()
+    for tmp_path, path in tmp_paths.items():
+        replace(tmp_path, path)
+        remove_partial_files(path)
+    if metrics != None:
+        timing.audio_ms = offset_ticks / 10000
+        timing.total = perf_counter() - start
+        metrics.on_chapter(timing)
+    return offset_ticks / 10000
+
+
+class TTSEngine:
+    """
+    TTSEngine converts many chapters at once, limited by `ConvertOptions.concurrency`.
+    Requests of all chapters share one AdaptiveLimiter.
+    """
+
+    def __init__(
+        self,
+        output_dir: PathLike | str,
+        options: ConvertOptions = ConvertOptions(),
+        on_progress: Callable[[ChapterProgress], None] | None = None,
+        cache: SynthesisCache | None = None,
+        backend: TTSBackend | None = None,
+        project: ProjectDB | None = None,
+        metrics: PipelineMetrics | None = None,
+    ):
+        """
+        TTSEngine converts many chapters at once, limited by `ConvertOptions.concurrency`.
+
+        Args:
+            output_dir (PathLike | str): Directory to write `<index> <title>.mp3` and `.lrc` into.
+            options (ConvertOptions): Synthesis options.
+            on_progress (Callable[[ChapterProgress], None]): Called when a chapter makes progress.
+            cache (SynthesisCache | None): Reuse the chunks synthesized before.
+            backend (TTSBackend | None): Speech synthesis service, Microsoft Edge online TTS if None.
+            project (ProjectDB | None): Record the results, and skip the chapters finished before.
+            metrics (PipelineMetrics | None): Record the timings of the requests and chapters, and the queue depth.
+        """
+        self.output_dir = Path(output_dir)
+        self.options = options
+        self.on_progress = on_progress
+        self.cache = cache
+        self.backend = backend if backend != None else EdgeTTSBackend()
+        self.project = project
+        self.metrics = metrics
+        self.limiter = AdaptiveLimiter(
+            initial=options.concurrency,
+            max_limit=max(1, options.concurrency * options.chunk_concurrency),
+        )
+        self.chapters: list[ChapterProgress] = []
+        self.__queue: asyncio.Queue | None = None
+        self.__workers: list[asyncio.Task] = []
+
+    def __notify(self, chapter: ChapterProgress):
+        if self.on_progress != None:
+            self.on_progress(chapter)
+
+    def __update_queue_depth(self):
+        if self.metrics != None and self.__queue != None:
+            self.metrics.set_queue_depth(self.__queue.qsize())
+
+    def __chapter_paths(self, chapter: ChapterProgress) -> tuple[Path, str, ProjectDB | None]:
+        """
+        Returns the output directory, the file stem and the project database of the chapter.
+        """
+        output_dir = chapter.output_dir if chapter.output_dir != None else self.output_dir
+        project = chapter.project if chapter.project != None else self.project
+        return output_dir, chapter_file_stem(chapter.index, chapter.title), project
+
+    def __save_result(self, chapter: ChapterProgress, key: str):
+        output_dir, stem, project = self.__chapter_paths(chapter)
+        if project == None:
+            return
+        mp3_path = output_dir / f"{stem}.mp3"
+        lrc_path = output_dir / f"{stem}.lrc"
+        project.save_synthesis(SynthesisRecord(
+            stem, key, chapter.state,
+            getsize(mp3_path) if chapter.state == STATE_DONE else 0,
+            getsize(lrc_path) if chapter.state == STATE_DONE else 0,
+            chapter.duration_ms,
+            chapter.error,
+        ))
+
+    async def __convert_one(self, chapter: ChapterProgress, text: str, key: str, normalized: NormalizedText | None):
+        output_dir, stem, _ = self.__chapter_paths(chapter)
+
+        def update_progress(progress: float):
+            chapter.progress = progress
+            self.__notify(chapter)
+
+        chapter.state = STATE_RUNNING
+        self.__notify(chapter)
+        try:
+            makedirs(output_dir, exist_ok=True)
+            chapter.duration_ms = await synthesize_chapter(
+                text,
+                output_dir / f"{stem}.mp3",
+                output_dir / f"{stem}.lrc",
+                self.options,
+                update_progress,
+                self.cache,
+                self.backend,
+                self.limiter,
+                self.metrics,
+                normalized,
+            )
+            chapter.state = STATE_DONE
+            chapter.progress = 1.0
+        except asyncio.CancelledError:
+            chapter.state = STATE_PENDING
+            raise
+        except Exception as e:
+            chapter.state = STATE_FAILED
+            chapter.error = str(e)
+        self.__save_result(chapter, key)
+        self.__notify(chapter)
+
+    async def __worker(self, queue: asyncio.Queue):
+        while True:
+            chapter, text, key, normalized = await queue.get()
+            self.__update_queue_depth()
+            try:
+                await self.__convert_one(chapter, text, key, normalized)
+            finally:
+                queue.task_done()
+
+    def start(self):
+        """
+        Start the workers, then `submit` chapters and `join`.
+        """
+        concurrency = max(1, self.options.concurrency)
+        self.chapters = []
+        self.__queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.__workers = [asyncio.create_task(self.__worker(self.__queue)) for _ in range(concurrency)]
+
+    async def submit(self, chapter: ChapterProgress, text: str):
+        """
+        Queue a chapter, wait if the queue is full.
+        A chapter finished before with the same text and options is not converted again.
+        """
+        if self.__queue == None:
+            raise RuntimeError("TTSEngine is not started")
+        self.chapters.append(chapter)
+        # normalized once for the key and the synthesis, chapter by chapter as they are submitted,
+        # so only the queued chapters keep a position map
+        normalized = normalize_chapter_text(text.strip(), self.options)
+        key = chapter_key(text, self.options, normalized)
+        output_dir, stem, project = self.__chapter_paths(chapter)
+        if project != None and project.is_synthesized(output_dir, stem, key, STATE_DONE):
+            record = project.synthesis(stem)
+            chapter.state = STATE_DONE
+            chapter.progress = 1.0
+            chapter.skipped = True
+            chapter.duration_ms = record.duration_ms
+            self.__notify(chapter)
+            return
+        await self.__queue.put((chapter, text, key, normalized))
+        self.__update_queue_depth()
+
+    async def stop(self):
+        """
+        Stop the workers, chapters not finished are left pending.
+        """
+        for worker in self.__workers:
+            worker.cancel()
+        await asyncio.gather(*self.__workers, return_exceptions=True)
+        self.__workers = []
+        self.__queue = None
+
+    async def join(self) -> list[ChapterProgress]:
+        """
+        Wait for all submitted chapters and stop the workers, returns the final state of each chapter.
+        """
+        if self.__queue != None:
+            await self.__queue.join()
+        await self.stop()
+        return self.chapters
+
+    async def convert(self, chapters: Iterable[tuple[str, str]]) -> list[ChapterProgress]:
+        """
+        Convert all chapters, returns the final state of each chapter.
+        Failed chapters do not stop the others.
+        """
+        self.start()
+        try:
+            for index, (title, text) in enumerate(chapters):
+                await self.submit(ChapterProgress(index, title), text)
+            return await self.join()
+        finally:
+            await self.stop()
@@ -0,0 +1,113 @@
+import asyncio
+import random
+from time import monotonic
+import aiohttp
+
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 30.0
+# HTTP status of the websocket handshake when the service throttles
+THROTTLE_STATUS = (403, 429)
+
+
+def backoff_delay(retry: int, base: float = DEFAULT_BACKOFF_BASE, cap: float = DEFAULT_BACKOFF_CAP) -> float:
+    """
+    Exponential backoff with full jitter, so failed requests do not retry at the same moment.
+    """
+    return random.uniform(0, min(cap, base * 2 ** retry))
+
+
+def is_throttled(error: BaseException) -> bool:
+    return isinstance(error, aiohttp.WSServerHandshakeError) and error.status in THROTTLE_STATUS
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit of the requests running at once.
+
+    The limit grows by about one for each full round of successful requests while the latency
+    stays near the best seen, and is halved on an error or when the latency grows,
+    at most once per cooldown so a burst of failures counts as one.
+    """
+
+    def __init__(
+        self,
+        initial: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 16,
+        latency_tolerance: float = 2.0,
+        cooldown: float = 1.0,
+    ):
+        """
+        AIMD limit of the requests running at once.
+
+        Args:
+            initial (float): Limit at start.
+            min_limit (float): Limit never goes below.
+            max_limit (float): Limit never goes above.
+            latency_tolerance (float): Back off when the latency is this many times the baseline.
+            cooldown (float): Min seconds between two decreases.
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+        self.retries = 0
+        # seconds per character of the fast requests
+        self.__baseline: float | None = None
+        self.__last_decrease = 0.0
+        self.__condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.__condition:
+            await self.__condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.__condition:
+            self.in_flight -= 1
+            self.__condition.notify_all()
+
+    def __decrease(self):
+        now = monotonic()
+        if now - self.__last_decrease < self.cooldown:
+            return
+        self.__last_decrease = now
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    def on_success(self, latency: float, chars: int = 1):
+        """
+        Record a finished request, latency in seconds.
+        """
+        self.successes += 1
+        per_char = latency / max(1, chars)
+        if self.__baseline == None or per_char < self.__baseline:
+            self.__baseline = per_char
+        else:
+            # follow slowly, the remote may get slower for everyone
+            self.__baseline += (per_char - self.__baseline) * 0.01
+        if per_char > self.__baseline * self.latency_tolerance:
+            self.__decrease()
+        elif self.in_flight >= int(self.limit):
+            # only grow while the limit is actually reached
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_error(self, error: BaseException):
+        self.errors += 1
+        if is_throttled(error):
+            self.throttled += 1
+        self.__decrease()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
@@ -0,0 +1,147 @@
+from rich.segment import Segment
+from textual import events
+from textual.binding import Binding
+from textual.geometry import Region, Size
+from textual.message import Message
+from textual.reactive import reactive
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from app.chapter_store import ChapterStore
+
+
+class ChapterListView(ScrollView, can_focus=True):
+    """
+    A list of chapter titles which only renders the visible rows.
+    Titles are read from the ChapterStore when a row is rendered, so there is no widget per chapter.
+    """
+
+    BINDINGS = [
+        Binding("enter", "select_cursor", "Select", show=False),
+        Binding("up", "cursor_up", "Cursor up", show=False),
+        Binding("down", "cursor_down", "Cursor down", show=False),
+        Binding("pageup", "page_up", "Page up", show=False),
+        Binding("pagedown", "page_down", "Page down", show=False),
+        Binding("home", "first", "First", show=False),
+        Binding("end", "last", "Last", show=False),
+    ]
+    COMPONENT_CLASSES = {"chapter-list--cursor"}
+    DEFAULT_CSS = """
+    ChapterListView {
+        background: $surface;
+    }
+    ChapterListView > .chapter-list--cursor {
+        background: $block-cursor-blurred-background;
+    }
+    ChapterListView:focus > .chapter-list--cursor {
+        background: $block-cursor-background;
+        color: $block-cursor-foreground;
+        text-style: $block-cursor-text-style;
+    }
+    """
+
+    index: reactive[int] = reactive(-1, always_update=True)
+
+    class Selected(Message):
+        def __init__(self, list_view: "ChapterListView", index: int):
+            super().__init__()
+            self.list_view = list_view
+            self.index = index
+
+        @property
+        def control(self) -> "ChapterListView":
+            return self.list_view
+
+    def __init__(self, chapters: ChapterStore | None = None, *, name=None, id=None, classes=None, disabled=False):
+        super().__init__(name=name, id=id, classes=classes, disabled=disabled)
+        self.chapters = chapters if chapters != None else ChapterStore()
+
+    # ======== data ========
+
+    def set_chapters(self, chapters: ChapterStore):
+        self.chapters = chapters
+        self.index = -1
+        self.scroll_to(0, 0, animate=False)
+        self.__update_virtual_size()
+        self.refresh()
+
+    def refresh_row(self, index: int):
+        """
+        Redraw one row after its title is changed.
+        """
+        self.refresh_line(index)
+
+    def rows_changed(self, index: int):
+        """
+        Redraw the rows from index after chapters are inserted or removed there.
+        """
+        self.__update_virtual_size()
+        first = max(index, self.scroll_offset.y)
+        self.refresh_lines(first, max(0, self.scroll_offset.y + self.size.height - first))
+
+    def __update_virtual_size(self):
+        self.virtual_size = Size(self.size.width, len(self.chapters))
+
+    # ======== render ========
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        row = scroll_y + y
+        width = self.size.width
+        style = self.rich_style
+        if row < 0 or row >= len(self.chapters):
+            return Strip.blank(width, style)
+        if row == self.index:
+            style = style + self.get_component_rich_style("chapter-list--cursor")
+        strip = Strip([Segment(" " + self.chapters.title(row), style)])
+        return strip.crop_extend(scroll_x, scroll_x + width, style)
+
+    def on_resize(self, _: events.Resize):
+        self.__update_virtual_size()
+
+    def on_focus(self, _: events.Focus):
+        self.refresh_row(self.index)
+
+    def on_blur(self, _: events.Blur):
+        self.refresh_row(self.index)
+
+    # ======== cursor ========
+
+    def validate_index(self, index: int) -> int:
+        # -1 is nothing selected
+        if index < 0 or len(self.chapters) <= 0:
+            return -1
+        return min(index, len(self.chapters) - 1)
+
+    def watch_index(self, old_index: int, new_index: int):
+        self.refresh_row(old_index)
+        self.refresh_row(new_index)
+        if new_index >= 0:
+            self.scroll_to_region(Region(0, new_index, 1, 1), animate=False, immediate=True)
+
+    def action_select_cursor(self):
+        if self.index >= 0:
+            self.post_message(self.Selected(self, self.index))
+
+    def action_cursor_up(self):
+        self.index = max(0, self.index - 1)
+
+    def action_cursor_down(self):
+        self.index = self.index + 1
+
+    def action_page_up(self):
+        self.index = max(0, self.index - max(1, self.size.height - 1))
+
+    def action_page_down(self):
+        self.index = self.index + max(1, self.size.height - 1)
+
+    def action_first(self):
+        self.index = 0
+
+    def action_last(self):
+        self.index = len(self.chapters) - 1
+
+    def on_click(self, event: events.Click):
+        row = event.y + self.scroll_offset.y
+        if row < len(self.chapters):
+            self.index = row
+            self.action_select_cursor()
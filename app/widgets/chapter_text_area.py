@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from textual.widgets import TextArea
+from textual.widgets.text_area import Edit, EditResult
+
+
+@dataclass
+class TextEdit:
+    """
+    A replacement of the text range [start, end) in character offsets, applied in order.
+    """
+    start: int
+    end: int
+    text: str
+    # first row touched by the edit
+    top_row: int
+
+
+class ChapterTextArea(TextArea):
+    """
+    TextArea which records every edit as a character range, so the changes can be applied
+    to the chapter text without reading the whole document again.
+    """
+
+    def __init__(self, text: str = "", *, name=None, id=None, classes=None, disabled=False):
+        super().__init__(text, name=name, id=id, classes=classes, disabled=disabled)
+        self.pending_edits: list[TextEdit] = []
+        # the recorded edits can not describe the change, read the whole document
+        self.needs_full_sync = False
+
+    def load_text(self, text: str) -> None:
+        super().load_text(text)
+        self.pending_edits = []
+        # document normalizes mixed line breaks, offsets would not match the original text
+        self.needs_full_sync = self.document.text != text
+
+    def take_edits(self) -> tuple[list[TextEdit], bool]:
+        """
+        Returns the edits since the last call, and whether a full sync is needed instead.
+        """
+        edits, full_sync = self.pending_edits, self.needs_full_sync
+        self.pending_edits = []
+        self.needs_full_sync = False
+        return edits, full_sync
+
+    def __normalize_newline(self, text: str) -> str:
+        lines = text.splitlines()
+        if text.endswith(("\r\n", "\n", "\r")):
+            lines.append("")
+        return self.document.newline.join(lines)
+
+    def edit(self, edit: Edit) -> EditResult:
+        if not self.needs_full_sync:
+            doc = self.document
+            self.pending_edits.append(TextEdit(
+                doc.get_index_from_location(edit.top),
+                doc.get_index_from_location(edit.bottom),
+                self.__normalize_newline(edit.text),
+                edit.top[0],
+            ))
+        return super().edit(edit)
+
+    def undo(self) -> None:
+        # undo and redo apply edits without TextArea.edit
+        self.needs_full_sync = True
+        super().undo()
+
+    def redo(self) -> None:
+        self.needs_full_sync = True
+        super().redo()
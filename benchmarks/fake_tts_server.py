@@ -0,0 +1,267 @@
+"""
+A local websocket server speaking the edge-tts protocol, for benchmarks and tests without the network.
+
+    python -m benchmarks.fake_tts_server --port 8765 --latency-ms 150 --jitter-ms 50 --drop-rate 0.01
+
+Connect with `WebSocketTTSBackend("ws://127.0.0.1:8765/")`.
+Every CJK character and every latin word is one WordBoundary, the audio is silent MP3 frames
+in the edge-tts output format (MPEG-2 Layer III, 24kHz, 48kbps, mono).
+A connection serves any number of turns, like the real service.
+"""
+import asyncio
+import json
+import random
+import re
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from xml.sax.saxutils import unescape
+from aiohttp import web, WSMsgType
+
+# MPEG-2 Layer III, 48kbps, 24kHz, mono: 144 bytes and 24ms per frame
+FRAME_HEADER = b"\xff\xf3\x64\xc4"
+FRAME_BYTES = 144
+FRAME_MS = 24
+FRAMES_PER_MESSAGE = 28
+CJK_CHAR_MS = 200
+LATIN_WORD_MS = 300
+PAUSE_MS = 250
+WORD_RE = re.compile(r"[㐀-鿿豈-﫿]|[A-Za-z0-9]+")
+PROSODY_RE = re.compile(r"<prosody[^>]*rate='([+-]\d+)%'[^>]*>(.*)</prosody>", re.DOTALL)
+
+
+@dataclass
+class FakeServerOptions:
+    # time to the first message of a turn, plus an exponential jitter with mean jitter_ms
+    latency_ms: float = 150
+    jitter_ms: float = 50
+    # audio seconds streamed per second
+    speed: float = 20.0
+    # chance to refuse a connection with HTTP 429, like the service does when throttling
+    reject_rate: float = 0.0
+    # chance to close the connection in the middle of a turn
+    drop_rate: float = 0.0
+    seed: int | None = None
+    # close connections idle for longer, in seconds
+    idle_timeout: float | None = None
+    # turns served at full speed at once, more turns share the speed
+    capacity: int | None = None
+
+
+@dataclass
+class FakeServerStats:
+    connections: int = 0
+    rejected: int = 0
+    turns: int = 0
+    dropped: int = 0
+    idle_closed: int = 0
+
+
+def make_timeline(text: str, rate_percent: int = 0) -> tuple[list[tuple[int, int, str]], int]:
+    """
+    Returns the words as (offset_ms, duration_ms, word) and the audio duration in ms.
+    """
+    speed = max(0.1, 1 + rate_percent / 100)
+    words: list[tuple[int, int, str]] = []
+    time_ms = 50
+    pos = 0
+    for mt in WORD_RE.finditer(text):
+        if mt.start() > pos and text[pos:mt.start()].strip() != "":
+            time_ms += round(PAUSE_MS / speed)
+        word = mt.group()
+        duration = round((CJK_CHAR_MS if len(word) == 1 and not word.isascii() else LATIN_WORD_MS) / speed)
+        words.append((time_ms, duration, word))
+        time_ms += duration
+        pos = mt.end()
+    return words, time_ms + 50
+
+
+def audio_message(request_id: str, frames: int) -> bytes:
+    headers = f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n".encode("utf-8")
+    frame = FRAME_HEADER + bytes(FRAME_BYTES - len(FRAME_HEADER))
+    return len(headers).to_bytes(2, "big") + headers + frame * frames
+
+
+def text_message(request_id: str, path: str, data: dict) -> str:
+    return (
+        f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\n"
+        f"Path:{path}\r\n\r\n{json.dumps(data, ensure_ascii=False)}"
+    )
+
+
+def metadata(offset_ms: int, duration_ms: int, word: str) -> dict:
+    return {"Metadata": [{
+        "Type": "WordBoundary",
+        "Data": {
+            "Offset": offset_ms * 10000,
+            "Duration": duration_ms * 10000,
+            "text": {"Text": word, "Length": len(word), "BoundaryType": "WordBoundary"},
+        },
+    }]}
+
+
+def parse_headers(message: str) -> tuple[dict[str, str], str]:
+    head, _, body = message.partition("\r\n\r\n")
+    headers = {}
+    for line in head.split("\r\n"):
+        key, _, value = line.partition(":")
+        headers[key] = value
+    return headers, body
+
+
+class FakeTTSServer:
+    """
+    A local websocket server speaking the edge-tts protocol.
+    """
+
+    def __init__(self, options: FakeServerOptions = FakeServerOptions(), host: str = "127.0.0.1", port: int = 0):
+        """
+        A local websocket server speaking the edge-tts protocol.
+
+        Args:
+            options (FakeServerOptions): Simulated latency, throughput and errors.
+            host (str): Listen address.
+            port (int): Listen port, 0 for any free port.
+        """
+        self.options = options
+        self.host = host
+        self.port = port
+        self.stats = FakeServerStats()
+        self.__rng = random.Random(options.seed)
+        self.__runner: web.AppRunner | None = None
+        self.__sockets: set[web.WebSocketResponse] = set()
+        self.__active_turns = 0
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/"
+
+    async def start(self) -> str:
+        """
+        Start listening, returns the url.
+        """
+        app = web.Application()
+        app.router.add_get("/", self.__handle)
+        self.__runner = web.AppRunner(app, handle_signals=False)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, self.host, self.port)
+        await site.start()
+        self.port = self.__runner.addresses[0][1]
+        return self.url
+
+    async def stop(self):
+        for websocket in list(self.__sockets):
+            await websocket.close()
+        if self.__runner != None:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    async def __handle(self, request: web.Request) -> web.StreamResponse:
+        if self.__rng.random() < self.options.reject_rate:
+            self.stats.rejected += 1
+            return web.Response(status=429, text="Too Many Requests")
+        self.stats.connections += 1
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.__sockets.add(websocket)
+        try:
+            while True:
+                try:
+                    message = await websocket.receive(timeout=self.options.idle_timeout)
+                except asyncio.TimeoutError:
+                    self.stats.idle_closed += 1
+                    await websocket.close()
+                    break
+                if message.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    break
+                if message.type != WSMsgType.TEXT:
+                    continue
+                headers, body = parse_headers(message.data)
+                if headers.get("Path") == "ssml":
+                    self.__active_turns += 1
+                    try:
+                        if not await self.__turn(websocket, headers.get("X-RequestId", ""), body):
+                            break
+                    except ConnectionResetError:
+                        # the client is gone
+                        break
+                    finally:
+                        self.__active_turns -= 1
+        finally:
+            self.__sockets.discard(websocket)
+        return websocket
+
+    async def __turn(self, websocket: web.WebSocketResponse, request_id: str, ssml: str) -> bool:
+        """
+        Answer one ssml request, returns False if the connection is dropped.
+        """
+        options = self.options
+        self.stats.turns += 1
+        mt = PROSODY_RE.search(ssml)
+        rate, text = (int(mt.group(1)), unescape(mt.group(2))) if mt != None else (0, "")
+        words, duration_ms = make_timeline(text, rate)
+        delay_ms = options.latency_ms
+        if options.jitter_ms > 0:
+            delay_ms += self.__rng.expovariate(1 / options.jitter_ms)
+        drop_at = -1
+        if self.__rng.random() < options.drop_rate:
+            drop_at = self.__rng.randrange(max(1, duration_ms // FRAME_MS))
+        await asyncio.sleep(delay_ms / 1000)
+        await websocket.send_str(text_message(request_id, "turn.start", {}))
+        if len(words) > 0:
+            total_frames = -(-duration_ms // FRAME_MS)
+            sent_frames = 0
+            word_index = 0
+            while sent_frames < total_frames:
+                frames = min(FRAMES_PER_MESSAGE, total_frames - sent_frames)
+                if drop_at >= 0 and sent_frames + frames > drop_at:
+                    self.stats.dropped += 1
+                    await websocket.close()
+                    return False
+                await websocket.send_bytes(audio_message(request_id, frames))
+                sent_frames += frames
+                while word_index < len(words) and words[word_index][0] < sent_frames * FRAME_MS:
+                    await websocket.send_str(text_message(request_id, "audio.metadata", metadata(*words[word_index])))
+                    word_index += 1
+                speed = options.speed
+                if options.capacity != None and self.__active_turns > options.capacity:
+                    speed = speed * options.capacity / self.__active_turns
+                await asyncio.sleep(frames * FRAME_MS / 1000 / speed)
+        await websocket.send_str(text_message(request_id, "turn.end", {}))
+        return True
+
+
+async def serve(options: FakeServerOptions, host: str, port: int):
+    server = FakeTTSServer(options, host, port)
+    print(f"listening on {await server.start()}", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Fake edge-tts websocket server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--speed", type=float, default=20.0, help="audio seconds streamed per second")
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--idle-timeout", type=float, default=None, help="close idle connections after seconds")
+    parser.add_argument("--capacity", type=int, default=None, help="turns served at full speed at once")
+    args = parser.parse_args()
+    options = FakeServerOptions(
+        args.latency_ms, args.jitter_ms, args.speed, args.reject_rate, args.drop_rate, args.seed,
+        args.idle_timeout, args.capacity)
+    try:
+        asyncio.run(serve(options, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
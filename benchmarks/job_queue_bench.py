@@ -0,0 +1,125 @@
+"""
+Benchmark of the shared directory job queue with local worker processes and the fake edge-tts server.
+
+    python -m benchmarks.job_queue_bench --workers 1 2 4 --kill-one
+
+For each number of workers, a job is created in a temporary directory and converted by
+`python . worker` processes. Exit status is 1 if a chapter is not finished, or converted twice.
+With `--kill-one`, one worker is killed in the middle, its chapter must be reclaimed by the others.
+"""
+import asyncio
+import json
+import sys
+from argparse import ArgumentParser
+from os import listdir
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from app.chapter_store import ChapterStore
+from app.chapter_splitter import ChapterSpan
+from app.job_queue import create_job
+from app.tts_engine import ConvertOptions
+from benchmarks.fake_tts_server import FakeTTSServer, FakeServerOptions
+from benchmarks.tts_bench import make_text
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def make_store(novel_path: Path, chapters: int, chapter_chars: int) -> ChapterStore:
+    spans: list[ChapterSpan] = []
+    pos = 0
+    with open(novel_path, "wb") as f:
+        for index in range(chapters):
+            data = f"第{index + 1}章\n{make_text(chapter_chars, index)}\n".encode("utf-8")
+            f.write(data)
+            spans.append(ChapterSpan(f"第{index + 1}章", pos, pos + len(data)))
+            pos += len(data)
+    return ChapterStore(novel_path, "utf-8", spans)
+
+
+async def run_job(args, workers: int, url: str) -> dict:
+    with TemporaryDirectory() as tmp_dir:
+        job_dir = Path(tmp_dir) / "job"
+        store = make_store(Path(tmp_dir) / "novel.txt", args.chapters, args.chapter_chars)
+        create_job(job_dir, store, ConvertOptions())
+        start = perf_counter()
+        processes = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, str(ROOT_DIR), "worker", str(job_dir),
+                "--worker-id", f"w{index}", "--tts-concurrency", str(args.concurrency), "--cache-dir", "",
+                "--tts-url", url, "--lease-timeout", str(args.lease_timeout),
+                "--heartbeat", str(args.lease_timeout / 4), "--poll", "0.2",
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            )
+            for index in range(workers)
+        ]
+        killed = None
+        if args.kill_one and workers > 1:
+            await asyncio.sleep(args.kill_after)
+            killed = processes[0]
+            killed.kill()
+        results = []
+        for process in processes:
+            stdout, _ = await process.communicate()
+            if process is not killed:
+                results.append(json.loads(stdout))
+        elapsed = perf_counter() - start
+        done_markers = listdir(job_dir / "done")
+        converted: dict[str, int] = {}
+        for name in done_markers:
+            with open(job_dir / "done" / name, "rt", encoding="utf-8") as f:
+                worker = json.load(f)["worker"]
+            converted[worker] = converted.get(worker, 0) + 1
+    return {
+        "elapsed": elapsed,
+        "done": len(done_markers),
+        "reported": sum(result["done"] for result in results),
+        "lost": sum(result["lost"] for result in results),
+        "per_worker": converted,
+        "killed": killed != None,
+    }
+
+
+async def run(args) -> bool:
+    server = FakeTTSServer(FakeServerOptions(args.latency_ms, args.jitter_ms, args.speed, seed=0))
+    url = await server.start()
+    ok = True
+    try:
+        for workers in args.workers:
+            result = await run_job(args, workers, url)
+            print(
+                f"workers={workers}: {result['done']}/{args.chapters} done in {result['elapsed']:.2f}s,"
+                f" {result['done'] / result['elapsed'] * 3600:.0f} chapters/hour,"
+                f" lost {result['lost']}, per worker {result['per_worker']}"
+                + (" (one killed)" if result["killed"] else "")
+            )
+            if result["done"] != args.chapters:
+                print("  not all chapters are finished")
+                ok = False
+            # a killed worker can not report, its finished chapters only have the markers
+            if not result["killed"] and result["reported"] != result["done"]:
+                print("  chapters converted twice")
+                ok = False
+    finally:
+        await server.stop()
+    return ok
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Shared directory job queue benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chapters", type=int, default=24)
+    parser.add_argument("--chapter-chars", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=1, help="chapters at once in each worker")
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--speed", type=float, default=20.0)
+    parser.add_argument("--lease-timeout", type=float, default=4.0)
+    parser.add_argument("--kill-one", action="store_true", help="kill one worker in the middle")
+    parser.add_argument("--kill-after", type=float, default=1.5)
+    args = parser.parse_args()
+    return 0 if asyncio.run(run(args)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Benchmark of the text normalization over all chapters of a novel.
+
+    python -m benchmarks.normalize_bench
+    python -m benchmarks.normalize_bench ./content/novel.txt --strip-pattern "www\\.\\w+\\.com"
+
+Reports how much shorter the text sent to synthesis is, in characters and UTF-8 bytes,
+and the speed of the normalization. Without a file, noisy chapters are generated.
+Exit status is 1 if a position of the normalized text does not map back to the same
+character of the original text.
+"""
+import random
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+from app.chapter_splitter import DEFAULT_CUT_CHAPTER_RE
+from app.chapter_store import ChapterStore
+from app.cli import split_novel
+from app.text_normalizer import FULLWIDTH_TABLE, NormalizedText, TextNormalizer
+from benchmarks.tts_bench import make_text
+
+NOISE = ["\n\n　　", "\n　　\n", "！！！", "。。。", "……………", "ＶＩＰ", "２０２４", "    "]
+WATERMARK = "\n　　www.example.com 最新章节 请收藏\n"
+SEPARATOR = "\n——————\n"
+
+
+def make_noisy_chapter(chars: int, seed: int) -> str:
+    rng = random.Random(seed)
+    parts: list[str] = []
+    length = 0
+    while length < chars:
+        part = make_text(rng.randint(20, 200), rng.randint(0, 1 << 30))
+        if rng.random() < 0.5:
+            part += rng.choice(NOISE)
+        elif rng.random() < 0.1:
+            part += rng.choice([WATERMARK, SEPARATOR])
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def map_errors(original: str, normalized: NormalizedText) -> int:
+    """
+    Count of positions mapping to a different character of the original text.
+    """
+    errors = 0
+    folded = original.translate(FULLWIDTH_TABLE)
+    for pos, ch in enumerate(normalized.text):
+        if folded[normalized.positions[pos]] != ch:
+            errors += 1
+    if normalized.positions[len(normalized.text)] != len(original):
+        errors += 1
+    return errors
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Text normalization benchmark")
+    parser.add_argument("novel", type=Path, nargs="?", default=None, help="txt小说, 不指定则生成")
+    parser.add_argument("--rule", default=DEFAULT_CUT_CHAPTER_RE)
+    parser.add_argument("--chapters", type=int, default=200)
+    parser.add_argument("--chapter-chars", type=int, default=5000)
+    parser.add_argument("--strip-pattern", action="append", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if args.novel != None:
+        _, encoding, spans, _, _ = split_novel(str(args.novel), args.rule)
+        texts = [text for _, text in ChapterStore(args.novel, encoding, spans)]
+        strip_patterns = args.strip_pattern or []
+    else:
+        texts = [make_noisy_chapter(args.chapter_chars, index) for index in range(args.chapters)]
+        strip_patterns = args.strip_pattern or [r"www\.\w+\.com"]
+    normalizer = TextNormalizer(strip_patterns)
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = perf_counter()
+        results = [normalizer.normalize(text) for text in texts]
+        best = min(best, perf_counter() - start)
+    chars = sum(len(text) for text in texts)
+    size = sum(len(text.encode("utf-8")) for text in texts)
+    normalized_chars = sum(len(result.text) for result in results)
+    normalized_size = sum(len(result.text.encode("utf-8")) for result in results)
+    errors = sum(map_errors(text, result) for text, result in zip(texts, results))
+    print(f"chapters: {len(texts)}")
+    print(f"   chars: {chars:>12} -> {normalized_chars:>12}  ({(1 - normalized_chars / max(1, chars)) * 100:5.1f}% less)")
+    print(f"   bytes: {size:>12} -> {normalized_size:>12}  ({(1 - normalized_size / max(1, size)) * 100:5.1f}% less)")
+    print(f"   speed: {size / best / 1e6:8.1f} MB/s  ({best * 1000:.1f} ms, best of {args.repeat})")
+    if errors > 0:
+        print(f"{errors} positions map to a different character")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
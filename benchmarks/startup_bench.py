@@ -0,0 +1,131 @@
+"""
+Benchmark of the startup of the interface, each run in a new interpreter.
+
+    python -m benchmarks.startup_bench
+
+Reports the time to import the app and the time until the first screen is ready, both counted
+from the start of the interpreter, and the slowest imports of the app. Exit status is 1 if the
+median time to the first screen is more than `--max-seconds`, or if a module which should be
+imported on first use is imported with the app.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+# loaded on first use only, not before the first screen
+LAZY_MODULES = ["edge_tts", "aiohttp", "app.tts_engine", "app.tabs.cut_chapters_tab", "app.tabs.tts_convert"]
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from app.mainapp import NovelTTSApp
+imported = time.perf_counter()
+# the lazy tabs are preloaded in the background after the first screen, check before it
+loaded = [name for name in {lazy} if name in sys.modules]
+
+async def auto_pilot(pilot):
+    mounted = [pane.id for pane in pilot.app.query("TabPane") if len(pane.children) > 0]
+    pilot.app.exit({{
+        "import": imported - start, "ready": time.perf_counter() - start, "loaded": loaded, "mounted": mounted,
+    }})
+
+result = NovelTTSApp().run(headless=True, auto_pilot=auto_pilot)
+print(json.dumps(result))
+"""
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def app_env() -> dict[str, str]:
+    """
+    Environment to import the app from another working directory.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+
+def run_startup() -> dict:
+    """
+    Returns the seconds to import and to the first screen, counted from the first line of the script,
+    the lazy modules imported with the app, and the tabs mounted at the first screen.
+    """
+    # the app creates ./content and may write other files in the working directory
+    with TemporaryDirectory() as work_dir:
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT.format(lazy=repr(LAZY_MODULES))],
+            cwd=work_dir, env=app_env(), capture_output=True, text=True, check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def interpreter_seconds(repeat: int) -> float:
+    """
+    Seconds to start and exit an empty interpreter.
+    """
+    results = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        results.append(perf_counter() - start)
+    return median(results)
+
+
+def slowest_imports(count: int) -> list[tuple[str, float]]:
+    """
+    Cumulative import time of the app modules, the slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.mainapp"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    times: list[tuple[str, float]] = []
+    for line in result.stderr.splitlines():
+        mt = IMPORTTIME_RE.match(line)
+        if mt != None and (mt[4].startswith("app") or len(mt[3]) <= 3):
+            times.append((mt[4], int(mt[2]) / 1e6))
+    return sorted(times, key=lambda item: item[1], reverse=True)[:count]
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Startup benchmark of the interface")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=1.0)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to show")
+    args = parser.parse_args()
+    interpreter = interpreter_seconds(args.repeat)
+    imports: list[float] = []
+    readies: list[float] = []
+    loaded: set[str] = set()
+    mounted: set[str] = set()
+    for _ in range(args.repeat):
+        result = run_startup()
+        imports.append(interpreter + result["import"])
+        readies.append(interpreter + result["ready"])
+        loaded.update(result["loaded"])
+        mounted.update(result["mounted"])
+    print(f"interpreter: {interpreter * 1000:8.1f} ms")
+    print(f"     import: {median(imports) * 1000:8.1f} ms  (median of {args.repeat}, from interpreter start)")
+    print(f"      ready: {median(readies) * 1000:8.1f} ms  (first screen)")
+    print("slowest imports:")
+    for name, seconds in slowest_imports(args.top):
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+    failed = False
+    if median(readies) > args.max_seconds:
+        print(f"first screen after {median(readies):.3f}s, more than {args.max_seconds}s")
+        failed = True
+    if len(loaded) > 0:
+        print(f"imported at startup, should be on first use: {', '.join(sorted(loaded))}")
+        failed = True
+    print(f"tabs mounted at the first screen: {', '.join(sorted(mounted))}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Benchmark of the synthesis pipeline against the local fake edge-tts server.
+
+    python -m benchmarks.tts_bench --chapters 40 --concurrency 4 --latency-ms 150 --drop-rate 0.01
+    python -m benchmarks.tts_bench --pool --chapter-chars 300 --chunk-chars 100
+
+Reports chapters per hour, the real-time factor (wall time / audio duration, lower is faster)
+and the tail latency of chapters and requests. Use `--url` to run against another server
+speaking the edge-tts protocol instead of starting the fake one.
+"""
+import asyncio
+import random
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from app.metrics import PipelineMetrics, RequestTiming, percentile
+from app.mp3 import mp3_duration_ms
+from app.tts_backend import TTSBackend, WebSocketTTSBackend, PooledTTSBackend
+from app.tts_engine import TTSEngine, ConvertOptions, ChapterProgress, STATE_RUNNING, STATE_DONE, STATE_FAILED
+from benchmarks.fake_tts_server import FakeTTSServer, FakeServerOptions
+
+WORDS = ["天地", "玄黄", "宇宙", "洪荒", "日月", "盈昃", "辰宿", "列张", "寒", "来", "暑", "往", "Edge", "TTS"]
+SIGNS = ["，", "。", "！", "？", "\n"]
+
+
+def make_text(chars: int, seed: int) -> str:
+    rng = random.Random(seed)
+    parts: list[str] = []
+    length = 0
+    while length < chars:
+        part = rng.choice(WORDS) if rng.random() > 0.2 else rng.choice(SIGNS)
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+class RecordingMetrics(PipelineMetrics):
+    """
+    Keeps the RequestTiming of every request for the tail latency, PipelineMetrics keeps only the recent ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.timings: list[RequestTiming] = []
+
+    def on_request(self, timing: RequestTiming):
+        super().on_request(timing)
+        self.timings.append(timing)
+
+
+async def run(args) -> dict:
+    server = None
+    url = args.url
+    if url == None:
+        server = FakeTTSServer(FakeServerOptions(
+            args.latency_ms, args.jitter_ms, args.speed, args.reject_rate, args.drop_rate, args.seed,
+            args.server_idle_timeout, args.server_capacity))
+        url = await server.start()
+    backend = PooledTTSBackend(url) if args.pool else WebSocketTTSBackend(url)
+    metrics = RecordingMetrics()
+    options = ConvertOptions(
+        concurrency=args.concurrency, chunk_chars=args.chunk_chars,
+        chunk_concurrency=args.chunk_concurrency, retries=args.retries)
+    started: dict[int, float] = {}
+    chapter_times: list[float] = []
+
+    def on_progress(chapter: ChapterProgress):
+        if chapter.state == STATE_RUNNING and chapter.index not in started:
+            started[chapter.index] = perf_counter()
+        elif chapter.state == STATE_DONE:
+            chapter_times.append(perf_counter() - started[chapter.index])
+
+    try:
+        with TemporaryDirectory() as output_dir:
+            engine = TTSEngine(output_dir, options, on_progress, backend=backend, metrics=metrics)
+            chapters = [(f"第{index + 1}章", make_text(args.chapter_chars, index)) for index in range(args.chapters)]
+            start = perf_counter()
+            results = await engine.convert(chapters)
+            elapsed = perf_counter() - start
+            limiter = engine.limiter.stats()
+            audio_s = sum(mp3_duration_ms(path.read_bytes()) for path in Path(output_dir).glob("*.mp3")) / 1000
+    finally:
+        await backend.close()
+        if server != None:
+            await server.stop()
+    done = sum(1 for chapter in results if chapter.state == STATE_DONE)
+    return {
+        "elapsed": elapsed,
+        "done": done,
+        "failed": sum(1 for chapter in results if chapter.state == STATE_FAILED),
+        "audio_s": audio_s,
+        "chapter_times": chapter_times,
+        "backend": backend,
+        "metrics": metrics,
+        "limiter": limiter,
+        "server": server,
+    }
+
+
+def main() -> int:
+    parser = ArgumentParser(description="TTS pipeline benchmark")
+    parser.add_argument("--url", default=None, help="edge-tts protocol server, start the fake server if not set")
+    parser.add_argument("--chapters", type=int, default=40)
+    parser.add_argument("--chapter-chars", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    parser.add_argument("--chunk-concurrency", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--speed", type=float, default=20.0, help="audio seconds streamed per second")
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-idle-timeout", type=float, default=None)
+    parser.add_argument("--server-capacity", type=int, default=None, help="turns the fake server runs at full speed")
+    parser.add_argument("--pool", action="store_true", help="reuse connections with PooledTTSBackend")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    elapsed, audio_s = result["elapsed"], result["audio_s"]
+    backend: TTSBackend = result["backend"]
+    metrics: RecordingMetrics = result["metrics"]
+    succeeded = [timing for timing in metrics.timings if timing.error == ""]
+    print(f"chapters: {result['done']} done, {result['failed']} failed in {elapsed:.2f}s")
+    print(f"chapters/hour: {result['done'] / elapsed * 3600:.0f}")
+    print(f"audio: {audio_s:.1f}s, RTF: {elapsed / max(audio_s, 1e-9):.4f}")
+    for name, values in (
+        ("chapter", result["chapter_times"]),
+        ("request first byte", [timing.first_byte for timing in succeeded]),
+        ("request total", [timing.total for timing in succeeded]),
+    ):
+        print(
+            f"{name:>18} latency ms: p50 {percentile(values, 0.5) * 1000:8.1f}"
+            f"  p95 {percentile(values, 0.95) * 1000:8.1f}  p99 {percentile(values, 0.99) * 1000:8.1f}"
+            f"  max {max(values, default=0) * 1000:8.1f}"
+        )
+    print(f"requests: {len(succeeded)} ok, {metrics.request_errors} failed")
+    limiter = result["limiter"]
+    print(
+        f"limiter: limit {limiter['limit']:.1f}, {limiter['errors']} errors,"
+        f" {limiter['throttled']} throttled, {limiter['retries']} retries"
+    )
+    if isinstance(backend, PooledTTSBackend):
+        stats = backend.stats
+        print(
+            f"pool: {stats.connects} connects, {stats.reuses} reuses,"
+            f" {stats.reconnects} reconnects, {stats.discarded} discarded"
+        )
+    server: FakeTTSServer | None = result["server"]
+    if server != None:
+        stats = server.stats
+        print(
+            f"server: {stats.connections} connections, {stats.turns} turns,"
+            f" {stats.rejected} rejected, {stats.dropped} dropped, {stats.idle_closed} idle closed"
+        )
+    return 1 if result["failed"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import asyncio
+import random
+from typing import AsyncIterator
+import aiohttp
+from edge_tts.typing import TTSChunk
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+from app.metrics import RequestTiming
+from app.tts_backend import TTSBackend
+from benchmarks.fake_tts_server import FRAME_BYTES, FRAME_HEADER, FRAME_MS, make_timeline
+
+
+class FakeBackend(TTSBackend):
+    """
+    In process backend with the timeline of the fake edge-tts server, silent MP3 frames and a WordBoundary per word.
+    Texts containing `fail_on` raise, after `fail_after` successful requests, at most `fail_times` times if not negative.
+    A part of the requests, `reject_rate`, is refused with HTTP 429 like the service does when throttling.
+    """
+
+    def __init__(
+        self, fail_on: str | None = None, fail_after: int = 0, fail_times: int = -1,
+        reject_rate: float = 0.0, latency: float = 0.0, seed: int | None = None,
+    ):
+        self.fail_on = fail_on
+        self.fail_after = fail_after
+        self.fail_times = fail_times
+        self.reject_rate = reject_rate
+        self.latency = latency
+        self.requests: list[str] = []
+        self.rejected = 0
+        self.__rng = random.Random(seed)
+
+    async def stream(
+        self, text: str, voice: str, rate: str, pitch: str, timing: RequestTiming | None = None,
+    ) -> AsyncIterator[TTSChunk]:
+        self.requests.append(text)
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.__rng.random() < self.reject_rate:
+            self.rejected += 1
+            url = URL("ws://fake/")
+            request_info = aiohttp.RequestInfo(url, "GET", CIMultiDictProxy(CIMultiDict()), url)
+            raise aiohttp.WSServerHandshakeError(request_info, (), status=429, message="Too Many Requests")
+        if (
+            self.fail_on != None and self.fail_on in text and len(self.requests) > self.fail_after
+            and self.fail_times != 0
+        ):
+            self.fail_times -= 1
+            raise ConnectionError(f"fake failure: {text[:10]}")
+        words, duration_ms = make_timeline(text)
+        frames = -(-duration_ms // FRAME_MS)
+        yield {"type": "audio", "data": (FRAME_HEADER + bytes(FRAME_BYTES - len(FRAME_HEADER))) * frames}
+        for offset_ms, word_ms, word in words:
+            yield {"type": "WordBoundary", "offset": offset_ms * 10000, "duration": word_ms * 10000, "text": word}
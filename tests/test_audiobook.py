@@ -0,0 +1,109 @@
+import io
+from app.audiobook import (
+    CTOC_MAX_ENTRIES, BookChapter, ChapterMark, assemble_audiobook, iter_frame_runs, make_chapter_tag,
+)
+from app.mp3 import skip_id3v2
+from benchmarks.fake_tts_server import FRAME_BYTES, FRAME_HEADER
+
+FRAME = FRAME_HEADER + bytes(FRAME_BYTES - len(FRAME_HEADER))
+# MPEG-2 layer III at 24kHz
+FRAME_SAMPLES = 576
+
+
+def unsyncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def parse_frames(body: bytes) -> list[tuple[bytes, bytes]]:
+    frames = []
+    pos = 0
+    while pos + 10 <= len(body):
+        size = unsyncsafe(body[pos + 4:pos + 8])
+        frames.append((body[pos:pos + 4], body[pos + 10:pos + 10 + size]))
+        pos += 10 + size
+    assert pos == len(body)
+    return frames
+
+
+def parse_tag(tag: bytes) -> list[tuple[bytes, bytes]]:
+    assert tag[:5] == b"ID3\x04\x00"
+    assert skip_id3v2(tag) == len(tag)
+    return parse_frames(tag[10:])
+
+
+def parse_ctoc(data: bytes) -> tuple[bytes, int, list[bytes], bytes]:
+    element_id, _, rest = data.partition(b"\x00")
+    flags, count = rest[0], rest[1]
+    rest = rest[2:]
+    children = []
+    for _ in range(count):
+        child, _, rest = rest.partition(b"\x00")
+        children.append(child)
+    return element_id, flags, children, rest
+
+
+def test_chapter_tag():
+    marks = [ChapterMark("第1章", 0, 1500), ChapterMark("第2章", 1500, 4000)]
+    frames = parse_tag(make_chapter_tag("书名", marks))
+    assert frames[0] == (b"TIT2", b"\x03" + "书名".encode("utf-8"))
+    chapters = [data for frame_id, data in frames if frame_id == b"CHAP"]
+    assert len(chapters) == 2
+    element_id, _, rest = chapters[1].partition(b"\x00")
+    assert element_id == b"chp1"
+    assert int.from_bytes(rest[0:4], "big") == 1500
+    assert int.from_bytes(rest[4:8], "big") == 4000
+    assert parse_frames(rest[16:]) == [(b"TIT2", b"\x03" + "第2章".encode("utf-8"))]
+    tocs = [parse_ctoc(data) for frame_id, data in frames if frame_id == b"CTOC"]
+    assert len(tocs) == 1
+    element_id, flags, children, _ = tocs[0]
+    assert (element_id, flags, children) == (b"toc", 0x03, [b"chp0", b"chp1"])
+
+
+def test_chapter_tag_groups_long_books():
+    count = CTOC_MAX_ENTRIES * 2 + 10
+    marks = [ChapterMark(str(index), index * 1000, index * 1000 + 1000) for index in range(count)]
+    frames = parse_tag(make_chapter_tag("书名", marks))
+    tocs = [parse_ctoc(data) for frame_id, data in frames if frame_id == b"CTOC"]
+    top = [toc for toc in tocs if toc[1] & 0x02]
+    assert len(top) == 1
+    assert top[0][2] == [b"toc0", b"toc1", b"toc2"]
+    children = [child for toc in tocs if not toc[1] & 0x02 for child in toc[2]]
+    assert children == [f"chp{index}".encode("ascii") for index in range(count)]
+
+
+def test_frame_runs_skip_tag_garbage_and_vbr_header():
+    vbr = FRAME_HEADER + bytes(32) + b"Xing" + bytes(FRAME_BYTES - len(FRAME_HEADER) - 36)
+    tag = make_chapter_tag("书名", [])
+    data = tag + vbr + FRAME * 3 + b"garbage" + FRAME * 2
+    runs = list(iter_frame_runs(io.BytesIO(data)))
+    assert [(run, samples) for run, samples, _ in runs] == [
+        (FRAME * 3, FRAME_SAMPLES * 3), (FRAME * 2, FRAME_SAMPLES * 2),
+    ]
+    assert all(rate == 24000 for _, _, rate in runs)
+
+
+def test_frame_runs_across_buffers(monkeypatch):
+    monkeypatch.setattr("app.audiobook.READ_BUFFER_BYTES", 100)
+    runs = list(iter_frame_runs(io.BytesIO(FRAME * 10)))
+    assert b"".join(run for run, _, _ in runs) == FRAME * 10
+    assert sum(samples for _, samples, _ in runs) == FRAME_SAMPLES * 10
+
+
+def test_assemble_audiobook(tmp_path):
+    chapters = []
+    for index, frames in enumerate([50, 0, 25]):
+        mp3_path = tmp_path / f"{index}.mp3"
+        mp3_path.write_bytes(FRAME * frames)
+        lrc_path = tmp_path / f"{index}.lrc"
+        lrc_path.write_text(f"[00:00.50]第{index + 1}章\n[00:01.00]正文\n", encoding="utf-8")
+        chapters.append(BookChapter(f"第{index + 1}章", mp3_path, lrc_path))
+    book = tmp_path / "book.mp3"
+    marks = assemble_audiobook(chapters, book, "书名", tmp_path / "book.lrc", tmp_path / "book.cue")
+    # 24ms per frame
+    assert marks == [ChapterMark("第1章", 0, 1200), ChapterMark("第2章", 1200, 1200), ChapterMark("第3章", 1200, 1800)]
+    data = book.read_bytes()
+    assert data[skip_id3v2(data):] == FRAME * 75
+    lrc = (tmp_path / "book.lrc").read_text(encoding="utf-8").splitlines()
+    assert lrc[-2:] == ["[00:01.70]第3章", "[00:02.20]正文"]
+    assert "INDEX 01 00:01:15" in (tmp_path / "book.cue").read_text(encoding="utf-8")
+    assert sorted(path.name for path in tmp_path.iterdir() if path.suffix == ".part") == []
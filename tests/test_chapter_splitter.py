@@ -0,0 +1,39 @@
+import pytest
+from app.chapter_splitter import ENCODING_SAMPLE_BYTES, read_span_text, split_chapter_spans
+
+RULE = r"^第\d+章"
+
+
+def make_novel(chapters: int, body: str) -> str:
+    return "".join(f"第{index + 1}章 标题\n{body}\n" for index in range(chapters))
+
+
+def test_split_utf8(tmp_path):
+    path = tmp_path / "novel.txt"
+    path.write_text(make_novel(5, "天地玄黄，宇宙洪荒。" * 20), encoding="utf-8")
+    encoding, spans = split_chapter_spans(RULE, path)
+    assert encoding == "utf-8"
+    assert [span.title for span in spans] == [f"第{index + 1}章 标题" for index in range(5)]
+    assert read_span_text(path, encoding, spans[1].start, spans[1].end).startswith("第2章 标题\n天地玄黄")
+
+
+def test_fall_back_when_a_later_block_does_not_decode(tmp_path):
+    # the sample for the detection is ASCII only, the Chinese text after it is GB18030
+    head = "a" * 99 + "\n"
+    text = head * (ENCODING_SAMPLE_BYTES // len(head) + 1) + make_novel(3, "天地玄黄，宇宙洪荒。" * 20)
+    path = tmp_path / "novel.txt"
+    path.write_bytes(text.encode("gb18030"))
+    encoding, spans = split_chapter_spans(RULE, path)
+    assert encoding == "gb18030"
+    assert spans[-1].title == "第3章 标题"
+    chapter = read_span_text(path, encoding, spans[-1].start, spans[-1].end)
+    assert "�" not in chapter and "宇宙洪荒" in chapter
+
+
+def test_undecodable_file_raises(tmp_path):
+    head = "a" * 99 + "\n"
+    path = tmp_path / "novel.txt"
+    # not valid in any of the encodings
+    path.write_bytes((head * (ENCODING_SAMPLE_BYTES // len(head) + 1)).encode("ascii") + b"\xff\xff\xff\n")
+    with pytest.raises(UnicodeError):
+        split_chapter_spans(RULE, path)
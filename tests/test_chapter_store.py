@@ -0,0 +1,65 @@
+import pytest
+from app.chapter_splitter import split_chapter_spans
+from app.chapter_store import ChapterStore
+
+RULE = r"^第\d+章"
+# chapters shorter than MIN_CHAPTER_CHARS are not split
+BODY1 = "天地玄黄，宇宙洪荒。\r\n" * 10 + "宇宙洪荒"
+BODY2 = "日月盈昃，辰宿列张。\r\n" * 10 + "辰宿列张"
+CHAPTER1 = "第1章 开始\r\n" + BODY1
+CHAPTER2 = "第2章 继续\r\n" + BODY2
+NOVEL = CHAPTER1 + "\r\n" + CHAPTER2 + "\r\n"
+
+
+def make_store(tmp_path, encoding: str = "utf-8") -> ChapterStore:
+    path = tmp_path / "novel.txt"
+    path.write_bytes(NOVEL.encode(encoding))
+    encoding, spans = split_chapter_spans(RULE, path)
+    return ChapterStore(path, encoding, spans)
+
+
+def test_text_of_ranges(tmp_path):
+    store = make_store(tmp_path)
+    assert list(store) == [("第1章 开始", CHAPTER1), ("第2章 继续", CHAPTER2)]
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "gb18030"])
+# in a title, before and after a \r\n, in a line
+@pytest.mark.parametrize("offset", [3, 7, 8, 20])
+def test_split_and_merge_up(tmp_path, encoding, offset):
+    store = make_store(tmp_path, encoding)
+    original = store.text(0)
+    store.split(0, offset)
+    assert len(store) == 3
+    assert store.text(0) + store.text(1) == original
+    assert store.title(1) == ChapterStore.first_line(original[offset:])
+    store.merge_up(1)
+    assert store.text(0) == original
+    assert store.text(1) == CHAPTER2
+
+
+def test_split_at_line_end(tmp_path):
+    store = make_store(tmp_path)
+    # right after the first line break of the body
+    offset = len("第1章 开始\r\n天地玄黄，宇宙洪荒。\r\n")
+    store.split(0, offset)
+    assert store.text(0) == CHAPTER1[:offset]
+    assert store.text(1) == CHAPTER1[offset:]
+    assert store.title(1) == "天地玄黄，宇宙洪荒。"
+
+
+def test_split_edited_chapter(tmp_path):
+    store = make_store(tmp_path)
+    store.set_text(0, "第1章 开始\n玄黄\n洪荒")
+    store.split(0, len("第1章 开始\n玄黄\n"))
+    assert (store.text(0), store.text(1)) == ("第1章 开始\n玄黄\n", "洪荒")
+    store.merge_up(1)
+    assert store.text(0) == "第1章 开始\n玄黄\n洪荒"
+
+
+def test_split_offset_out_of_range(tmp_path):
+    store = make_store(tmp_path)
+    with pytest.raises(ValueError):
+        store.split(0, 0)
+    with pytest.raises(ValueError):
+        store.split(0, len(store.text(0)))
@@ -0,0 +1,35 @@
+import pytest
+from app import cli
+
+
+@pytest.fixture
+def novel(tmp_path):
+    path = tmp_path / "novel.txt"
+    path.write_text("第1章\n天地玄黄\n", encoding="utf-8")
+    return path
+
+
+def fail_if_called(*args, **kwargs):
+    raise AssertionError("the novel is split before the options are checked")
+
+
+@pytest.mark.parametrize("option", [
+    ["--rule", "第("],
+    ["--strip-pattern", "("],
+    ["--voice", "Yunxi"],
+    # without a sign
+    ["--rate", "10%"],
+    ["--rate=-20"],
+])
+def test_bad_options_are_rejected_before_splitting(tmp_path, novel, monkeypatch, capsys, option):
+    monkeypatch.setattr(cli, "split_novel", fail_if_called)
+    monkeypatch.setattr(cli, "run_batch", fail_if_called)
+    assert cli.main(["batch", str(tmp_path), *option]) == cli.EXIT_USAGE
+    assert cli.main(["queue", str(novel), str(tmp_path / "job"), *option]) == cli.EXIT_USAGE
+    assert not (tmp_path / "job").exists()
+    assert capsys.readouterr().err.count(option[0].split("=")[0]) == 2
+
+
+def test_negative_rate_is_accepted(tmp_path, novel, capsys):
+    assert cli.main(["queue", str(novel), str(tmp_path / "job"), "--rate=-20%"]) == cli.EXIT_OK
+    assert (tmp_path / "job").exists()
@@ -0,0 +1,34 @@
+import asyncio
+from textual.app import App
+from textual.widgets import Input, Label
+from app.context import ContextData
+from app.tabs.cut_chapters_tab import CutChaptersTab
+
+
+class TabApp(App):
+    def __init__(self, ctx: ContextData):
+        super().__init__()
+        self.ctx = ctx
+
+    def compose(self):
+        yield CutChaptersTab(self.ctx)
+
+
+def test_preview_of_missing_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("app.tabs.cut_chapters_tab.PREVIEW_DELAY", 0)
+    ctx = ContextData()
+    ctx.selected_txt_path = tmp_path / "removed.txt"
+
+    async def run() -> str:
+        app = TabApp(ctx)
+        async with app.run_test() as pilot:
+            app.query_one("#w_cut_rule_text", Input).value = "^第"
+            label = app.query_one("#w_cut_rule_preview", Label)
+            for _ in range(50):
+                await pilot.pause(0.02)
+                if str(label.render()) != "":
+                    break
+            return str(label.render())
+
+    assert asyncio.run(run()).startswith("无法读取")
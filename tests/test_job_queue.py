@@ -0,0 +1,114 @@
+import asyncio
+from os import listdir, utime
+from time import time
+from app.chapter_splitter import ChapterSpan
+from app.chapter_store import ChapterStore
+import app.job_queue
+from app.job_queue import JobQueue, create_job, run_worker
+from app.tts_engine import ConvertOptions
+from tests.fake_backend import FakeBackend
+
+CHAPTERS = ["第1章\n天地玄黄。\n", "第2章\n宇宙洪荒。\n", "第3章\n日月盈昃。\n"]
+
+
+def make_job(tmp_path, options: ConvertOptions = ConvertOptions()):
+    novel = tmp_path / "novel.txt"
+    data = "".join(CHAPTERS).encode("utf-8")
+    novel.write_bytes(data)
+    spans = []
+    pos = 0
+    for text in CHAPTERS:
+        size = len(text.encode("utf-8"))
+        spans.append(ChapterSpan(text.split("\n")[0], pos, pos + size))
+        pos += size
+    job_dir = tmp_path / "job"
+    assert create_job(job_dir, ChapterStore(novel, "utf-8", spans), options) == len(CHAPTERS)
+    return job_dir
+
+
+def test_a_chapter_is_claimed_once(tmp_path):
+    job_dir = make_job(tmp_path)
+    first = JobQueue(job_dir, "first")
+    second = JobQueue(job_dir, "second")
+    claimed = [first.claim_next(), second.claim_next(), first.claim_next()]
+    assert [task.index for task in claimed] == [0, 1, 2]
+    assert second.claim_next() == None
+    assert first.task_text(claimed[1]) == "第2章\n宇宙洪荒。"
+
+
+def test_stale_lease_is_reclaimed(tmp_path):
+    job_dir = make_job(tmp_path)
+    first = JobQueue(job_dir, "first", lease_timeout=30)
+    second = JobQueue(job_dir, "second", lease_timeout=30)
+    task = first.claim_next()
+    # fresh lease stays
+    assert second.claim_next().index == 1
+    old = time() - 60
+    utime(job_dir / "leases" / task.id, (old, old))
+    assert second.claim_next().id == task.id
+    # the first worker lost it
+    assert not first.heartbeat(task)
+    assert not first.complete(task, {})
+    assert second.complete(task, {"duration_ms": 1.0})
+    assert listdir(job_dir / "done") == [task.id]
+
+
+def test_fail_gives_up_after_max_attempts(tmp_path):
+    job_dir = make_job(tmp_path)
+    queue = JobQueue(job_dir, "worker", max_attempts=2)
+    task = queue.claim_next()
+    queue.fail(task, "error")
+    assert queue.claim_next().id == task.id
+    queue.fail(task, "error")
+    assert listdir(job_dir / "failed") == [task.id]
+    assert queue.remaining() == len(CHAPTERS) - 1
+
+
+def test_run_worker(tmp_path, monkeypatch):
+    # retries of the failing chapter do not wait
+    monkeypatch.setattr("app.tts_engine.backoff_delay", lambda retry: 0)
+    job_dir = make_job(tmp_path)
+    queue = JobQueue(job_dir, "worker", max_attempts=1)
+    stats = asyncio.run(run_worker(queue, FakeBackend(fail_on="宇宙"), concurrency=2, poll=0.01))
+    assert stats == {"done": 2, "failed": 1, "lost": 0, "retried": 0}
+    assert queue.remaining() == 0
+    assert sorted(listdir(job_dir / "output")) == [
+        "0001 第1章.lrc", "0001 第1章.mp3",
+        # the output of the failed chapter is kept aside
+        "0002 第2章.lrc.partial", "0002 第2章.mp3.partial",
+        "0003 第3章.lrc", "0003 第3章.mp3",
+    ]
+
+
+def test_successful_retry_is_not_a_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.tts_engine.backoff_delay", lambda retry: 0)
+    job_dir = make_job(tmp_path)
+    queue = JobQueue(job_dir, "worker", max_attempts=3)
+    # the first attempt fails with all its request retries
+    failures = queue.options.retries + 1
+    stats = asyncio.run(run_worker(queue, FakeBackend(fail_on="宇宙", fail_times=failures), poll=0.01))
+    assert stats == {"done": 3, "failed": 0, "lost": 0, "retried": 1}
+    assert listdir(job_dir / "failed") == []
+
+
+def test_fresh_lease_is_not_stolen(tmp_path, monkeypatch):
+    job_dir = make_job(tmp_path)
+    first = JobQueue(job_dir, "first", lease_timeout=30)
+    second = JobQueue(job_dir, "second", lease_timeout=30)
+    third = JobQueue(job_dir, "third", lease_timeout=30)
+    task = first.claim_next()
+    lease = job_dir / "leases" / task.id
+    old = time() - 60
+    utime(lease, (old, old))
+    rename = app.job_queue.rename
+
+    def claim_between_check_and_rename(src, dst):
+        # the stale lease is released and claimed again by another worker
+        first.release(task)
+        assert third.try_claim(task)
+        rename(src, dst)
+
+    monkeypatch.setattr("app.job_queue.rename", claim_between_check_and_rename)
+    assert not second.reclaim_stale(task, second.server_now())
+    assert third.owns(task)
+    assert third.heartbeat(task)
@@ -0,0 +1,143 @@
+import random
+import pytest
+from app.lrc_maker import LRCLine, LRCMaker, ms_to_lrc_timestamp
+
+WORDS = ["天地", "玄黄", "宇宙", "洪荒", "日月", "盈昃", "辰宿", "列张", "寒", "来", "暑", "往", "Edge", "TTS"]
+SIGNS = ["，", "。", "！", "？", "\n", "\n\n", " ", "“", "”"]
+
+
+class ReferenceLRCMaker:
+    """
+    The LRCMaker before the single pass rework, searches the reference text again for each step.
+    """
+
+    def __init__(self, reference_text = "", stop_ms = -1, cjk_chars_limit = -1):
+        self.lines: list[LRCLine] = []
+        self.ref = reference_text
+        self.ref_pos = 0
+        self.stop_ms = stop_ms
+        self.ch_lmt = cjk_chars_limit
+
+    def update_ref_pos(self, text: str, word_pos = -1):
+        if self.ref != "":
+            if word_pos < 0:
+                word_pos = self.ref.find(text, self.ref_pos)
+            self.ref_pos = word_pos + len(text)
+        else:
+            self.ref_pos = self.ref_pos + len(text)
+
+    def feed_edge_tts_chunk(self, chunk: dict):
+        offset = chunk["offset"] // 10000
+        duration = chunk["duration"] // 10000
+        text = chunk["text"]
+        if len(self.lines) <= 0:
+            self.lines.append(LRCLine(offset, duration, text))
+            self.update_ref_pos(text)
+            return
+        last_line = self.lines[len(self.lines) - 1]
+        flag_need_break = False
+        word_pos = -1
+        if self.ref != "":
+            word_pos = self.ref.find(text, self.ref_pos)
+            if word_pos - self.ref_pos > 0:
+                text_between = self.ref[self.ref_pos : word_pos]
+                flag_need_break = True
+                if text_between.strip(" ") == "":
+                    flag_need_break = False
+                if self.stop_ms > 0:
+                    last_offset = offset - (last_line.offset_ms + last_line.duration_ms)
+                    if last_offset < self.stop_ms:
+                        flag_need_break = False
+        if self.stop_ms > 0:
+            last_offset = offset - (last_line.offset_ms + last_line.duration_ms)
+            if last_offset >= self.stop_ms:
+                flag_need_break = True
+        if self.ch_lmt > 0:
+            last_count = sum( (0.5 if ord(ch) < 0xFF else 1) for ch in last_line.text )
+            current_count = sum( (0.5 if ord(ch) < 0xFF else 1) for ch in text )
+            if self.ch_lmt < last_count + current_count:
+                flag_need_break = True
+        if flag_need_break:
+            new_line = LRCLine(offset, duration, text)
+            if self.ref != "":
+                word_pos = self.ref.find(text, self.ref_pos)
+                words_between = self.ref[self.ref_pos : word_pos]
+                if words_between.find("\n") >= 0:
+                    pos_last_line = words_between.find("\n")
+                    last_line.text = last_line.text + words_between[:pos_last_line]
+                    pos_next_line = words_between.rfind("\n")
+                    new_line.text = words_between[pos_next_line + 1:] + new_line.text
+                else:
+                    last_line.text = last_line.text + words_between
+            self.lines.append(new_line)
+            self.update_ref_pos(text, word_pos)
+            return
+        last_line.duration_ms = (offset + duration) - last_line.offset_ms
+        if self.ref != "":
+            word_pos = self.ref.find(text, self.ref_pos)
+            last_line.text = last_line.text + self.ref[self.ref_pos : word_pos + len(text)]
+            self.update_ref_pos(text, word_pos)
+        else:
+            if all( (ord(ch) < 0xFF) for ch in text ):
+                last_line.text = last_line.text + " "
+            last_line.text = last_line.text + text
+            self.update_ref_pos(text)
+
+    def get_lrc(self) -> str:
+        lrc_text = "\r\n".join(
+            f"[{ms_to_lrc_timestamp(line.offset_ms)}]{line.text.strip().replace(chr(13), '').replace(chr(10), '')}"
+            for line in self.lines
+        )
+        if self.ref_pos < len(self.ref) - 1:
+            lrc_text = lrc_text + self.ref[self.ref_pos:].strip()
+        return lrc_text
+
+
+def make_chapter(words: int, seed: int, sign_rate: float = 0.3) -> tuple[str, list[dict]]:
+    """
+    Returns reference text and WordBoundary messages like edge-tts does, 100ns unit.
+    Lower sign_rate gives longer lines.
+    """
+    rng = random.Random(seed)
+    parts: list[str] = []
+    chunks: list[dict] = []
+    time_ms = rng.randint(0, 100)
+    for _ in range(words):
+        word = rng.choice(WORDS)
+        parts.append(word)
+        duration = rng.randint(50, 200) * len(word)
+        chunks.append({"type": "WordBoundary", "offset": time_ms * 10000, "duration": duration * 10000, "text": word})
+        time_ms += duration + rng.choice([0, 0, 20, 150, 400])
+        if rng.random() < sign_rate:
+            parts.append(rng.choice(SIGNS))
+    if rng.random() < 0.5:
+        parts.append(rng.choice(["。", "！”", "\n"]))
+    return "".join(parts), chunks
+
+
+@pytest.mark.parametrize("stop_ms, cjk_chars_limit", [(-1, -1), (100, -1), (-1, 10), (100, 8), (300, 20)])
+@pytest.mark.parametrize("seed", range(20))
+def test_same_lrc_as_reference(seed: int, stop_ms: int, cjk_chars_limit: int):
+    ref, chunks = make_chapter(300, seed)
+    expected = ReferenceLRCMaker(ref, stop_ms, cjk_chars_limit)
+    actual = LRCMaker(ref, stop_ms, cjk_chars_limit)
+    for chunk in chunks:
+        expected.feed_edge_tts_chunk(chunk)
+        actual.feed_edge_tts_chunk(chunk)
+    assert actual.get_lrc() == expected.get_lrc()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_same_lrc_as_reference_without_reference_text(seed: int):
+    _, chunks = make_chapter(200, seed)
+    expected = ReferenceLRCMaker()
+    actual = LRCMaker()
+    for chunk in chunks:
+        expected.feed_edge_tts_chunk(chunk)
+        actual.feed_edge_tts_chunk(chunk)
+    assert actual.get_lrc() == expected.get_lrc()
+
+
+def test_rejects_other_messages():
+    with pytest.raises(ValueError):
+        LRCMaker("天地").feed_edge_tts_chunk({"type": "audio", "data": b""})
@@ -0,0 +1,43 @@
+"""
+Benchmarks of LRCMaker alignment, run with pytest-benchmark installed:
+
+    python -m pytest tests/test_lrc_maker_bench.py --benchmark-only
+
+The time per word should not grow with the chapter length, compare the groups of 1000 and 10000 words.
+"""
+import pytest
+from app.lrc_maker import LRCMaker
+from tests.test_lrc_maker import ReferenceLRCMaker, make_chapter
+
+pytest.importorskip("pytest_benchmark")
+
+
+def align(maker_class, ref: str, chunks: list[dict], stop_ms: int, cjk_chars_limit: int) -> str:
+    maker = maker_class(ref, stop_ms, cjk_chars_limit)
+    for chunk in chunks:
+        maker.feed_edge_tts_chunk(chunk)
+    return maker.get_lrc()
+
+
+@pytest.mark.parametrize("words", [1000, 10000])
+@pytest.mark.parametrize("stop_ms, cjk_chars_limit", [(100, -1), (100, 10), (-1, 100000)])
+def test_bench_lrc_maker(benchmark, words: int, stop_ms: int, cjk_chars_limit: int):
+    ref, chunks = make_chapter(words, 0)
+    benchmark.group = f"stop_ms={stop_ms} cjk_chars_limit={cjk_chars_limit} words={words}"
+    benchmark(align, LRCMaker, ref, chunks, stop_ms, cjk_chars_limit)
+
+
+@pytest.mark.parametrize("words", [1000, 10000])
+def test_bench_lrc_maker_without_punctuation(benchmark, words: int):
+    # the whole chapter is one line until the character limit
+    ref, chunks = make_chapter(words, 0, sign_rate=0.0)
+    benchmark.group = f"no punctuation words={words}"
+    benchmark(align, LRCMaker, ref, chunks, -1, 100000)
+
+
+@pytest.mark.parametrize("words", [1000, 10000])
+@pytest.mark.parametrize("stop_ms, cjk_chars_limit", [(100, -1), (100, 10), (-1, 100000)])
+def test_bench_reference(benchmark, words: int, stop_ms: int, cjk_chars_limit: int):
+    ref, chunks = make_chapter(words, 0)
+    benchmark.group = f"stop_ms={stop_ms} cjk_chars_limit={cjk_chars_limit} words={words}"
+    benchmark(align, ReferenceLRCMaker, ref, chunks, stop_ms, cjk_chars_limit)
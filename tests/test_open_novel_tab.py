@@ -0,0 +1,35 @@
+import asyncio
+import inspect
+from textual.app import App
+from textual.widgets import DirectoryTree
+from app.tabs.open_novel_tab import FilteredDirectoryTree
+
+
+def test_overridden_textual_methods_exist():
+    # FilteredDirectoryTree overrides these private methods, a Textual upgrade must keep them
+    assert list(inspect.signature(DirectoryTree._directory_content).parameters) == ["self", "location", "worker"]
+    assert isinstance(inspect.getattr_static(DirectoryTree, "_safe_is_dir"), staticmethod)
+    assert list(inspect.signature(DirectoryTree._safe_is_dir).parameters) == ["path"]
+
+
+def test_lists_directories_and_txt_files(tmp_path):
+    (tmp_path / "book").mkdir()
+    (tmp_path / "novel.txt").write_text("第1章", encoding="utf-8")
+    (tmp_path / "cover.jpg").write_bytes(b"")
+    (tmp_path / ".hidden.txt").write_text("", encoding="utf-8")
+
+    class TreeApp(App):
+        def compose(self):
+            yield FilteredDirectoryTree(tmp_path)
+
+    async def run() -> list[str]:
+        app = TreeApp()
+        async with app.run_test() as pilot:
+            tree = app.query_one(FilteredDirectoryTree)
+            for _ in range(50):
+                await pilot.pause(0.02)
+                if len(tree.root.children) > 0:
+                    break
+            return sorted(str(node.label) for node in tree.root.children)
+
+    assert asyncio.run(run()) == ["book", "novel.txt"]
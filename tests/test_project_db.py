@@ -0,0 +1,86 @@
+import sqlite3
+import pytest
+from app.chapter_splitter import split_chapter_spans
+from app.chapter_store import ChapterStore
+from app.context import ContextData
+from app.project_db import ProjectDB, SynthesisRecord
+
+
+# chapters shorter than MIN_CHAPTER_CHARS are not split
+CHAPTER1 = "第1章\n" + "天地玄黄，宇宙洪荒。\n" * 10 + "天地玄黄"
+CHAPTER2 = "第2章\n" + "日月盈昃，辰宿列张。\n" * 10 + "宇宙洪荒"
+
+
+@pytest.fixture
+def novel(tmp_path):
+    path = tmp_path / "novel.txt"
+    path.write_text(f"{CHAPTER1}\n{CHAPTER2}\n", encoding="utf-8")
+    return path
+
+
+def make_store(path) -> ChapterStore:
+    encoding, spans = split_chapter_spans(r"^第\d+章", path)
+    return ChapterStore(path, encoding, spans)
+
+
+def test_source_path_is_absolute(tmp_path, novel, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    project = ProjectDB(tmp_path / "project.db")
+    project.save_source("novel.txt", "utf-8", "rule")
+    assert project.source().path == str(novel.resolve())
+    monkeypatch.chdir("/")
+    assert project.source_matches(project.source().path)
+    project.close()
+
+
+def test_chapters_round_trip(tmp_path, novel):
+    project = ProjectDB(tmp_path / "project.db")
+    project.save_source(novel, "utf-8", "rule")
+    store = make_store(novel)
+    assert store.text(0) == CHAPTER1
+    store.set_text(1, "第2章\n改过的文本")
+    project.save_chapters(store)
+    loaded = project.load_chapters(novel)
+    assert [loaded.title(index) for index in range(len(loaded))] == ["第1章", "第2章"]
+    assert loaded.text(0) == CHAPTER1
+    assert loaded.text(1) == "第2章\n改过的文本"
+    novel.write_text("另一本小说", encoding="utf-8")
+    assert project.load_chapters(novel) == None
+    project.close()
+
+
+def test_synthesis_record(tmp_path):
+    project = ProjectDB(tmp_path / "project.db")
+    (tmp_path / "0001 a.mp3").write_bytes(b"mp3")
+    (tmp_path / "0001 a.lrc").write_bytes(b"lrc!")
+    project.save_synthesis(SynthesisRecord("0001 a", "key", "done", 3, 4, 1000.0))
+    assert project.is_synthesized(tmp_path, "0001 a", "key", "done")
+    assert not project.is_synthesized(tmp_path, "0001 a", "other", "done")
+    (tmp_path / "0001 a.lrc").write_bytes(b"changed")
+    assert not project.is_synthesized(tmp_path, "0001 a", "key", "done")
+    project.close()
+
+
+def test_context_closes_the_previous_project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ctx = ContextData()
+    ctx.selected_txt_path = tmp_path / "a.txt"
+    first = ctx.open_project(create=True)
+    ctx.selected_txt_path = tmp_path / "b.txt"
+    ctx.open_project(create=True)
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.source()
+
+
+def test_held_project_is_closed_after_release(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ctx = ContextData()
+    ctx.selected_txt_path = tmp_path / "a.txt"
+    first = ctx.open_project(create=True)
+    first.hold()
+    ctx.selected_txt_path = tmp_path / "b.txt"
+    ctx.open_project(create=True)
+    assert first.source() == None
+    first.release()
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.source()
@@ -0,0 +1,66 @@
+import pytest
+import re
+from app.text_normalizer import FULLWIDTH_TABLE, NormalizedText, TextNormalizer, get_normalizer
+from app.tts_engine import ConvertOptions, chapter_key, normalize_chapter_text
+
+
+def check_positions(original: str, normalized: NormalizedText):
+    folded = original.translate(FULLWIDTH_TABLE)
+    for pos, ch in enumerate(normalized.text):
+        mapped = folded[normalized.positions[pos]]
+        # a merged run of spaces maps to its first character
+        assert mapped == ch or (ch == " " and mapped.isspace()), pos
+    assert normalized.to_original(len(normalized.text)) == len(original)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("　　天地玄黄\n\n　　宇宙洪荒", "天地玄黄\n宇宙洪荒"),
+    ("天地  玄黄\t\t宇宙", "天地 玄黄 宇宙"),
+    ("ＶＩＰ章节２０２４", "VIP章节2024"),
+    ("天地\n------\n玄黄", "天地\n玄黄"),
+    # a line of dots or dashes is a pause, not a separator
+    ("天地\n......\n玄黄", "天地\n...\n玄黄"),
+    ("天地\n——————\n玄黄", "天地\n——\n玄黄"),
+    ("“你……”\n　　…………\n玄黄", "“你……”\n……\n玄黄"),
+    ("什么！！！真的？？", "什么！真的？"),
+    ("天地……………玄黄——————", "天地……玄黄——"),
+    # ellipses keep three dots
+    ("天地......玄黄。。。。。。宇宙...洪荒。。。", "天地...玄黄。。。宇宙...洪荒。。。"),
+    ("天地。。玄黄..", "天地。。玄黄.."),
+    ("天地玄黄。\n宇宙洪荒。", "天地玄黄。\n宇宙洪荒。"),
+])
+def test_normalize(text, expected):
+    normalized = TextNormalizer().normalize(text)
+    assert normalized.text == expected
+    check_positions(text, normalized)
+
+
+def test_strip_patterns_are_compiled_alone():
+    normalizer = TextNormalizer([r"(?i)www\.\w+\.com", r"(广告)\1", r"^请收藏$"])
+    text = "天地\nWWW.Example.COM 最新章节\n\n玄黄\n广告广告\n请收藏\n宇宙 请收藏\n洪荒"
+    normalized = normalizer.normalize(text)
+    assert normalized.text == "天地\n玄黄\n宇宙 请收藏\n洪荒"
+    check_positions(text, normalized)
+    assert normalizer.strip_lines(text).text == "天地\n玄黄\n宇宙 请收藏\n洪荒"
+    assert normalizer.strip_lines("天地玄黄") == None
+
+
+def test_invalid_strip_pattern_raises():
+    with pytest.raises(re.error):
+        TextNormalizer(["(广告"])
+
+
+def test_normalize_is_off_by_default():
+    text = "　　天地玄黄\n\n　　宇宙洪荒"
+    assert normalize_chapter_text(text, ConvertOptions()) == None
+    # keys of the chapters converted before stay the same
+    assert chapter_key(text, ConvertOptions()) != chapter_key(text, ConvertOptions(normalize=True))
+    stripped = normalize_chapter_text("天地\n广告\n玄黄", ConvertOptions(strip_patterns=("广告",)))
+    assert stripped.text == "天地\n玄黄"
+
+
+def test_chapter_key_uses_given_normalization():
+    options = ConvertOptions(normalize=True)
+    text = "　　天地玄黄"
+    normalized = get_normalizer().normalize(text.strip())
+    assert chapter_key(text, options, normalized) == chapter_key(text, options)
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from app import edge_tts_internals
+from app.tts_backend import PooledTTSBackend, TTSBackend, WebSocketTTSBackend
+from benchmarks.fake_tts_server import FakeServerOptions, FakeTTSServer
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        TTSBackend()
+
+
+def test_websocket_backend_checks_edge_tts_version(monkeypatch):
+    WebSocketTTSBackend("ws://127.0.0.1:1")
+    monkeypatch.setattr(edge_tts_internals.edge_tts, "__version__", "0.0.1")
+    with pytest.raises(RuntimeError):
+        WebSocketTTSBackend("ws://127.0.0.1:1")
+
+
+async def speak(backend: TTSBackend, text: str = "天地玄黄") -> tuple[int, int]:
+    """
+    Returns the audio bytes and the WordBoundary messages received.
+    """
+    audio = 0
+    words = 0
+    async for chunk in backend.stream(text, "zh-CN-YunxiNeural", "+0%", "+0Hz"):
+        if chunk["type"] == "audio":
+            audio += len(chunk["data"])
+        else:
+            words += 1
+    return audio, words
+
+
+def fast_server(**kwargs) -> FakeTTSServer:
+    return FakeTTSServer(FakeServerOptions(latency_ms=0, jitter_ms=0, speed=1000.0, seed=0, **kwargs))
+
+
+def test_pool_reuses_connection():
+    async def run():
+        server = fast_server()
+        backend = PooledTTSBackend(await server.start())
+        try:
+            assert (await speak(backend))[1] == 4
+            assert (await speak(backend))[1] == 4
+        finally:
+            await backend.close()
+            await server.stop()
+        return backend.stats, server.stats
+
+    stats, server_stats = asyncio.run(run())
+    assert (stats.connects, stats.reuses, stats.reconnects) == (1, 1, 0)
+    assert server_stats.connections == 1
+
+
+def test_pool_discards_connection_idle_too_long():
+    async def run():
+        server = fast_server()
+        backend = PooledTTSBackend(await server.start(), idle_timeout=0.05)
+        try:
+            await speak(backend)
+            await asyncio.sleep(0.1)
+            assert (await speak(backend))[1] == 4
+        finally:
+            await backend.close()
+            await server.stop()
+        return backend.stats
+
+    stats = asyncio.run(run())
+    assert (stats.connects, stats.reuses, stats.discarded) == (2, 0, 1)
+
+
+def test_pool_reconnects_after_server_idle_timeout():
+    async def run():
+        # the server closes idle connections before the pool considers them stale
+        server = fast_server(idle_timeout=0.05)
+        backend = PooledTTSBackend(await server.start(), idle_timeout=60)
+        try:
+            await speak(backend)
+            await asyncio.sleep(0.2)
+            assert (await speak(backend))[1] == 4
+        finally:
+            await backend.close()
+            await server.stop()
+        return backend.stats, server.stats
+
+    stats, server_stats = asyncio.run(run())
+    assert stats.connects == 2
+    # the closed connection is only noticed when the request is sent on it, then sent again on a new one
+    assert (stats.connects, stats.reuses, stats.reconnects) == (2, 1, 1)
+    assert server_stats.idle_closed == 1
+
+
+def test_pool_reconnects_after_dropped_socket():
+    async def run():
+        server = fast_server()
+        url = await server.start()
+        backend = PooledTTSBackend(url)
+        try:
+            await speak(backend)
+            # the server restarts, the idle connection is dropped
+            await server.stop()
+            server = FakeTTSServer(server.options, port=server.port)
+            await server.start()
+            assert (await speak(backend))[1] == 4
+        finally:
+            await backend.close()
+            await server.stop()
+        return backend.stats
+
+    stats = asyncio.run(run())
+    assert stats.connects == 2
+    # the closed connection is only noticed when the request is sent on it, then sent again on a new one
+    assert (stats.connects, stats.reuses, stats.reconnects) == (2, 1, 1)
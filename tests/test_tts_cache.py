@@ -0,0 +1,66 @@
+from os import listdir, utime
+from time import time
+from app.tts_cache import STALE_TMP_SECONDS, SynthesisCache, unique_tmp_path
+
+BOUNDARIES = [{"type": "WordBoundary", "offset": 0, "duration": 10000, "text": "天"}]
+
+
+def make_old(path):
+    old = time() - STALE_TMP_SECONDS - 10
+    utime(path, (old, old))
+
+
+def test_put_and_get(tmp_path):
+    cache = SynthesisCache(tmp_path)
+    key = SynthesisCache.make_key("天地", "voice", "+0%", "+0Hz")
+    assert cache.get(key) == None
+    cache.put(key, b"mp3", BOUNDARIES)
+    assert cache.get(key) == (b"mp3", BOUNDARIES)
+    # no temporary file is left
+    assert sorted(listdir(tmp_path)) == [f"{key}.json", f"{key}.mp3"]
+    assert SynthesisCache(tmp_path).get(key) == (b"mp3", BOUNDARIES)
+
+
+def test_key_ignores_line_breaks_around_text():
+    assert SynthesisCache.make_key("天地\r\n", "v", "r", "p") == SynthesisCache.make_key("天地", "v", "r", "p")
+    assert SynthesisCache.make_key("天地", "v", "r", "p") != SynthesisCache.make_key("天地", "v2", "r", "p")
+
+
+def test_tmp_paths_are_unique(tmp_path):
+    assert unique_tmp_path(tmp_path / "a.mp3") != unique_tmp_path(tmp_path / "a.mp3")
+    assert unique_tmp_path(tmp_path / "a.mp3", "part").endswith(".part")
+
+
+def test_keeps_files_other_processes_are_writing(tmp_path):
+    writing = tmp_path / f"{'a' * 64}.mp3.123-abcd.tmp"
+    writing.write_bytes(b"mp3")
+    half = tmp_path / f"{'b' * 64}.mp3"
+    half.write_bytes(b"mp3")
+    SynthesisCache(tmp_path)
+    assert writing.exists()
+    assert half.exists()
+
+
+def test_removes_stale_files(tmp_path):
+    stale = tmp_path / f"{'a' * 64}.mp3.123-abcd.tmp"
+    stale.write_bytes(b"mp3")
+    make_old(stale)
+    half = tmp_path / f"{'b' * 64}.mp3"
+    half.write_bytes(b"mp3")
+    make_old(half)
+    cache = SynthesisCache(tmp_path)
+    assert listdir(tmp_path) == []
+    assert cache.total_bytes == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = SynthesisCache(tmp_path, max_bytes=600)
+    keys = [SynthesisCache.make_key(str(index), "v", "r", "p") for index in range(3)]
+    cache.put(keys[0], b"0" * 200, [])
+    cache.put(keys[1], b"1" * 200, [])
+    cache.get(keys[0])
+    cache.put(keys[2], b"2" * 200, [])
+    assert cache.get(keys[1]) == None
+    assert cache.get(keys[0]) != None
+    assert cache.get(keys[2]) != None
+    assert cache.total_bytes <= 600
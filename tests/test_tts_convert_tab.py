@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from textual.app import App
+from textual.widgets import Input
+from app.chapter_splitter import ChapterSpan
+from app.chapter_store import ChapterStore
+from app.context import ContextData, MainAppEvent
+from app.tabs.tts_convert import TTSConvertTab
+
+
+class TabApp(App):
+    def __init__(self, ctx: ContextData):
+        super().__init__()
+        self.ctx = ctx
+        self.status: list[str] = []
+
+    def compose(self):
+        yield TTSConvertTab(self.ctx)
+
+    def on_main_app_event_set_status_text(self, event: MainAppEvent.SetStatusText):
+        self.status.append(event.text)
+
+
+def run_with_concurrency(tmp_path, value: str, start: bool = False) -> tuple[TabApp, object]:
+    ctx = ContextData()
+    ctx.selected_txt_path = tmp_path / "novel.txt"
+    ctx.chapters = ChapterStore(None, "utf-8", [ChapterSpan("第1章", 0, 0)])
+
+    async def run():
+        app = TabApp(ctx)
+        async with app.run_test() as pilot:
+            tab = app.query_one(TTSConvertTab)
+            app.query_one("#w_tts_concurrency", Input).value = value
+            if start:
+                await pilot.click("#w_tts_start")
+                await pilot.pause()
+                return app, tab.engine
+            try:
+                return app, tab.get_options().concurrency
+            except ValueError as e:
+                return app, e
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("value, expected", [("", 4), ("8", 8), ("0", 1), ("-3", 1)])
+def test_concurrency_is_at_least_one(tmp_path, value, expected):
+    assert run_with_concurrency(tmp_path, value)[1] == expected
+
+
+@pytest.mark.parametrize("value", ["-", "1.5"])
+def test_bad_concurrency_is_reported(tmp_path, value):
+    assert isinstance(run_with_concurrency(tmp_path, value)[1], ValueError)
+    app, engine = run_with_concurrency(tmp_path, value, start=True)
+    assert engine == None
+    assert app.status == [f"并发数不是整数: {value}"]
@@ -0,0 +1,46 @@
+import asyncio
+from io import StringIO
+from os import listdir
+from app.lrc_maker import LRCLine, SubtitleWriter
+from app.tts_engine import PARTIAL_SUFFIX, ConvertOptions, synthesize_chapter
+from tests.fake_backend import FakeBackend
+
+TEXT = "\n".join(f"第{index}段，天地玄黄，宇宙洪荒。日月盈昃，辰宿列张。" for index in range(1, 9))
+OPTIONS = ConvertOptions(chunk_chars=40, chunk_concurrency=1, retries=0, subtitle_formats=("srt",))
+
+
+def test_synthesize_chapter(tmp_path):
+    backend = FakeBackend()
+    duration_ms = asyncio.run(synthesize_chapter(
+        TEXT, tmp_path / "a.mp3", tmp_path / "a.lrc", OPTIONS, backend=backend))
+    assert len(backend.requests) > 1
+    assert duration_ms > 0
+    assert sorted(listdir(tmp_path)) == ["a.lrc", "a.mp3", "a.srt"]
+    lrc = (tmp_path / "a.lrc").read_text(encoding="utf-8")
+    assert "第8段" in lrc and lrc.splitlines()[-1].endswith("辰宿列张")
+
+
+def test_failed_chapter_keeps_the_finished_part(tmp_path):
+    backend = FakeBackend(fail_on="第8段")
+    try:
+        asyncio.run(synthesize_chapter(TEXT, tmp_path / "a.mp3", tmp_path / "a.lrc", OPTIONS, backend=backend))
+        assert False, "the last chunk fails"
+    except ConnectionError:
+        pass
+    assert sorted(listdir(tmp_path)) == [f"a.{suffix}.{PARTIAL_SUFFIX}" for suffix in ("lrc", "mp3", "srt")]
+    # the chunks before the failed one are written and aligned
+    assert (tmp_path / f"a.mp3.{PARTIAL_SUFFIX}").stat().st_size > 0
+    assert "第1段" in (tmp_path / f"a.lrc.{PARTIAL_SUFFIX}").read_text(encoding="utf-8")
+    asyncio.run(synthesize_chapter(TEXT, tmp_path / "a.mp3", tmp_path / "a.lrc", OPTIONS, backend=FakeBackend()))
+    assert sorted(listdir(tmp_path)) == ["a.lrc", "a.mp3", "a.srt"]
+
+
+def test_srt_numbers_skip_empty_lines():
+    buffer = StringIO()
+    writer = SubtitleWriter(buffer, "srt")
+    writer.write_line(LRCLine(0, 1000, "天地"))
+    writer.write_line(LRCLine(1000, 500, "  "))
+    writer.write_line(LRCLine(1500, 1000, "玄黄"))
+    blocks = buffer.getvalue().strip().split("\r\n\r\n")
+    assert [block.split("\r\n")[0] for block in blocks] == ["1", "2"]
+    assert blocks[1].split("\r\n")[2] == "玄黄"
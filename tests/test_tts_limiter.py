@@ -0,0 +1,75 @@
+import asyncio
+import aiohttp
+import pytest
+from app.tts_engine import ConvertOptions, synthesize_chunk_with_retry
+from app.tts_limiter import AdaptiveLimiter, backoff_delay
+from tests.fake_backend import FakeBackend
+
+OPTIONS = ConvertOptions(retries=0)
+
+
+async def run_requests(limiter: AdaptiveLimiter, backend: FakeBackend, count: int) -> list[float]:
+    """
+    Runs count requests at once, returns the limit after each one.
+    """
+    limits: list[float] = []
+
+    async def request(index: int):
+        try:
+            await synthesize_chunk_with_retry(f"天地玄黄{index}", OPTIONS, backend, limiter)
+        except aiohttp.WSServerHandshakeError:
+            pass
+        limits.append(limiter.limit)
+
+    await asyncio.gather(*[request(index) for index in range(count)])
+    return limits
+
+
+@pytest.mark.parametrize("retry", range(8))
+def test_backoff_delay_is_capped(retry):
+    assert 0 <= backoff_delay(retry, base=1.0, cap=10.0) <= min(10.0, 2 ** retry)
+
+
+def test_throttling_halves_the_limit():
+    limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=16, cooldown=0)
+    backend = FakeBackend(reject_rate=1.0)
+    asyncio.run(run_requests(limiter, backend, 1))
+    assert limiter.limit == 4
+    assert limiter.throttled == 1
+    asyncio.run(run_requests(limiter, backend, 1))
+    assert limiter.limit == 2
+
+
+def test_burst_of_errors_within_cooldown_counts_once():
+    limiter = AdaptiveLimiter(initial=8, max_limit=16, cooldown=60)
+    asyncio.run(run_requests(limiter, FakeBackend(reject_rate=1.0), 4))
+    assert limiter.limit == 4
+    assert limiter.throttled == 4
+
+
+def test_limit_stays_above_min():
+    limiter = AdaptiveLimiter(initial=4, min_limit=2, max_limit=16, cooldown=0)
+    limits = asyncio.run(run_requests(limiter, FakeBackend(reject_rate=1.0), 10))
+    assert min(limits) == 2
+
+
+def test_success_grows_the_limit_additively_up_to_max():
+    # latency jitter of a busy machine must not look like an overloaded service
+    limiter = AdaptiveLimiter(initial=2, min_limit=1, max_limit=4, latency_tolerance=100)
+    limits = asyncio.run(run_requests(limiter, FakeBackend(latency=0.01), 40))
+    # about one for each full round of requests, never a jump
+    steps = [after - before for before, after in zip([2.0] + limits, limits)]
+    assert all(0 <= step <= 0.5 for step in steps)
+    assert limits[-1] == 4
+
+
+def test_limit_recovers_after_throttling_within_bounds():
+    limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=8, cooldown=0)
+    backend = FakeBackend(reject_rate=0.2, latency=0.01, seed=1)
+    limits = asyncio.run(run_requests(limiter, backend, 200))
+    assert backend.rejected > 0
+    assert limiter.throttled == backend.rejected
+    assert all(1 <= limit <= 8 for limit in limits)
+    # halved on throttling, grown back on success
+    assert min(limits) < 8
+    assert any(after > before for before, after in zip(limits, limits[1:]))